@@ -144,7 +144,7 @@ class ComfyClient:
 
     def __handle_response_message(self, message):
         if message["type"] == "status":
-            self.log(message["data"]["status"])
+            self.log(message["data"]["status"], level="debug")
         elif message["type"] == "progress":
             self.logger.progress_bar(
                 message["data"]["value"],
@@ -154,7 +154,7 @@ class ComfyClient:
             )
         if message["type"] == "executing":
             cur_node_name = self.workflow.parse_node_name(message["data"])
-            self.log(f"Executing Node: {cur_node_name}")
+            self.log(f"Executing Node: {cur_node_name}", level="debug")
 
             if (
                 message["data"]["node"] is None
@@ -0,0 +1,342 @@
+"""
+Stand-in for the Comfy server, for running the pipeline end to end without ComfyUI or a GPU.
+
+Implements the parts of the Comfy server API that the pipeline uses: POST /prompt, the /ws
+message protocol (status, execution_start, executing, progress, executed, execution_error),
+GET /queue, GET /history/<prompt_id>, POST /upload/image, GET /view and GET /system_stats.
+
+Workflows are not really executed. The nodes are "executed" in ID order:
+    - LoadImage nodes load their image from the input directory.
+    - KSampler nodes send progress messages and sleep, so that a prompt takes --latency seconds.
+    - SaveImage/PreviewImage nodes save the loaded image with its transparent pixels filled in
+      (OpenCV Telea inpainting), so the result is deterministic. SaveImage nodes whose title
+      contains "alpha" save an RGBA cutout of an ellipse in the lower middle of the image instead,
+      as a stand-in for a segmented salient object. Filename prefixes (including subfolders) are
+      honored the same way Comfy does.
+
+Launched by ComfyServer when the project config has "mock_comfy_server": true, or by hand:
+    python src/comfy_api/mock_server.py --port 8188 --latency 0.5
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import struct
+import hashlib
+import argparse
+import tempfile
+import threading
+import queue
+from urllib.parse import urlparse, parse_qs
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import cv2
+from PIL import Image
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class MockComfyState:
+    """Directories, connected websockets, prompt queue and history shared by the request handlers."""
+
+    def __init__(self, input_directory, output_directory, latency):
+        self.input_directory = input_directory
+        self.output_directory = output_directory
+        self.temp_directory = tempfile.mkdtemp(prefix="mock_comfy_temp_")
+        self.latency = latency
+        self.websockets = {}  # client_id -> MockComfyHandler
+        self.history = {}
+        self.queued = {}  # prompt_id -> client_id of the prompts that are queued or running
+        self.prompt_queue = queue.Queue()
+        self.lock = threading.Lock()
+        for directory in (self.input_directory, self.output_directory):
+            os.makedirs(directory, exist_ok=True)
+        threading.Thread(target=self.__execute_loop, daemon=True).start()
+
+    def send(self, client_id, message_type, data):
+        handler = self.websockets.get(client_id)
+        if handler:
+            handler.send_websocket_text(json.dumps({"type": message_type, "data": data}))
+
+    def get_directory(self, folder_type):
+        return {
+            "input": self.input_directory,
+            "output": self.output_directory,
+            "temp": self.temp_directory,
+        }[folder_type]
+
+    def __execute_loop(self):
+        while True:
+            prompt_id, prompt, client_id = self.prompt_queue.get()
+            self.send(client_id, "status", {"status": {"exec_info": {"queue_remaining": self.prompt_queue.qsize()}}})
+            self.send(client_id, "execution_start", {"prompt_id": prompt_id})
+            try:
+                outputs = self.__execute(prompt_id, prompt, client_id)
+                self.history[prompt_id] = {
+                    "prompt": prompt,
+                    "outputs": outputs,
+                    "status": {"status_str": "success", "completed": True},
+                }
+            except Exception as e:
+                self.history[prompt_id] = {
+                    "prompt": prompt,
+                    "outputs": {},
+                    "status": {"status_str": "error", "completed": False},
+                }
+                self.send(
+                    client_id,
+                    "execution_error",
+                    {"prompt_id": prompt_id, "exception_message": str(e)},
+                )
+            with self.lock:
+                self.queued.pop(prompt_id, None)
+            self.send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+            self.send(client_id, "status", {"status": {"exec_info": {"queue_remaining": self.prompt_queue.qsize()}}})
+
+    def __execute(self, prompt_id, prompt, client_id):
+        outputs = {}
+        image = None
+        samplers = [
+            node_id for node_id, node in prompt.items() if "KSampler" in node.get("class_type", "")
+        ]
+        for node_id in sorted(prompt, key=lambda node_id: int(node_id) if node_id.isdigit() else 0):
+            node = prompt[node_id]
+            class_type = node.get("class_type", "")
+            self.send(client_id, "executing", {"node": node_id, "prompt_id": prompt_id})
+
+            if class_type == "LoadImage":
+                image_path = os.path.join(self.input_directory, node["inputs"]["image"])
+                if not os.path.exists(image_path):
+                    raise FileNotFoundError(f"Invalid image file: {node['inputs']['image']}")
+                image = Image.open(image_path).convert("RGBA")
+            elif node_id in samplers:
+                steps = node["inputs"].get("steps", 20)
+                steps = steps if isinstance(steps, int) and steps > 0 else 20
+                for step in range(1, steps + 1):
+                    time.sleep(self.latency / len(samplers) / steps)
+                    self.send(
+                        client_id,
+                        "progress",
+                        {"value": step, "max": steps, "prompt_id": prompt_id, "node": node_id},
+                    )
+            elif class_type in ("SaveImage", "PreviewImage"):
+                if image is None:
+                    raise ValueError(f"Node {node_id}: no image was loaded before {class_type}")
+                title = node.get("_meta", {}).get("title", "")
+                result = cutout(image) if "alpha" in title.lower() else fill_transparent(image)
+                folder_type = "output" if class_type == "SaveImage" else "temp"
+                filename_prefix = node["inputs"].get("filename_prefix", "ComfyUI")
+                image_info = self.__save(result, filename_prefix, folder_type)
+                outputs[node_id] = {"images": [image_info]}
+                self.send(
+                    client_id,
+                    "executed",
+                    {"node": node_id, "display_node": node_id, "output": outputs[node_id], "prompt_id": prompt_id},
+                )
+        return outputs
+
+    def __save(self, image, filename_prefix, folder_type):
+        """Saves like Comfy's SaveImage: <subfolder>/<name>_<counter:05d>_.png, with the counter after the highest existing one."""
+        subfolder, name = os.path.split(os.path.normpath(filename_prefix))
+        directory = os.path.join(self.get_directory(folder_type), subfolder)
+        with self.lock:
+            os.makedirs(directory, exist_ok=True)
+            counters = [
+                int(filename[len(name) + 1 : -5])
+                for filename in os.listdir(directory)
+                if filename.startswith(name + "_")
+                and filename.endswith("_.png")
+                and filename[len(name) + 1 : -5].isdigit()
+            ]
+            filename = f"{name}_{max(counters, default=0) + 1:05d}_.png"
+            image.save(os.path.join(directory, filename))
+        return {"filename": filename, "subfolder": subfolder, "type": folder_type}
+
+
+def fill_transparent(image):
+    """Fills the transparent pixels of an RGBA image deterministically. Returns an RGB image."""
+    rgba = np.asarray(image)
+    rgb = np.ascontiguousarray(rgba[:, :, :3])
+    mask = (rgba[:, :, 3] == 0).astype(np.uint8)
+    if mask.any():
+        rgb = cv2.inpaint(rgb, mask, 3, cv2.INPAINT_TELEA)
+    return Image.fromarray(rgb, "RGB")
+
+
+def cutout(image):
+    """RGBA cutout of an ellipse in the lower middle of the image, as a stand-in salient object."""
+    rgba = np.array(fill_transparent(image).convert("RGBA"))
+    height, width = rgba.shape[:2]
+    y, x = np.ogrid[:height, :width]
+    inside = ((x - width / 2) / (width / 8)) ** 2 + ((y - height * 0.7) / (height / 6)) ** 2 <= 1
+    rgba[:, :, 3] = np.where(inside, 255, 0)
+    return Image.fromarray(rgba, "RGBA")
+
+
+class MockComfyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: MockComfyState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/ws":
+            self.__serve_websocket(parse_qs(url.query).get("clientId", [str(uuid.uuid4())])[0])
+        elif url.path in ("/", "/system_stats"):
+            self.__send_json({"system": {"os": sys.platform, "python_version": sys.version, "mock": True}, "devices": []})
+        elif url.path == "/queue":
+            # Only the number, ID and client ID of the entries, the pipeline doesn't use the rest
+            with self.state.lock:
+                entries = [[number, prompt_id, {}, {"client_id": client_id}, []] for number, (prompt_id, client_id) in enumerate(self.state.queued.items())]
+            self.__send_json({"queue_running": entries[:1], "queue_pending": entries[1:]})
+        elif url.path.startswith("/history/"):
+            prompt_id = url.path[len("/history/") :]
+            history = self.state.history.get(prompt_id)
+            self.__send_json({prompt_id: history} if history else {})
+        elif url.path == "/view":
+            query = parse_qs(url.query)
+            path = os.path.join(
+                self.state.get_directory(query.get("type", ["output"])[0]),
+                query.get("subfolder", [""])[0],
+                query["filename"][0],
+            )
+            if not os.path.exists(path):
+                self.__send(404, b"Not found", "text/plain")
+                return
+            with open(path, "rb") as image_file:
+                self.__send(200, image_file.read(), "image/png")
+        else:
+            self.__send(404, b"Not found", "text/plain")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        url = urlparse(self.path)
+        if url.path == "/prompt":
+            request = json.loads(body)
+            prompt_id = request.get("prompt_id") or str(uuid.uuid4())
+            with self.state.lock:
+                self.state.queued[prompt_id] = request.get("client_id")
+            self.state.prompt_queue.put((prompt_id, request["prompt"], request.get("client_id")))
+            self.__send_json({"prompt_id": prompt_id, "number": self.state.prompt_queue.qsize(), "node_errors": {}})
+        elif url.path == "/upload/image":
+            message = BytesParser(policy=default_policy).parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode("utf-8") + b"\r\n\r\n" + body
+            )
+            fields = {}
+            for part in message.iter_parts():
+                fields[part.get_param("name", header="content-disposition")] = (
+                    part.get_filename(),
+                    part.get_payload(decode=True),
+                )
+            filename = os.path.basename(fields["image"][0])
+            subfolder = fields.get("subfolder", (None, b""))[1].decode("utf-8")
+            directory = os.path.join(self.state.input_directory, subfolder)
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, filename), "wb") as image_file:
+                image_file.write(fields["image"][1])
+            self.__send_json({"name": filename, "subfolder": subfolder, "type": "input"})
+        else:
+            self.__send(404, b"Not found", "text/plain")
+
+    def send_websocket_text(self, text):
+        payload = text.encode("utf-8")
+        if len(payload) < 126:
+            header = struct.pack("!BB", 0x81, len(payload))
+        elif len(payload) < 1 << 16:
+            header = struct.pack("!BBH", 0x81, 126, len(payload))
+        else:
+            header = struct.pack("!BBQ", 0x81, 127, len(payload))
+        with self.__websocket_lock:
+            self.wfile.write(header + payload)
+            self.wfile.flush()
+
+    def __serve_websocket(self, client_id):
+        accept = base64.b64encode(
+            hashlib.sha1((self.headers["Sec-WebSocket-Key"] + WEBSOCKET_GUID).encode("utf-8")).digest()
+        ).decode("utf-8")
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        self.__websocket_lock = threading.Lock()
+        self.state.websockets[client_id] = self
+        self.send_websocket_text(
+            json.dumps({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": 0}}, "sid": client_id}})
+        )
+        try:
+            while True:
+                opcode, payload = self.__read_frame()
+                if opcode is None or opcode == 0x8:  # Closed
+                    break
+                if opcode == 0x9:  # Ping
+                    with self.__websocket_lock:
+                        self.wfile.write(struct.pack("!BB", 0x8A, len(payload)) + payload)
+                        self.wfile.flush()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if self.state.websockets.get(client_id) is self:
+                del self.state.websockets[client_id]
+            self.close_connection = True
+
+    def __read_frame(self):
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return None, b""
+        opcode = header[0] & 0x0F
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if header[1] & 0x80 else b"\x00\x00\x00\x00"
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self.rfile.read(length)))
+        return opcode, payload
+
+    def __send_json(self, data):
+        self.__send(200, json.dumps(data).encode("utf-8"), "application/json")
+
+    def __send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Comfy server")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--input-directory", default=None)
+    parser.add_argument("--output-directory", default=None)
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per prompt")
+    # Accepted for compatibility with the Comfy server's command line, ignored
+    parser.add_argument("--disable-auto-launch", action="store_true")
+    parser.add_argument("--disable-metadata", action="store_true")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="mock_comfy_")
+    MockComfyHandler.state = MockComfyState(
+        args.input_directory or os.path.join(root, "input"),
+        args.output_directory or os.path.join(root, "output"),
+        args.latency,
+    )
+    server = ThreadingHTTPServer(("localhost", args.port), MockComfyHandler)
+    server.daemon_threads = True
+    print("Starting server\n", flush=True)
+    print(f"To see the GUI go to: http://localhost:{args.port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
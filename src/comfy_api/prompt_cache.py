@@ -0,0 +1,172 @@
+import os
+import json
+import shutil
+import hashlib
+from interfaces.project_interface import ProjectInterface
+from interfaces.logger_interface import LoggerInterface
+from utils.check_make_dir import check_make_dir
+from constants import COMFY_CACHE_DIR, COMFY_CACHE_MAX_MB
+
+
+class ComfyPromptCache:
+    """
+    Content-addressed on-disk cache of Comfy prompt results.
+
+    The key is a hash of the submitted workflow dict, with every uploaded input image replaced by
+    the hash of its bytes and the project's subfolder of the server's directories (in upload
+    names and filename prefixes) replaced by a placeholder. An entry is a directory holding the prompt's outputs dict and the images
+    the prompt saved. The cache is shared by all projects, bounded to "comfy_cache_max_mb" (project
+    config), and the least recently used entries are evicted first (an entry's mtime is its last use).
+    """
+
+    def __init__(
+        self,
+        project: ProjectInterface,
+        logger: LoggerInterface,
+        caller_prefix="COMFY CACHE",
+    ):
+        self.project = project
+        self.logger = logger
+        self.caller_prefix = caller_prefix
+        self.cache_dir = os.path.join(self.project.repo_root, COMFY_CACHE_DIR)
+        check_make_dir(self.cache_dir)
+        self.max_bytes = (
+            int(self.project.config_file().get("comfy_cache_max_mb", COMFY_CACHE_MAX_MB))
+            * 1024
+            * 1024
+        )
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+
+    def log(self, *args, **kwargs):
+        self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
+
+    def get_key(
+        self, workflow_dict: dict, input_hashes: dict, project_subfolder: str
+    ) -> str:
+        """
+        Args:
+            workflow_dict (dict): The workflow dict that is submitted.
+            input_hashes (dict): Input image name (as used in LoadImage nodes) -> hash of the image's bytes.
+            project_subfolder (str): The project's subfolder of the server's input and output
+                directories, which its upload names and SaveImage filename prefixes start with.
+        """
+        keyed_workflow = json.loads(json.dumps(workflow_dict))
+        for node in keyed_workflow.values():
+            inputs = node.get("inputs", {})
+            for name, value in inputs.items():
+                if not isinstance(value, str):
+                    continue
+                if name == "image" and value in input_hashes:
+                    inputs[name] = input_hashes[value]
+                elif name != "image" and value.startswith(project_subfolder + "/"):
+                    # Same outputs whichever project saves them
+                    inputs[name] = "<project>" + value[len(project_subfolder) :]
+        return hashlib.sha256(
+            json.dumps(keyed_workflow, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str):
+        """
+        Returns the cached outputs for the key, or None on a miss.
+
+        Returns:
+            dict | None: The outputs dict, with a "cache_path" (the cached image file) added to the entries of the saved images.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry_dir, "outputs.json"), "r") as outputs_file:
+                outputs = json.load(outputs_file)
+            for node_outputs in outputs.values():
+                for image_info in node_outputs.get("images", []):
+                    if "cache_path" in image_info:
+                        image_info["cache_path"] = os.path.join(
+                            entry_dir, image_info["cache_path"]
+                        )
+                        if not os.path.exists(image_info["cache_path"]):
+                            raise FileNotFoundError(image_info["cache_path"])
+                        self.bytes_served += os.path.getsize(image_info["cache_path"])
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        # Mark as most recently used
+        os.utime(entry_dir)
+        self.hits += 1
+        return outputs
+
+    def put(self, key: str, outputs: dict, images: dict) -> dict:
+        """
+        Stores a prompt's results and evicts least recently used entries if the cache is too big.
+
+        Args:
+            key (str): The key from get_key().
+            outputs (dict): The outputs dict of the prompt.
+            images (dict): (node_id, image index) -> image bytes, for the images to cache.
+
+        Returns:
+            dict: The outputs dict, with a "cache_path" added to the entries of the cached images (same as get()).
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        temp_dir = entry_dir + ".tmp"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+
+        outputs = json.loads(json.dumps(outputs))
+        for (node_id, index), image_bytes in images.items():
+            filename = f"{node_id}_{index}.png"
+            with open(os.path.join(temp_dir, filename), "wb") as image_file:
+                image_file.write(image_bytes)
+            outputs[node_id]["images"][index]["cache_path"] = filename
+        with open(os.path.join(temp_dir, "outputs.json"), "w") as outputs_file:
+            json.dump(outputs, outputs_file)
+
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(temp_dir, entry_dir)
+        self.__evict(keep=entry_dir)
+
+        for node_outputs in outputs.values():
+            for image_info in node_outputs.get("images", []):
+                if "cache_path" in image_info:
+                    image_info["cache_path"] = os.path.join(
+                        entry_dir, image_info["cache_path"]
+                    )
+        return outputs
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        if not total:
+            return
+        self.log(
+            f"Comfy cache: {self.hits}/{total} hits ({100 * self.hits / total:.0f}%),",
+            f"{self.misses} misses, {self.bytes_served / 1024 / 1024:.1f}MB served from cache",
+        )
+
+    def __evict(self, keep: str):
+        entries = []
+        total_bytes = 0
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp") or not os.path.isdir(entry_dir):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_dir, filename))
+                for filename in os.listdir(entry_dir)
+            )
+            entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+            total_bytes += size
+
+        # Oldest use first
+        for _, size, entry_dir in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if entry_dir == keep:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_bytes -= size
+            self.log(
+                f"Comfy cache: Evicted {os.path.basename(entry_dir)}",
+                print_to_console=False,
+                level="debug",
+            )
@@ -1,8 +1,19 @@
 from interfaces.project_interface import ProjectInterface
 from log.logging import Logger
-from constants import COMFY_PATH, COMFY_PORT
+from utils.check_make_dir import check_make_dir
+from constants import (
+    COMFY_PATH,
+    COMFY_PORT,
+    COMFY_SERVER_READY_TIMEOUT,
+    COMFY_SERVER_STARTUP_TIMES_FILENAME,
+    GLOABL_LOGS_DIR,
+)
 import subprocess
 import os
+import sys
+import json
+import time
+from collections import deque
 from urllib import request, error
 
 
@@ -11,23 +22,35 @@ class ComfyServer:
         self,
         project: ProjectInterface,
         logger: Logger,
-        output_directory: str,
-        input_directory: str,
+        output_directory: str = None,
+        input_directory: str = None,
         caller_prefix: str = "COMFY SERVER",
     ):
         self.project = project
         self.logger = logger
         # Create separate logger/logfile for parallel comfy server process's stdout/stderr
         self.detatched_logfile = self.logger.get_isolated_child_logfile(caller_prefix)
-        # The directory to save the generated images for this server instance to, used as a command line argument when launching comfy
+        # The directories to save generated images to and load input images from, used as command line arguments when launching comfy
+        # If None, comfy's default directories are used and images are passed through uploads/downloads (see ComfyServerManager)
         self.output_directory = output_directory
         self.input_directory = input_directory
         self.caller_prefix = caller_prefix
+        # Stays None if a server was already running, so that kill() doesn't stop a server this instance didn't start
+        self.server_process = None
         self.server_url = f"http://localhost:{COMFY_PORT}"
         self.comfy_compatible_python_ver = "3.10.6"
-        self.comfy_launcher_target = os.path.join(COMFY_PATH, "main.py")
-
-        self.__set_python_path()
+        # The mock server runs the pipeline without ComfyUI or a GPU (see mock_server.py)
+        self.use_mock_server = self.project.config_file().get("mock_comfy_server", False)
+        if self.use_mock_server:
+            self.comfy_launcher_target = os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), "mock_server.py"
+            )
+            self.comfy_working_dir = os.getcwd()
+            self.python_path = sys.executable
+        else:
+            self.comfy_launcher_target = os.path.join(COMFY_PATH, "main.py")
+            self.comfy_working_dir = COMFY_PATH
+            self.__set_python_path()
         self.log(
             f"This is the command that will be used to start comfy: {self.__get_comfy_cli_args()}",
             pad_with_rules=False,
@@ -37,13 +60,60 @@ class ComfyServer:
         self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
 
     def start(self):
-        """Wrapper for server so that it can be wrapped in try/except block that terminates the server on error"""
+        """
+        Launches the server (if one isn't already running) and waits until it accepts requests.
+        Terminates the server if it fails to start.
+
+        Raises:
+            RuntimeError: If the server process exits or doesn't become ready in time.
+        """
         try:
+            launch_time = time.time()
             self.__launch_process()
+            if self.server_process:
+                self.wait_until_ready()
+                self.__record_time_to_ready(time.time() - launch_time)
             self.log("Comfy server started")
         except Exception as e:
             self.log(f"Error starting comfy server: {e}")
             self.kill()
+            raise e
+
+    def is_ready(self) -> bool:
+        """Whether the server answers a lightweight HTTP request."""
+        try:
+            with request.urlopen(f"{self.server_url}/system_stats", timeout=1) as f:
+                return f.status == 200
+        except (error.URLError, error.HTTPError, ConnectionError, OSError):
+            return False
+
+    def wait_until_ready(self, timeout: float = COMFY_SERVER_READY_TIMEOUT):
+        """
+        Polls the server with a short, growing backoff until it answers, and polls right away
+        whenever the server's log file says it is listening.
+
+        Raises:
+            RuntimeError: With the tail of the server log, if the process exits or the timeout is reached.
+        """
+        deadline = time.time() + timeout
+        backoff = 0.05
+        log_position = 0
+        while True:
+            if self.is_ready():
+                return
+            if self.server_process and self.server_process.poll() is not None:
+                raise RuntimeError(
+                    f"Comfy server exited with code {self.server_process.returncode} before it was ready. Server log tail:\n{self.__get_log_tail()}"
+                )
+            if time.time() > deadline:
+                raise RuntimeError(
+                    f"Comfy server not ready after {timeout}s. Server log tail:\n{self.__get_log_tail()}"
+                )
+
+            listening, log_position = self.__log_says_listening(log_position)
+            if not listening:
+                time.sleep(backoff)
+                backoff = min(backoff * 1.5, 1)
 
     def kill(self):
         if self.server_process:
@@ -53,18 +123,61 @@ class ComfyServer:
         else:
             self.log("Comfy Process Disconnect Attempt: No Comfy server to stop")
 
+    def __log_says_listening(self, log_position: int) -> tuple[bool, int]:
+        """Checks the server log from log_position for the line comfy prints once it is listening."""
+        try:
+            with open(self.detatched_logfile, "r", errors="replace") as server_logfile:
+                server_logfile.seek(log_position)
+                new_text = server_logfile.read()
+                log_position = server_logfile.tell()
+        except OSError:
+            return False, log_position
+        return "To see the GUI go to" in new_text or "Starting server" in new_text, log_position
+
+    def __get_log_tail(self, n_lines: int = 20) -> str:
+        try:
+            with open(self.detatched_logfile, "r", errors="replace") as server_logfile:
+                return "".join(deque(server_logfile, maxlen=n_lines))
+        except OSError:
+            return "(server log not found)"
+
+    def __record_time_to_ready(self, time_to_ready: float):
+        """Appends the launch's time-to-ready to the global logs dir, to see how cold starts trend over time."""
+        self.log(f"Comfy server ready after {time_to_ready:.2f}s")
+        logs_dir = os.path.join(self.project.repo_root, GLOABL_LOGS_DIR)
+        check_make_dir(logs_dir)
+        startup_times_path = os.path.join(logs_dir, COMFY_SERVER_STARTUP_TIMES_FILENAME)
+        with open(startup_times_path, "a") as startup_times_file:
+            startup_times_file.write(
+                json.dumps(
+                    {
+                        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "project": self.project.name,
+                        "time_to_ready_s": round(time_to_ready, 3),
+                    }
+                )
+                + "\n"
+            )
+
     def __get_comfy_cli_args(self):
         """https://github.com/comfyanonymous/ComfyUI/blob/master/comfy/cli_args.py"""
         # TODO: --extra-model-paths-config PATH [PATH . . . ] Load one or more extra_model_paths.yaml files. Load models specific to this project
+        io_directory_args = []
+        if self.output_directory:
+            io_directory_args += ["--output-directory", self.output_directory]
+        if self.input_directory:
+            io_directory_args += ["--input-directory", self.input_directory]
+        if self.use_mock_server:
+            io_directory_args += [
+                "--latency",
+                str(self.project.config_file().get("mock_comfy_latency", 0)),
+            ]
         return [
             self.python_path,
             self.comfy_launcher_target,
             "--port",
             str(COMFY_PORT),
-            "--output-directory",
-            self.output_directory,
-            "--input-directory",
-            self.input_directory,
+            *io_directory_args,
             # Maybe need previews to be enabled for api client listener
             # "--preview-method",
             # "none",
@@ -118,6 +231,11 @@ class ComfyServer:
             with request.urlopen(self.server_url) as f:
                 if f.status == 200:
                     self.log("Comfy server status: Already running. Connecting")
+                    if self.output_directory or self.input_directory:
+                        self.log(
+                            "Warning: The running server may have been started with different i/o directories than:",
+                            f"output={self.output_directory}, input={self.input_directory}",
+                        )
                     return
         except (error.URLError, error.HTTPError, KeyError):
             self.log(
@@ -126,7 +244,7 @@ class ComfyServer:
 
         # NOTE: Changing dirs necessary if using pyenv aliases per location, i think (not sure)
         original_dir = os.getcwd()
-        os.chdir(COMFY_PATH)
+        os.chdir(self.comfy_working_dir)
 
         # Launch the server subprocess, don't wait for it to finish, and redirect its output to server log file
         server_logfile = open(self.detatched_logfile, "w")
@@ -0,0 +1,229 @@
+import os
+import hashlib
+from comfy_api.server import ComfyServer
+from comfy_api.session import ComfySession
+from comfy_api.prompt_cache import ComfyPromptCache
+from workflow_wrapper.workflow import ComfyAPIWorkflow
+from interfaces.project_interface import ProjectInterface
+from interfaces.logger_interface import LoggerInterface
+from constants import COMFY_IO_SUBFOLDER
+
+
+class ComfyServerManager:
+    """
+    Owns the Comfy server and session for a whole project run.
+
+    The server is started (or an already running one is connected to) the first time a stage
+    needs it, shared by every stage after that, and shut down by shutdown() at the end of the run.
+
+    The server is launched without --input-directory/--output-directory, so it doesn't matter
+    whether it was started here or by the user with other directories. Each stage's input images
+    are uploaded into a per-stage subfolder of the server's input directory, its SaveImage nodes
+    save into the same subfolder of the server's output directory, and the outputs are downloaded
+    into the project directories.
+
+    Uploads are deferred until a prompt that uses them is submitted. Unless "comfy_cache" is false in
+    the project config, prompts whose workflow and input images are unchanged are answered from
+    the ComfyPromptCache, without submitting them (or even starting the server).
+    """
+
+    def __init__(
+        self,
+        project: ProjectInterface,
+        logger: LoggerInterface,
+        caller_prefix="COMFY SERVER MANAGER",
+    ):
+        self.project = project
+        self.logger = logger
+        self.caller_prefix = caller_prefix
+        self.server = None
+        self.session = None
+        # LoadImage value -> image bytes not uploaded yet
+        self.__pending_uploads = {}
+        # LoadImage value -> hash of the image bytes
+        self.__input_hashes = {}
+        self.cache = (
+            ComfyPromptCache(self.project, self.logger)
+            if self.project.config_file().get("comfy_cache", True)
+            else None
+        )
+
+    def log(self, *args, **kwargs):
+        self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
+
+    def start(self):
+        """Starts the server and connects the session, if not already done."""
+        if self.session:
+            return
+        self.server = ComfyServer(self.project, self.logger, caller_prefix="COMFY SERVER")
+        self.server.start()
+        self.session = ComfySession(self.project, self.logger, "COMFY SESSION")
+        self.session.connect()
+
+    def shutdown(self):
+        """Disconnects the session and stops the server (unless it was already running before the run)."""
+        try:
+            if self.session:
+                self.session.disconnect()
+            if self.server:
+                self.server.kill()
+        except Exception as e:
+            self.log(f"Error stopping comfy server/session: {e}")
+        self.server = None
+        self.session = None
+        if self.cache:
+            self.cache.log_stats()
+
+    def project_subfolder(self) -> str:
+        return f"{COMFY_IO_SUBFOLDER}/{self.project.name}"
+
+    def stage_subfolder(self, stage: str) -> str:
+        return f"{self.project_subfolder()}/{stage}"
+
+    def upload_input(self, image_fullpath: str, stage: str) -> str:
+        """
+        Uploads an image to the stage's subfolder of the server's input directory.
+
+        Returns:
+            str: The value to set as a LoadImage node's image input.
+        """
+        with open(image_fullpath, "rb") as image_file:
+            return self.upload_input_bytes(
+                image_file.read(), os.path.basename(image_fullpath), stage
+            )
+
+    def upload_input_bytes(self, image_bytes: bytes, filename: str, stage: str) -> str:
+        """
+        Uploads an encoded image to the stage's subfolder of the server's input directory
+        (when the next prompt is submitted).
+
+        Returns:
+            str: The value to set as a LoadImage node's image input.
+        """
+        image_name = f"{self.stage_subfolder(stage)}/{filename}"
+        self.__pending_uploads[image_name] = image_bytes
+        self.__input_hashes[image_name] = hashlib.sha256(image_bytes).hexdigest()
+        return image_name
+
+    def route_output(
+        self, workflow: ComfyAPIWorkflow, node_name: str, stage: str, filename_prefix: str
+    ):
+        """Makes a SaveImage node save into the stage's subfolder of the server's output directory."""
+        workflow.update(
+            node_name,
+            "filename_prefix",
+            f"{self.stage_subfolder(stage)}/{filename_prefix}",
+        )
+
+    def run(self, workflow: ComfyAPIWorkflow, caller_prefix: str = None) -> dict:
+        """
+        Queues a workflow on the shared session and waits for it, or returns its cached outputs.
+
+        Returns:
+            dict: The outputs of the prompt's output nodes, keyed by node ID.
+        """
+        if self.cache:
+            cache_key = self.cache_key(workflow)
+            outputs = self.cache.get(cache_key)
+            if outputs is not None:
+                self.log(f"Comfy cache hit: {caller_prefix or workflow.filename}")
+                self.__pending_uploads = {}
+                return outputs
+
+        self.start()
+        self.__upload_pending()
+        outputs = self.session.queue_workflow(workflow, caller_prefix)
+        if self.cache and self.__saves_only_output_images(outputs):
+            # Later fetch_output calls read the images from the cache entry instead of downloading them again
+            outputs = self.cache.put(
+                cache_key, outputs, self.__fetch_saved_images(outputs)
+            )
+        return outputs
+
+    def cache_key(self, workflow: ComfyAPIWorkflow) -> str:
+        """The workflow's ComfyPromptCache key, with the input images uploaded since the last prompt."""
+        return self.cache.get_key(
+            workflow.get_workflow_dict(), self.__input_hashes, self.project_subfolder()
+        )
+
+    def __saves_only_output_images(self, outputs: dict) -> bool:
+        """
+        Whether every image of the prompt is a saved ("output") image. Preview and temp images
+        aren't cached, and a cache hit doesn't start the server, so prompts with them aren't cached.
+        """
+        return all(
+            image_info.get("type", "output") == "output"
+            for node_outputs in outputs.values()
+            for image_info in node_outputs.get("images", [])
+        )
+
+    def __upload_pending(self):
+        for image_name, image_bytes in self.__pending_uploads.items():
+            subfolder, filename = image_name.rsplit("/", 1)
+            uploaded_name = self.session.upload_image(image_bytes, filename, subfolder)
+            if uploaded_name != image_name:
+                raise RuntimeError(
+                    f"Comfy server stored upload {image_name} as {uploaded_name}"
+                )
+        self.__pending_uploads = {}
+
+    def __fetch_saved_images(self, outputs: dict) -> dict:
+        """Downloads the images saved by the prompt's output nodes (not previews), to be cached."""
+        images = {}
+        for node_id, node_outputs in outputs.items():
+            for index, image_info in enumerate(node_outputs.get("images", [])):
+                if image_info.get("type", "output") == "output":
+                    images[(node_id, index)] = self.session.view_image(
+                        image_info["filename"], image_info.get("subfolder", "")
+                    )
+        return images
+
+    def fetch_output(
+        self, outputs: dict, workflow: ComfyAPIWorkflow, node_name: str
+    ) -> bytes:
+        """
+        Fetches the first image saved by a node of a finished prompt.
+
+        Args:
+            outputs (dict): The outputs returned by run().
+            workflow (ComfyAPIWorkflow): The workflow that was run.
+            node_name (str): The title or class_type of the SaveImage node.
+
+        Raises:
+            KeyError: If the node didn't save any images.
+
+        Returns:
+            bytes: The encoded image.
+        """
+        node_outputs = outputs.get(workflow.get_node_id(node_name), {})
+        if not node_outputs.get("images"):
+            raise KeyError(f"Comfy server returned no images for node: {node_name}")
+        image_info = node_outputs["images"][0]
+        if "cache_path" in image_info:
+            with open(image_info["cache_path"], "rb") as image_file:
+                return image_file.read()
+        # The outputs may come from the cache, in which case the server hasn't been started
+        self.start()
+        return self.session.view_image(
+            image_info["filename"],
+            image_info.get("subfolder", ""),
+            image_info.get("type", "output"),
+        )
+
+    def download_output(
+        self,
+        outputs: dict,
+        workflow: ComfyAPIWorkflow,
+        node_name: str,
+        dest_fullpath: str,
+    ) -> str:
+        """
+        Downloads the first image saved by a node of a finished prompt (see fetch_output).
+
+        Returns:
+            str: dest_fullpath
+        """
+        image_bytes = self.fetch_output(outputs, workflow, node_name)
+        with open(dest_fullpath, "wb") as image_file:
+            image_file.write(image_bytes)
+        return dest_fullpath
@@ -0,0 +1,357 @@
+import json
+import time
+import uuid
+import http.client
+from urllib.parse import urlencode
+import websocket
+from workflow_wrapper.workflow import ComfyAPIWorkflow
+from interfaces.project_interface import ProjectInterface
+from interfaces.logger_interface import LoggerInterface
+from constants import COMFY_PORT, COMFY_API_MAX_CONNECT_ATTEMPTS
+
+
+class ComfySession:
+    """
+    Long-lived connection to the Comfy server, reused across many prompts.
+
+    Keeps one websocket and one keep-alive HTTP connection open for the whole session instead
+    of opening new ones for every prompt (see ComfyClient). Websocket messages are demultiplexed
+    by prompt_id, so more than one prompt can be in flight at a time. If the websocket drops,
+    the session reconnects with the same client ID and checks the server's history for any
+    prompt that finished while it was disconnected.
+
+    https://github.com/comfyanonymous/ComfyUI/blob/master/script_examples/websockets_api_example.py
+    """
+
+    def __init__(
+        self,
+        project: ProjectInterface,
+        logger: LoggerInterface,
+        caller_prefix: str = "COMFY SESSION",
+    ):
+        self.project = project
+        self.logger = logger
+        self.caller_prefix = caller_prefix
+        self.client_id = str(uuid.uuid4())
+        self.__websocket = None
+        self.__http = None
+        # prompt_id -> {"workflow", "caller_prefix", "outputs", "done", "error"}
+        self.__prompts = {}
+        self.log(f"New Comfy Session Created with ID: {self.client_id}")
+
+    def log(self, *args, **kwargs):
+        self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+
+    def is_connected(self):
+        return self.__websocket is not None and self.__websocket.connected
+
+    def connect(self):
+        """
+        Opens the session's websocket, attempting to connect every second up to
+        COMFY_API_MAX_CONNECT_ATTEMPTS times.
+
+        Raises:
+            ConnectionError: If the connection to the Comfy server fails.
+        """
+        self.__websocket = websocket.WebSocket()
+
+        for attempt in range(COMFY_API_MAX_CONNECT_ATTEMPTS):
+            try:
+                self.__websocket.connect(
+                    f"ws://localhost:{COMFY_PORT}/ws?clientId={self.client_id}",
+                )
+            except ConnectionRefusedError:
+                self.logger.progress_bar(
+                    attempt + 1,
+                    COMFY_API_MAX_CONNECT_ATTEMPTS,
+                    "Server Connection Attempts",
+                    self.caller_prefix,
+                )
+                time.sleep(1)
+                continue
+
+            if self.__websocket.connected:
+                self.log(
+                    "Comfy session connection attempt",
+                    f"{attempt + 1}/{COMFY_API_MAX_CONNECT_ATTEMPTS}:",
+                    "Succeeded - connection established",
+                )
+                break
+
+        if not self.__websocket.connected:
+            raise ConnectionError("Failed to connect to Comfy server")
+
+    def disconnect(self):
+        if self.is_connected():
+            self.log("Disconnecting Session from Comfy server")
+            self.__websocket.close()
+        if self.__http:
+            self.__http.close()
+            self.__http = None
+
+    def queue_workflow(
+        self, workflow: ComfyAPIWorkflow, caller_prefix: str = None
+    ) -> dict:
+        """
+        Submits a workflow and waits for it to complete.
+
+        Args:
+            workflow (ComfyAPIWorkflow): The workflow to run.
+            caller_prefix (str, optional): Log prefix for this prompt's messages. Defaults to the session's prefix.
+
+        Returns:
+            dict: The outputs of the prompt's output nodes, keyed by node ID.
+        """
+        start_time_epoch = time.time()
+        self.log(f"Queueing Workflow at: {time.strftime('%I:%M%p')}")
+
+        prompt_id = self.submit(workflow, caller_prefix)
+        outputs = self.wait(prompt_id)
+
+        time_diff_formatted = time.strftime(
+            "%Mmin, %Ssec", time.gmtime(time.time() - start_time_epoch)
+        )
+        self.log(
+            f"Comfy server finished processing request at: {time.strftime('%I:%M%p')} (Time elapsed - {time_diff_formatted})"
+        )
+        return outputs
+
+    def submit(self, workflow: ComfyAPIWorkflow, caller_prefix: str = None) -> str:
+        """
+        Submits a workflow without waiting for it.
+
+        Returns:
+            str: The prompt's ID, to pass to wait().
+        """
+        if not self.is_connected():
+            self.connect()
+
+        # Generated here rather than by the server, so a POST that fails after it was sent can be
+        # looked up on the server instead of being sent again and queued twice
+        prompt_id = str(uuid.uuid4())
+        payload = self.__http_request(
+            "POST",
+            "/prompt",
+            json.dumps(
+                {
+                    "prompt": workflow.get_workflow_dict(),
+                    "client_id": self.client_id,
+                    "prompt_id": prompt_id,
+                }
+            ).encode("utf-8"),
+            {"Content-Type": "application/json"},
+            resend_if=lambda: not self.__is_known_prompt(prompt_id),
+        )
+        if payload is None:
+            self.log(f"Comfy server queued prompt {prompt_id}, but its response was lost")
+        else:
+            # Servers older than the prompt_id field assign their own
+            prompt_id = json.loads(payload)["prompt_id"]
+        self.__prompts[prompt_id] = {
+            "workflow": workflow,
+            "caller_prefix": caller_prefix or self.caller_prefix,
+            "outputs": {},
+            "done": False,
+            "error": None,
+        }
+        return prompt_id
+
+    def wait(self, prompt_id: str) -> dict:
+        """
+        Receives websocket messages (dispatching messages of other prompts as they arrive)
+        until the given prompt is done.
+
+        Raises:
+            RuntimeError: If the server reports an execution error for the prompt.
+
+        Returns:
+            dict: The outputs of the prompt's output nodes, keyed by node ID.
+        """
+        prompt = self.__prompts[prompt_id]
+        while not prompt["done"]:
+            self.__receive()
+
+        del self.__prompts[prompt_id]
+        if prompt["error"]:
+            raise RuntimeError(f"Comfy prompt {prompt_id} failed: {prompt['error']}")
+        return prompt["outputs"]
+
+    def request(self, method: str, path: str, body: dict = None) -> dict:
+        """
+        Sends a request over the session's keep-alive HTTP connection.
+
+        Returns:
+            dict: The decoded JSON response.
+        """
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        return json.loads(
+            self.__http_request(
+                method, path, data, {"Content-Type": "application/json"}
+            )
+        )
+
+    def upload_image(
+        self, image_bytes: bytes, filename: str, subfolder: str = ""
+    ) -> str:
+        """
+        Uploads an image into a subfolder of the server's input directory (overwriting any
+        image with the same name), so it doesn't matter which input directory the server uses.
+
+        Args:
+            image_bytes (bytes): The encoded image.
+            filename (str): The filename to upload the image as.
+            subfolder (str, optional): The subfolder of the input directory.
+
+        Returns:
+            str: The value to set as a LoadImage node's image input.
+        """
+        boundary = uuid.uuid4().hex
+        fields = {"subfolder": subfolder, "type": "input", "overwrite": "true"}
+        body = b""
+        for name, value in fields.items():
+            body += (
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            ).encode("utf-8")
+        body += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+            + "Content-Type: image/png\r\n\r\n"
+        ).encode("utf-8")
+        body += image_bytes + f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+        response = json.loads(
+            self.__http_request(
+                "POST",
+                "/upload/image",
+                body,
+                {"Content-Type": f"multipart/form-data; boundary={boundary}"},
+            )
+        )
+        if response.get("subfolder"):
+            return f"{response['subfolder']}/{response['name']}"
+        return response["name"]
+
+    def view_image(
+        self, filename: str, subfolder: str = "", folder_type: str = "output"
+    ) -> bytes:
+        """
+        Downloads an image from one of the server's directories.
+
+        Returns:
+            bytes: The encoded image.
+        """
+        query = urlencode(
+            {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        )
+        return self.__http_request("GET", f"/view?{query}", None, {})
+
+    def __http_request(
+        self, method: str, path: str, body: bytes, headers: dict, resend_if=None
+    ) -> bytes:
+        """
+        Reconnects and resends once if the server closed the keep-alive connection.
+
+        Args:
+            resend_if (callable, optional): For requests that aren't idempotent. If the request
+                failed after it was sent, it is only resent if this returns True (i.e., the server
+                didn't get it). Defaults to always resending.
+
+        Returns:
+            bytes: The response body, or None if the request was sent but not resent because
+                resend_if returned False.
+        """
+        for attempt in range(2):
+            if not self.__http:
+                self.__http = http.client.HTTPConnection("localhost", COMFY_PORT)
+            sent = False
+            try:
+                self.__http.request(method, path, body=body, headers=headers)
+                sent = True
+                response = self.__http.getresponse()
+                payload = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError) as e:
+                self.__http.close()
+                self.__http = None
+                if attempt == 1:
+                    raise e
+                if sent and resend_if and not resend_if():
+                    return None
+
+        if response.status != 200:
+            raise ConnectionError(
+                f"Comfy server returned {response.status} for {method} {path}: {payload.decode('utf-8', 'replace')}"
+            )
+        return payload
+
+    def __receive(self):
+        try:
+            out = self.__websocket.recv()
+        except (websocket.WebSocketException, ConnectionError, OSError) as e:
+            self.log(f"Websocket dropped ({e}), reconnecting")
+            self.connect()
+            self.__check_history()
+            return
+
+        # Previews are binary data
+        if isinstance(out, str):
+            self.__handle_message(json.loads(out))
+
+    def __is_known_prompt(self, prompt_id: str) -> bool:
+        """Whether the server has queued, is running or has run the prompt."""
+        queue = self.request("GET", "/queue")
+        for entry in queue.get("queue_running", []) + queue.get("queue_pending", []):
+            if entry[1] == prompt_id:
+                return True
+        return prompt_id in self.request("GET", f"/history/{prompt_id}")
+
+    def __check_history(self):
+        """Marks prompts which finished while the websocket was disconnected as done."""
+        for prompt_id, prompt in self.__prompts.items():
+            if prompt["done"]:
+                continue
+            history = self.request("GET", f"/history/{prompt_id}")
+            if prompt_id not in history:
+                continue
+            for node_id, output in history[prompt_id].get("outputs", {}).items():
+                prompt["outputs"][node_id] = output
+            prompt["done"] = True
+
+    def __handle_message(self, message):
+        data = message.get("data", {})
+        if message["type"] == "status":
+            self.log(data["status"], print_to_console=False, level="debug")
+            return
+
+        prompt = self.__prompts.get(data.get("prompt_id"))
+        if not prompt:
+            return  # Message about a prompt from another client or one that is already done
+
+        if message["type"] == "progress":
+            self.logger.progress_bar(
+                data["value"],
+                data["max"],
+                prompt["workflow"].parse_node_name(data),
+                prompt["caller_prefix"],
+            )
+        elif message["type"] == "executed":
+            prompt["outputs"][data["node"]] = data["output"]
+        elif message["type"] == "execution_error":
+            prompt["error"] = data.get("exception_message", "Unknown error")
+            prompt["done"] = True
+        elif message["type"] == "executing":
+            if data["node"] is None:
+                prompt["done"] = True  # Execution is done
+            else:
+                cur_node_name = prompt["workflow"].parse_node_name(data)
+                self.logger.log(
+                    f"Executing Node: {cur_node_name}",
+                    caller_prefix=prompt["caller_prefix"],
+                    level="debug",
+                )
@@ -12,16 +12,34 @@ STITCHED_INPAINT_DIR = "stitches/stitched_inpainted"
 CROPPED_STEPS_DIR = "layers/cropped_steps"
 LAYER_VIDEOS_DIR = "videos/layer_videos"
 VIDEO_CODEC = "libx264"
+DEFAULT_RENDER_ENGINE = "moviepy"  # "moviepy", "numpy" or "segmented" (overridden by "render_engine" in project config)
 OUTPUT_VIDEO_PATH = "output"
+RENDER_SEGMENTS_DIR = "output/segments"
 SALIENT_OBJECTS_DIR = "objects/alpha_layers/salient_objects"
 PROJECT_WORKFLOW_DIR = "project_workflows"
 GLOABL_LOGS_DIR = "logs" # rel path from repo root
+DEFAULT_LOG_LEVEL = "info"  # "debug", "info", "warning" or "error" (overridden by "log_level" in project config)
+LOG_QUEUE_SIZE = 10000  # Max records waiting for the logging thread before log() blocks
 COMFY_PORT = 8188
 COMFY_API_MAX_CONNECT_ATTEMPTS = 18
+COMFY_SERVER_READY_TIMEOUT = 120  # (s) max time to wait for a launched comfy server to accept requests
+COMFY_SERVER_STARTUP_TIMES_FILENAME = "comfy_server_startup_times.jsonl"  # in the global logs dir
+COMFY_CACHE_DIR = "cache/comfy_prompts"  # rel path from repo root
+COMFY_CACHE_MAX_MB = 2048  # overridden by "comfy_cache_max_mb" in project config
+COMFY_IO_SUBFOLDER = "infinite-parallax"  # subfolder of the comfy server's input/output dirs, per project and stage
 SALIENT_OBJECTS_WORKFLOW_PATH = "workflow-templates/api/salient_object/salient_object-remove_inpaint_extract-v2-API_VERSION.json"
 INPAINT_WORKFLOW_PATH = "workflow-templates/api/inpaint/inpaint_with_lora_stack-API_VERSION.json"
 SALIENT_OBJECT_ALPHA_LAYER_PREFIX = "salient_object_alpha_layer"
 BASE_LAYER_WITHOUT_OBJECTS_PREFIX = "base_layer-salient_object_removed"
+DEFAULT_INPAINT_BACKEND = "comfy"  # "comfy" or "opencv" (overridden by "inpaint_backend" in project config)
+OPENCV_INPAINT_RADIUS = 5  # (px) overridden by "opencv_inpaint_radius" in project config
+ROI_CONTEXT_MARGIN = 64  # (px) context around each gap sent to the inpaint workflow in ROI mode (overridden by "roi_context_margin" in project config)
+ROI_SIZE_MULTIPLE = 8  # ROI atlas dimensions are padded to a multiple of this (latent scale)
+INPAINT_MANIFEST_FILENAME = "inpaint_manifest.json"  # in the layer outputs dir
+STAGE_STATE_FILENAME = "stages.json"  # in the project dir
+RUN_REPORTS_DIR = "reports"  # in the project dir
+RUN_REPORT_HISTORY_FILENAME = "runs.jsonl"  # in the run reports dir, one line per run
+RSS_SAMPLE_INTERVAL = 0.1  # (s) how often memory is sampled while a stage runs
 START_STEP_PREFIX = "start_step"
 STITCHED_OBJECTS_DIR = "stitches/stitched_object_alphas"
 DEFAULT_DISTANCES = {
@@ -44,3 +62,4 @@ DEFAULT_DISTANCES = {
         "creates_best_output_distance": 800,
     },
 }
+PANORAMA_TILE_CACHE_SIZE = 16  # Tiles read from disk kept in memory per panorama, consecutive frames mostly reuse the same tiles
@@ -0,0 +1,195 @@
+import os
+import json
+import hashlib
+from PIL import Image
+from interfaces.project_interface import ProjectInterface
+from interfaces.logger_interface import LoggerInterface
+from constants import (
+    INPAINT_MANIFEST_FILENAME,
+    DEFAULT_INPAINT_BACKEND,
+    INPAINT_WORKFLOW_PATH,
+)
+
+
+class InpaintCheckpoint:
+    """
+    Step manifest of the inpaint loop, used to resume an interrupted loop instead of starting over.
+
+    After every inpaint step, the step's input/output image hashes and the shift preprocessor's
+    state are recorded in a manifest in the layer outputs dir. On the next run with the same
+    inputs (same settings, input image and inpaint workflow template), the last recorded step
+    whose output image and layer slices are still on disk and unchanged, and whose input canvas
+    recreated from the previous step's output is unchanged, is the step the loop resumes after.
+    """
+
+    def __init__(
+        self,
+        project: ProjectInterface,
+        logger: LoggerInterface,
+        n_steps: int,
+        caller_prefix="INPAINT > CHECKPOINT",
+    ):
+        self.project = project
+        self.logger = logger
+        self.caller_prefix = caller_prefix
+        self.n_steps = n_steps
+        self.manifest_path = os.path.join(
+            self.project.layer_outputs_dir(), INPAINT_MANIFEST_FILENAME
+        )
+        self.signature = self.__get_signature()
+        self.steps = []
+
+    def log(self, *args, **kwargs):
+        self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
+
+    def get_end_image_path(self, step: int) -> str:
+        return os.path.join(self.project.layer_outputs_dir(), f"end_step_{step:05d}_.png")
+
+    def get_resume_step(self, recreate_step_input) -> int:
+        """
+        Loads the manifest and validates the recorded steps, newest first.
+
+        Args:
+            recreate_step_input (callable): Takes a step's source image (the previous step's output,
+                or the input image) and the shifter's step count, and returns the step's input
+                canvas without saving anything (LayerShifter.recreate_shifted_canvas).
+
+        Returns:
+            int: The number of steps that are done (the loop continues with the step after it), 0 to start over.
+        """
+        if not os.path.exists(self.manifest_path):
+            return 0
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            self.log("Inpaint manifest: Unreadable, starting over")
+            return 0
+        if manifest.get("signature") != self.signature:
+            self.log("Inpaint manifest: Settings, input image or workflow changed, starting over")
+            return 0
+
+        steps = manifest["steps"]
+        while steps and not self.__is_valid(steps, recreate_step_input):
+            self.log(f"Inpaint manifest: Step {steps[-1]['step']} is incomplete or changed")
+            steps.pop()
+        self.steps = steps
+        if steps:
+            self.log(
+                f"Inpaint manifest: Resuming after step {steps[-1]['step']}/{self.n_steps}"
+            )
+        return steps[-1]["step"] if steps else 0
+
+    def get_shifter_state(self) -> dict:
+        """Returns the shift preprocessor's state recorded with the step to resume after."""
+        return self.steps[-1]["shifter"]
+
+    def record_step(
+        self,
+        step: int,
+        input_image: Image.Image,
+        end_image: Image.Image,
+        shifter_step_count: int,
+    ):
+        """
+        Records a finished step. The manifest is replaced atomically, so it is always readable.
+
+        Args:
+            step (int): The step number.
+            input_image (Image.Image): The shifted canvas that was inpainted.
+            end_image (Image.Image): The inpainted RGB image.
+            shifter_step_count (int): The shift preprocessor's step count to continue with after this step.
+        """
+        self.steps.append(
+            {
+                "step": step,
+                "input_hash": self.hash_image(input_image),
+                "output_hash": self.hash_image(end_image),
+                "shifter": {"step_count": shifter_step_count},
+            }
+        )
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as manifest_file:
+            json.dump(
+                {"signature": self.signature, "steps": self.steps}, manifest_file, indent=4
+            )
+        os.replace(temp_path, self.manifest_path)
+
+    def hash_image(self, image: Image.Image) -> str:
+        """Hash of the decoded pixels, so it doesn't depend on how (or whether) the image was encoded."""
+        return hashlib.sha1(image.tobytes() + image.mode.encode("utf-8")).hexdigest()
+
+    def __is_valid(self, steps: list[dict], recreate_step_input) -> bool:
+        """Whether the last of the recorded steps can be resumed after."""
+        step_record = steps[-1]
+        end_image_path = self.get_end_image_path(step_record["step"])
+        try:
+            with Image.open(end_image_path) as end_image:
+                if self.hash_image(end_image.convert("RGB")) != step_record["output_hash"]:
+                    return False
+        except OSError:
+            return False
+
+        # The layer slices up to the step are needed for stitching
+        n_layers = len(self.project.config_file()["layers"])
+        for step in range(1, step_record["step"] + 1):
+            for layer_index in range(n_layers):
+                if not os.path.exists(
+                    os.path.join(
+                        self.project.layer_outputs_dir(),
+                        f"layer_{layer_index+1}_{step:05d}_.png",
+                    )
+                ):
+                    return False
+
+        # The step's input canvas, recreated the way the loop created it
+        source_path = (
+            self.get_end_image_path(steps[-2]["step"])
+            if len(steps) > 1
+            else self.project.config_file()["input_image_path"]
+        )
+        try:
+            with Image.open(source_path) as source_image:
+                # The step count was advanced once, by creating this input canvas
+                input_image = recreate_step_input(
+                    source_image, step_record["shifter"]["step_count"] - 1
+                )
+        except OSError:
+            return False
+        return self.hash_image(input_image) == step_record["input_hash"]
+
+    def __get_signature(self) -> str:
+        """Hash of everything that determines the steps' inputs. A manifest with a different signature is stale."""
+        config = self.project.config_file()
+        inpaint_backend = config.get("inpaint_backend", DEFAULT_INPAINT_BACKEND)
+        signature_dict = {
+            "input_image": self.__hash_file(config["input_image_path"]),
+            # Edits to the workflow template (model, sampler, LoRAs...) change the inpainted steps
+            "workflow_template": (
+                self.__hash_file(
+                    os.path.join(self.project.repo_root, INPAINT_WORKFLOW_PATH)
+                )
+                if inpaint_backend == "comfy"
+                else None
+            ),
+            "layers": config["layers"],
+            "total_steps": config["total_steps"],
+            "n_steps": self.n_steps,
+            "prompt_prepend": config.get("prompt_prepend"),
+            "min_inpaint_gap": config.get("min_inpaint_gap", 0),
+            "roi_inpainting": config.get("roi_inpainting", False),
+            "roi_context_margin": config.get("roi_context_margin"),
+            "inpaint_backend": inpaint_backend,
+            "opencv_inpaint_method": config.get("opencv_inpaint_method"),
+            "opencv_inpaint_radius": config.get("opencv_inpaint_radius"),
+        }
+        return hashlib.sha1(
+            json.dumps(signature_dict, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def __hash_file(self, path: str) -> str:
+        file_hash = hashlib.sha1()
+        with open(path, "rb") as input_file:
+            for chunk in iter(lambda: input_file.read(1 << 20), b""):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
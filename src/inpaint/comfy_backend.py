@@ -0,0 +1,86 @@
+import io
+import os
+from PIL import Image
+from comfy_api.server_manager import ComfyServerManager
+from workflow_wrapper.workflow import ComfyAPIWorkflow
+from interfaces.project_interface import ProjectInterface
+from interfaces.logger_interface import LoggerInterface
+from constants import INPAINT_WORKFLOW_PATH, FEATHERING_MARGIN
+
+
+class ComfyInpaintBackend:
+    """Inpaints with the diffusion inpaint workflow on the (shared) Comfy server."""
+
+    def __init__(
+        self,
+        project: ProjectInterface,
+        logger: LoggerInterface,
+        server_manager: ComfyServerManager,
+        caller_prefix="INPAINT > COMFY",
+    ):
+        self.project = project
+        self.logger = logger
+        self.server_manager = server_manager
+        self.stage = "inpaint_loop"
+        self.caller_prefix = caller_prefix
+
+        self.log(
+            "Inpainting workflow location:",
+            os.path.join(project.repo_root, INPAINT_WORKFLOW_PATH),
+        )
+        if self.project.interactive:
+            input(
+                "\nYou can edit the workflow now if the default values are not working."
+                + "\nPress ENTER when done or to skip editing."
+                + self.logger.get_prompt()
+            )
+
+        self.workflow = ComfyAPIWorkflow(
+            project,
+            logger,
+            os.path.join(project.repo_root, INPAINT_WORKFLOW_PATH),
+            "INPAINT-LOOP > WF",
+        )
+        # NOTE: Change if workflow changes or custom nodes are updated
+        self.workflow.update(
+            "ImpactWildcardProcessor",
+            "wildcard_text",
+            project.config_file()["prompt_prepend"],
+        )
+        self.workflow.update(
+            "GrowMaskWithBlur",
+            "expand",
+            int(FEATHERING_MARGIN * 1.85)
+        )
+        self.workflow.update(
+            "GrowMaskWithBlur",
+            "blur_radius",
+            FEATHERING_MARGIN / 4
+        )
+        self.server_manager.route_output(
+            self.workflow, "Save Image", self.stage, "end_step"
+        )
+
+    def log(self, *args, **kwargs):
+        self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
+
+    def inpaint(self, image: Image.Image, step: int) -> Image.Image:
+        self.workflow.update(
+            "LoadImage",
+            "image",
+            self.server_manager.upload_input_bytes(
+                self.__encode_png(image), f"inpaint_input_{step:05d}_.png", self.stage
+            ),
+        )
+        outputs = self.server_manager.run(self.workflow, f"IP-STEP {step} > CLIENT")
+        return Image.open(
+            io.BytesIO(
+                self.server_manager.fetch_output(outputs, self.workflow, "Save Image")
+            )
+        ).convert("RGB")
+
+    def __encode_png(self, image: Image.Image) -> bytes:
+        # Fastest zlib level, the upload is only read back once by the server
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", compress_level=1)
+        return buffer.getvalue()
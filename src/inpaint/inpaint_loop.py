@@ -1,12 +1,17 @@
 from PIL import Image
-import os
+from queue import Queue
 from preprocessors.preprocess_step_input import LayerShifter
-from comfy_api.client import ComfyClient
-from comfy_api.server import ComfyServer
-from workflow_wrapper.workflow import ComfyAPIWorkflow
+from preprocessors.roi_packer import RegionOfInterestPacker
+from inpaint.step_scheduler import StepScheduler
+from inpaint.checkpoint import InpaintCheckpoint
+from inpaint.comfy_backend import ComfyInpaintBackend
+from inpaint.opencv_backend import OpenCVInpaintBackend
+from comfy_api.server_manager import ComfyServerManager
+from utils.async_writer import AsyncImageWriter
+from interfaces.inpaint_backend_interface import InpaintBackendInterface
 from interfaces.project_interface import ProjectInterface
 from interfaces.logger_interface import LoggerInterface
-from constants import INPAINT_WORKFLOW_PATH, FEATHERING_MARGIN
+from constants import DEFAULT_INPAINT_BACKEND
 
 
 class InpaintLooper:
@@ -14,95 +19,137 @@ class InpaintLooper:
         self,
         project: ProjectInterface,
         logger: LoggerInterface,
+        server_manager: ComfyServerManager,
+        scheduler: StepScheduler,
         caller_prefix="INPAINT LOOP",
     ):
         self.project = project
         self.logger = logger
+        self.server_manager = server_manager
         self.caller_prefix = caller_prefix
 
-        self.log(
-            "Inpainting workflow location:",
-            os.path.join(project.repo_root, INPAINT_WORKFLOW_PATH),
-        )
-        input(
-            "\nYou can edit the workflow now if the default values are not working."
-            + "\nPress ENTER when done or to skip editing."
-            + self.logger.get_prompt()
-        )
-
-        self.shift_preprocessor = LayerShifter(project, logger)
-        self.workflow = ComfyAPIWorkflow(
-            project,
-            logger,
-            os.path.join(project.repo_root, INPAINT_WORKFLOW_PATH),
-            "INPAINT-LOOP > WF",
-        )
-        # NOTE: Change if workflow changes or custom nodes are updated
-        self.workflow.update(
-            "ImpactWildcardProcessor",
-            "wildcard_text",
-            project.config_file()["prompt_prepend"],
-        )
-        self.workflow.update(
-            "GrowMaskWithBlur",
-            "expand",
-            int(FEATHERING_MARGIN * 1.85)
-        )
-        self.workflow.update(
-            "GrowMaskWithBlur",
-            "blur_radius",
-            FEATHERING_MARGIN / 4
-        )
+        self.shift_preprocessor = LayerShifter(project, logger, scheduler)
+        self.backend = self.__create_backend()
 
     def log(self, *args, **kwargs):
         self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
 
-    def iterative_inpaint(self, n_iterations):
-        # Start with input image (salient objects should be removed already)
-        start_image_fullpath = self.shift_preprocessor.create_shifted_image(
-            Image.open(self.project.config_file()["input_image_path"])
+    def iterative_inpaint(self, n_iterations, step_queue: Queue = None):
+        """
+        Runs the shift -> inpaint loop n_iterations times.
+
+        Args:
+            n_iterations (int): The number of inpainting steps.
+            step_queue (Queue, optional): If given, the step number is put onto the queue as soon as
+                that step's layer slices are saved, and None is put onto it when the loop ends.
+        """
+        # In memory transfer: the step images are written to disk in the background, only for archival
+        image_writer = (
+            AsyncImageWriter()
+            if self.project.config_file().get("in_memory_transfer", False)
+            else None
+        )
+        self.shift_preprocessor.image_writer = image_writer
+        self.roi_packer = (
+            RegionOfInterestPacker(self.project, self.logger)
+            if self.project.config_file().get("roi_inpainting", False)
+            else None
         )
-        self.workflow.update(
-            "LoadImage", "image", os.path.basename(start_image_fullpath)
+
+        loop_error = None
+        checkpoint = InpaintCheckpoint(self.project, self.logger, n_iterations)
+        resume_step = checkpoint.get_resume_step(
+            self.shift_preprocessor.recreate_shifted_canvas
         )
 
         try:
-            server = ComfyServer(
-                self.project,
-                self.logger,
-                self.project.layer_outputs_dir(),
-                self.project.layer_outputs_dir(),
-                "INPAINT-LOOP > SERVER",
-            )
-            server.start()
-
-            for i in range(n_iterations):
-                client = ComfyClient(
-                    self.project, self.workflow, self.logger, f"IP-STEP {i+1} > CLIENT"
+            if resume_step:
+                # Steps up to resume_step are done, continue from the last one's output
+                for step in range(1, resume_step + 1):
+                    if step_queue:
+                        step_queue.put(step)
+                self.shift_preprocessor.step_count = checkpoint.get_shifter_state()[
+                    "step_count"
+                ]
+                start_image, _ = (
+                    self.shift_preprocessor.create_shifted_canvas(
+                        Image.open(checkpoint.get_end_image_path(resume_step))
+                    )
                 )
-                client.queue_workflow()
-                end_image_filename = f"end_step_{i+1:05d}_.png"
-                start_image_fullpath = self.shift_preprocessor.create_shifted_image(
-                    Image.open(
-                        os.path.join(
-                            self.project.layer_outputs_dir(), end_image_filename
-                        )
+            else:
+                # Start with input image (salient objects should be removed already)
+                start_image, _ = (
+                    self.shift_preprocessor.create_shifted_canvas(
+                        Image.open(self.project.config_file()["input_image_path"])
                     )
                 )
-                self.workflow.update(
-                    "LoadImage", "image", os.path.basename(start_image_fullpath)
+            self.__notify_step_saved(step_queue)
+
+            for i in range(resume_step, n_iterations):
+                end_image = self.__inpaint_step(i + 1, start_image)
+                end_image_fullpath = checkpoint.get_end_image_path(i + 1)
+                if image_writer:
+                    image_writer.write_image(end_image, end_image_fullpath)
+                else:
+                    end_image.save(end_image_fullpath)
+                checkpoint.record_step(
+                    i + 1,
+                    start_image,
+                    end_image,
+                    self.shift_preprocessor.step_count,
+                )
+
+                start_image, _ = (
+                    self.shift_preprocessor.create_shifted_canvas(end_image)
                 )
-                client.disconnect()
+                self.__notify_step_saved(step_queue)
 
         except Exception as e:
-            self.log(f"Error with comfy server/client during inpaint loop: {e}")
-            raise e
+            self.log(f"Error with inpaint backend during inpaint loop: {e}")
+            loop_error = e
+            raise
 
         finally:
-            try:
-                server.kill()
-                client.disconnect()
-            except Exception as e:
-                self.log(f"Error stopping comfy server/client: {e}")
-            
+            if step_queue:
+                step_queue.put(None)
+            if image_writer:
+                self.__close_image_writer(image_writer, loop_error)
+
         self.log("Inpaint loop: Completed")
+
+    def __close_image_writer(self, image_writer: AsyncImageWriter, loop_error: Exception = None):
+        """Waits for the step images to be written. A write error is only logged if the loop already failed."""
+        try:
+            image_writer.close()
+        except Exception as e:
+            if loop_error is None:
+                raise
+            self.log(f"Error writing step images after the inpaint loop failed: {e}", level="error")
+        finally:
+            self.shift_preprocessor.image_writer = None
+
+    def __create_backend(self) -> InpaintBackendInterface:
+        backend = self.project.config_file().get("inpaint_backend", DEFAULT_INPAINT_BACKEND)
+        if backend == "comfy":
+            return ComfyInpaintBackend(self.project, self.logger, self.server_manager)
+        if backend == "opencv":
+            return OpenCVInpaintBackend(self.project, self.logger)
+        raise ValueError(
+            f"Unknown inpaint_backend: {backend}. Expected one of: ['comfy', 'opencv']"
+        )
+
+    def __inpaint_step(self, step: int, start_image: Image.Image) -> Image.Image:
+        """Inpaints the shifted canvas, or only its gaps in ROI mode (see RegionOfInterestPacker)."""
+        if not self.roi_packer:
+            return self.backend.inpaint(start_image, step)
+
+        atlas = self.roi_packer.pack(start_image, self.shift_preprocessor.gap_mask)
+        if atlas is None:
+            self.log(f"IP-STEP {step}: Nothing to inpaint")
+            return start_image.convert("RGB")
+        return self.roi_packer.unpack(self.backend.inpaint(atlas, step), start_image)
+
+    def __notify_step_saved(self, step_queue: Queue):
+        if step_queue:
+            # The shifter has already advanced to the next step
+            step_queue.put(self.shift_preprocessor.step_count - 1)
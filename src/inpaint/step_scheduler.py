@@ -0,0 +1,166 @@
+import math
+from interfaces.project_interface import ProjectInterface
+from interfaces.logger_interface import LoggerInterface
+from constants import FEATHERING_MARGIN
+
+
+def get_displacement(velocity: float, ticks: int) -> int:
+    """
+    Returns how far a layer has moved after a number of ticks, in whole pixels.
+
+    The exact position (velocity * ticks) is rounded half away from zero, rather than summing
+    per-tick rounded velocities, so the error is at most half a pixel however many ticks there are.
+
+    Args:
+        velocity (float): The layer's velocity along one axis (px per tick), can be fractional.
+        ticks (int): The number of ticks (steps) moved.
+
+    Returns:
+        int: The signed displacement in px.
+    """
+    position = velocity * ticks
+    return int(math.copysign(math.floor(abs(position) + 0.5), position))
+
+
+class StepScheduler:
+    """
+    Decides how far each layer is shifted at each inpaint step.
+
+    Every tick (one of the project's total_steps), each layer moves by its exact (fractional)
+    velocity. Its whole-pixel position is its exact position rounded (see get_displacement), so
+    sub-pixel velocities don't freeze a layer or round it up to 1px per tick, and the rounding
+    error never accumulates. A layer is only shifted once the gap between its whole-pixel position
+    and where it was last shifted to is at least the project's "min_inpaint_gap" wide (or at the
+    last tick), and the layers that are due on the same tick are shifted and inpainted together in
+    one step. Ticks on which no layer is due are skipped, so slow layers are inpainted less often
+    and there are fewer inpaint steps for the same total displacement.
+
+    Without "min_inpaint_gap" in the project config, a layer is shifted as soon as its gap is wider
+    than the feathering margin (narrower strips would not extend its stitched panorama). A gap that
+    is still too narrow after the last tick is added to the layer's last shift, so each layer's
+    shifts add up to its exact displacement.
+
+    Both axes are accumulated, and a layer is scheduled by the gap along its dominant axis (the
+    axis it moves further along), so layers that move mostly or only vertically are shifted too.
+    A layer that moves horizontally is only shifted once its horizontal gap is also wider than the
+    feathering margin, as its stitched strips are as wide as its horizontal shifts.
+    """
+
+    def __init__(
+        self,
+        project: ProjectInterface,
+        logger: LoggerInterface,
+        caller_prefix="INPAINT > SCHEDULER",
+    ):
+        self.project = project
+        self.logger = logger
+        self.caller_prefix = caller_prefix
+        self.min_gap = int(self.project.config_file().get("min_inpaint_gap", 0))
+        # Stitched strips overlap by the feathering margin, so a narrower strip wouldn't extend the layer
+        self.min_shift = FEATHERING_MARGIN + 1
+        self.__set_schedule()
+
+    def log(self, *args, **kwargs):
+        self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
+
+    def n_steps(self) -> int:
+        """Returns the number of inpaint steps."""
+        return len(self.shifts)
+
+    def get_x_shift(self, step_index: int, layer_index: int) -> int:
+        """
+        Returns how far a layer is shifted in an inpaint step.
+
+        Args:
+            step_index (int): The 0-based index of the inpaint step.
+            layer_index (int): The 0-based index of the layer in the project config.
+
+        Returns:
+            int: The signed shift in px, 0 if the layer is not shifted in that step (or the step is past the last one).
+        """
+        if step_index >= len(self.shifts):
+            return 0
+        return self.shifts[step_index][layer_index][0]
+
+    def get_y_shift(self, step_index: int, layer_index: int) -> int:
+        """
+        Returns how far a layer is shifted vertically in an inpaint step.
+
+        Args:
+            step_index (int): The 0-based index of the inpaint step.
+            layer_index (int): The 0-based index of the layer in the project config.
+
+        Returns:
+            int: The signed shift in px, 0 if the layer is not shifted in that step (or the step is past the last one).
+        """
+        if step_index >= len(self.shifts):
+            return 0
+        return self.shifts[step_index][layer_index][1]
+
+    def __is_due(self, gap_x, gap_y, x_velocity, y_velocity, is_last_tick) -> bool:
+        """Whether a layer with the given gaps (px) since it was last shifted is shifted on this tick."""
+        gap = gap_x if abs(x_velocity) >= abs(y_velocity) else gap_y
+        if abs(gap) < self.min_shift or (abs(gap) < self.min_gap and not is_last_tick):
+            return False
+        # The layer's stitched strip has to extend its panorama
+        return not x_velocity or abs(gap_x) >= self.min_shift
+
+    def __carry_leftover(self, layer_index, velocity, total_ticks, shifted):
+        """
+        Adds what is left of a layer's displacement after its last shift (a gap too narrow to be
+        shifted on its own) to that shift, so the layer's total shift is its exact displacement.
+        """
+        leftover = [
+            get_displacement(velocity[axis], total_ticks) - shifted[axis] for axis in (0, 1)
+        ]
+        if leftover == [0, 0]:
+            return
+        last_step = next(
+            (
+                step_shifts
+                for step_shifts in reversed(self.shifts)
+                if step_shifts[layer_index] != (0, 0)
+            ),
+            None,
+        )
+        if last_step is None:
+            self.log(
+                f"Layer {layer_index+1} moves {leftover[0]}px, {leftover[1]}px in total,",
+                f"less than a {self.min_shift}px shift, so it isn't shifted",
+                level="warning",
+            )
+            return
+        shift_x, shift_y = last_step[layer_index]
+        last_step[layer_index] = (shift_x + leftover[0], shift_y + leftover[1])
+
+    def __set_schedule(self):
+        config = self.project.config_file()
+        layer_configs = config["layers"]
+        total_ticks = int(config["total_steps"])
+        velocities = [layer["velocity"] for layer in layer_configs]
+        # Where each layer was last shifted to (px)
+        shifted = [[0, 0] for _ in velocities]
+
+        self.shifts = []
+        for tick in range(1, total_ticks + 1):
+            is_last_tick = tick == total_ticks
+            step_shifts = []
+            for layer_index, (x_velocity, y_velocity) in enumerate(velocities):
+                gap_x = get_displacement(x_velocity, tick) - shifted[layer_index][0]
+                gap_y = get_displacement(y_velocity, tick) - shifted[layer_index][1]
+                if self.__is_due(gap_x, gap_y, x_velocity, y_velocity, is_last_tick):
+                    step_shifts.append((gap_x, gap_y))
+                    shifted[layer_index][0] += gap_x
+                    shifted[layer_index][1] += gap_y
+                else:
+                    step_shifts.append((0, 0))
+            if any(shift != (0, 0) for shift in step_shifts):
+                self.shifts.append(step_shifts)
+
+        for layer_index, velocity in enumerate(velocities):
+            self.__carry_leftover(layer_index, velocity, total_ticks, shifted[layer_index])
+
+        self.log(
+            f"Inpaint schedule: {len(self.shifts)} inpaint steps for {total_ticks} steps",
+            f"(min inpaint gap: {self.min_gap}px)",
+        )
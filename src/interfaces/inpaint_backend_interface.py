@@ -0,0 +1,20 @@
+from typing import Protocol
+from PIL.Image import Image as PILImage
+
+
+class InpaintBackendInterface(Protocol):
+    caller_prefix: str  # The prefix to use for logging.
+
+    def inpaint(self, image: PILImage, step: int) -> PILImage:
+        """
+        Fills the transparent pixels of an image.
+
+        Args:
+            image (PILImage): An RGBA image, transparent where it should be inpainted. Either the
+                whole shifted canvas of a step or, in ROI mode, the packed gap regions of the step.
+            step (int): The inpaint step number (starting at 1), for naming and logging.
+
+        Returns:
+            PILImage: The inpainted RGB image, same size as the input image.
+        """
+        ...
@@ -1,4 +1,5 @@
 from typing import Protocol, TypedDict
+from utils.panorama import TiledPanorama
 from moviepy.editor import VideoClip
 from PIL.Image import Image as PILImage
 from interfaces.project_interface import ProjectInterface
@@ -10,7 +11,7 @@ LayerConfigDict = TypedDict(
         "height": int,  # The height of the layer in pixels.
         "distance": int,  # The arbitrary distance from viewer of the layer (relative to other layers, not in accordance with any unit system).
         "distance_ratio": float,  # The ratio of the distance-from-viewer of the layer relative to the total distance-from-viewer of all layers.
-        "velocity": list[int],  # The velocity vector of the layer.
+        "velocity": list[float],  # The velocity vector of the layer (px per step, can be fractional).
         "steps_x": int,  # The number of steps to move the layer in the x-direction.
         "steps_y": int,  # The number of steps to move the layer in the y-direction.
     },
@@ -28,6 +29,18 @@ ImageDict = TypedDict(
     },
 )
 
+CroppedImageDict = TypedDict(
+    "CroppedImageDict",
+    {
+        "width": int,  # The width of the cropped image in pixels.
+        "filename": str,  # The filename of the image.
+        "basename": str,  # The basename of the image (filename without extension).
+        "ext": str,  # The extension of the image (e.g., 'png').
+        "path": str,  # The path to the image.
+        "fullpath": str,  # The full path to the image (path + filename).
+    },
+)
+
 PathPartsDict = TypedDict(
     "ImagesPathPartsDict",
     {
@@ -52,29 +65,29 @@ class LayerInterface(Protocol):
         PathPartsDict
     ]  # A list of step images for the layer. Represented by dictionaries containing the filename, fullpath, and other path parts for the image.
     cropped_step_images: list[
-        ImageDict
-    ]  # A list of cropped step images for the layer. Represented by dictionaries containing the PIL image object, filename, and other path parts for the image.
+        CroppedImageDict
+    ]  # A list of cropped step images for the layer. Represented by dictionaries containing the image's width, filename, and other path parts for the image (the pixels are read from the file when needed).
     original_layer: ImageDict  # The original layer image. Represented by a dictionary containing the PIL image object, filename, and other path parts for the image.
 
-    def get_x_velocity(self) -> int:
+    def get_x_velocity(self) -> float:
         """
         Returns the x-component of the layer's velocity vector.
 
         The x-component of the velocity vector is the first element in the velocity vector list.
 
         Returns:
-            int: The x-component of the layer's velocity vector.
+            float: The x-component of the layer's velocity vector, exact (not rounded to whole pixels).
         """
         ...
 
-    def get_y_velocity(self) -> int:
+    def get_y_velocity(self) -> float:
         """
         Returns the y-component of the layer's velocity vector.
 
         The y-component of the velocity vector is the second element in the velocity vector list.
 
         Returns:
-            int: The y-component of the layer's velocity vector.
+            float: The y-component of the layer's velocity vector, exact (not rounded to whole pixels).
         """
         ...
 
@@ -99,22 +112,106 @@ class LayerInterface(Protocol):
         """Stitch the cropped step images together to create the final layer output.
 
         The order of the images should be from the first step to the last step.
-        The output image should be saved in the project directory with the name {layer_prefix}_stitched_inpainted_regions.png.
+        The images are placed as tiles of a virtual panorama (see get_panorama) rather than pasted onto one canvas.
+        If "export_stitched_layers" is set in the project config, the stitched image is also saved in the
+        project directory with the name {layer_prefix}_stitched_inpainted_regions.png.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+    def get_x_offset(self, t: float) -> int:
+        """
+        Returns the x-coordinate of the left edge of the layer's viewport in the stitched image at time t.
+
+        Args:
+            t (float): The time in seconds.
+
+        Returns:
+            int: The x-offset in pixels.
+        """
+        ...
+
+    def get_panorama(self) -> TiledPanorama:
+        """
+        Returns the stitched image of the layer as a virtual panorama, from which any
+        window of columns can be assembled without holding the full stitched image.
+
+        Base layers are RGB, object layers are RGBA.
+
+        Returns:
+            TiledPanorama: The layer's panorama.
+        """
+        ...
+
+    def get_stitched_fullpath(self) -> str:
+        """
+        Returns the full path to the memory-mapped stitched image (.npy) of the layer.
+        The file is written from the panorama the first time it is requested.
+
+        Returns:
+            str: The full path to the stitched image panorama.
+        """
+        ...
+
+    def load_stitched_panorama(self) -> None:
+        """
+        Loads the layer's panorama from the stitched image (.npy) written by get_stitched_fullpath
+        in an earlier run, instead of cropping and stitching the steps again.
+        The panorama is memory-mapped, so only the windows that are rendered are read.
+
+        Returns:
+            None
+        """
+        ...
+
+    def start_streaming_stitch(self, total_steps: int) -> None:
+        """
+        Prepares the layer to be cropped and stitched one step at a time, while the inpaint loop is running.
+
+        Args:
+            total_steps (int): The number of inpainting steps.
+
+        Returns:
+            None
+        """
+        ...
+
+    def append_step_image(self, step_count: int) -> None:
+        """
+        Crops the step image of the given step and appends it to the layer's panorama.
+        Used instead of create_cropped_steps and stitch_cropped_steps when stitching is streamed.
 
         Args:
+            step_count (int): The step number whose layer slices were just saved.
+
+        Returns:
             None
+        """
+        ...
+
+    def finish_streaming_stitch(self) -> None:
+        """
+        Finalizes the layer's panorama once every step has been appended.
 
         Returns:
             None
         """
+        ...
 
-    def create_layer_videoclip(self) -> VideoClip:
+    def create_layer_videoclip(self, frame_profiler: "FrameProfiler" = None) -> VideoClip:
         """
         Creates a video clip from the stitched image, panning from left to right.
 
         The duration is uniform for all layers and is calculated as the total number of steps
         multiplied by the number of seconds per step.
 
+        Args:
+            frame_profiler (FrameProfiler, optional): If given, the time of every frame (and mask) fetch is recorded.
+
         Returns:
             VideoClip: The created video clip.
         """
@@ -7,7 +7,7 @@ class LoggerInterface(Protocol):
     PREFIX_COLOR: str  # The color of the log prefix. A termcolor color.
     log_file_fullpath: str  # The full path to the log file for this logging instance's session.
 
-    def log(self, *args, print_to_console: bool = DEV, write_to_log: bool = True, pad_with_rules: bool = True):
+    def log(self, *args, print_to_console: bool = DEV, write_to_log: bool = True, pad_with_rules: bool = True, level: str = "info"):
         """
         Automatically parses and formats the message, regardless of type or number of
         arguments and prints it and/or writes it to the log file.
@@ -17,9 +17,18 @@ class LoggerInterface(Protocol):
             print_to_console: Whether to print the message to the console. Default is DEV.
             write_to_log: Whether to write the message to the log file. Default is True.
             pad_with_rules: Whether to pad the message with horizontal rules. Default is True.
+            level: "debug", "info", "warning" or "error". Messages below the logger's level are dropped. Default is "info".
         """
         ...
 
+    def set_level(self, level: str):
+        """Sets the minimum level of the messages that are logged ("debug", "info", "warning" or "error")."""
+        ...
+
+    def flush(self):
+        """Waits until every message logged so far is printed and written."""
+        ...
+
     def get_prompt(self) -> str:
         """Returns the prompt string for the logger.
         
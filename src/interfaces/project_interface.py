@@ -8,11 +8,13 @@ class ProjectInterface(Protocol):
     author: str  # The author of the project.
     project_dir_path: str  # The path to the project directory.
     repo_root: str  # The root directory of the project repository.
+    interactive: bool  # False when the project runs headless (from a project spec), i.e., nothing may prompt for input.
 
     def update_config(self, key: str, value: any) -> None:
         """
-        Update the configuration file with the given key-value pair.
-        The change will be written to the actual configuration file.
+        Update the configuration with the given key-value pair.
+        The change is visible immediately and written to the actual configuration file
+        by the next `save_config` call (or when the interpreter exits).
 
         Args:
             key (str): The key to update in the configuration file.
@@ -23,9 +25,24 @@ class ProjectInterface(Protocol):
         """
         ...
 
+    def save_config(self) -> None:
+        """
+        Writes the pending configuration updates to the configuration file, atomically and
+        under a file lock, so concurrent writers can't corrupt it.
+
+        Returns:
+            None
+        """
+        ...
+
     def config_file(self) -> dict:
         """
-        Reads the configuration file and returns its contents as a dictionary.
+        Returns the contents of the configuration file as a dictionary.
+
+        The file is only read once. Every call returns a deep copy of the cached dictionary
+        (including pending updates), so modifying it doesn't change the configuration (use
+        `update_config`). Read it once per call or in `__init__`, rather than in per-step or
+        per-frame loops.
 
         If the configuration file does not exist, it will be created by calling the `set_config` method.
 
@@ -138,4 +155,17 @@ class ProjectInterface(Protocol):
         Returns:
             str: The path to the stitched objects directory.
         """
-        ...
\ No newline at end of file
+        ...
+
+    def render_segments_dir(self) -> str:
+        """
+        Returns the path to the directory where the segments of a segmented render are stored.
+
+        The path is determined by joining the project directory path with the
+        RENDER_SEGMENTS_DIR constant. If the directory does not exist, it will
+        be created using the check_make_dir function.
+
+        Returns:
+            str: The path to the render segments directory.
+        """
+        ...
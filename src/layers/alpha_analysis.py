@@ -0,0 +1,128 @@
+import os
+import numpy as np
+from PIL import Image
+
+
+def binary_alpha_mask(rgba: np.ndarray) -> np.ndarray:
+    """
+    Converts the alpha channel of an RGBA array to a binary mask (1 where alpha > 0, else 0).
+
+    Args:
+        rgba (np.ndarray): A (height, width, 4) array.
+
+    Returns:
+        np.ndarray: A (height, width) uint8 array of 0s and 1s.
+    """
+    return (rgba[:, :, 3] > 0).astype(np.uint8)
+
+
+def bounding_box(mask: np.ndarray):
+    """
+    Returns the tight bounding box of the non-zero pixels in a mask as (left, top, right, bottom),
+    with right and bottom exclusive (same convention as PIL's crop box). None if the mask is empty.
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
+class AlphaLayerAnalysis:
+    """
+    Analysis of a salient object's alpha layer, computed with array operations and cached
+    in a .npz file next to the alpha layer PNG.
+
+    The cache is invalidated when the alpha layer PNG's size or modification time changes.
+
+    Attributes:
+        mask: (height, width) uint8 array, 1 where the alpha layer is not fully transparent.
+        bounding_box: (left, top, right, bottom) of the non-transparent pixels, or None if there are none.
+        row_occupancy: (height,) array with the number of non-transparent pixels in each row.
+        row_first_x: (height,) array with the x-coordinate of the first non-transparent pixel in each row, -1 if the row is empty.
+        lowest_non_alpha_pixel: (x, y) of the first non-transparent pixel in the lowest occupied row, or None.
+    """
+
+    def __init__(self, alpha_layer_fullpath: str):
+        self.alpha_layer_fullpath = alpha_layer_fullpath
+        self.cache_fullpath = (
+            os.path.splitext(alpha_layer_fullpath)[0] + "-alpha_analysis.npz"
+        )
+        if not self.__load_cache():
+            self.__analyze()
+            self.__save_cache()
+
+    def parent_layer_index(self, layer_height_breakpoints: list[int]) -> int:
+        """
+        Returns the index of the first layer breakpoint below the lowest non-alpha pixel.
+
+        Defaults to the last (lowest) layer if the lowest non-alpha pixel isn't above any of the breakpoints.
+
+        Args:
+            layer_height_breakpoints (list[int]): The y-coordinates at which each layer starts.
+
+        Returns:
+            int: The parent layer index.
+        """
+        index = int(
+            np.searchsorted(
+                layer_height_breakpoints, self.lowest_non_alpha_pixel[1], side="right"
+            )
+        )
+        return min(index, len(layer_height_breakpoints) - 1)
+
+    def __analyze(self):
+        rgba = np.asarray(Image.open(self.alpha_layer_fullpath).convert("RGBA"))
+        self.mask = binary_alpha_mask(rgba)
+        self.bounding_box = bounding_box(self.mask)
+        self.row_occupancy = self.mask.sum(axis=1, dtype=np.int64)
+        self.row_first_x = np.where(
+            self.row_occupancy > 0, self.mask.argmax(axis=1), -1
+        )
+
+        occupied_rows = np.flatnonzero(self.row_occupancy)
+        if occupied_rows.size == 0:
+            self.lowest_non_alpha_pixel = None
+        else:
+            y = int(occupied_rows[-1])
+            self.lowest_non_alpha_pixel = (int(self.row_first_x[y]), y)
+
+    def __get_source_signature(self) -> np.ndarray:
+        stat = os.stat(self.alpha_layer_fullpath)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def __load_cache(self) -> bool:
+        if not os.path.exists(self.cache_fullpath):
+            return False
+        try:
+            with np.load(self.cache_fullpath) as cache:
+                if not np.array_equal(
+                    cache["source_signature"], self.__get_source_signature()
+                ):
+                    return False
+                self.mask = cache["mask"]
+                self.row_occupancy = cache["row_occupancy"]
+                self.row_first_x = cache["row_first_x"]
+                bbox = cache["bounding_box"]
+                lowest = cache["lowest_non_alpha_pixel"]
+        except (OSError, KeyError, ValueError):
+            return False
+
+        self.bounding_box = tuple(int(v) for v in bbox) if bbox.size else None
+        self.lowest_non_alpha_pixel = (
+            (int(lowest[0]), int(lowest[1])) if lowest.size else None
+        )
+        return True
+
+    def __save_cache(self):
+        np.savez_compressed(
+            self.cache_fullpath,
+            source_signature=self.__get_source_signature(),
+            mask=self.mask,
+            row_occupancy=self.row_occupancy,
+            row_first_x=self.row_first_x,
+            bounding_box=np.array(self.bounding_box or [], dtype=np.int64),
+            lowest_non_alpha_pixel=np.array(
+                self.lowest_non_alpha_pixel or [], dtype=np.int64
+            ),
+        )
@@ -1,11 +1,15 @@
 import os
+import numpy as np
 from PIL import Image
-from moviepy.editor import VideoClip, ImageClip
+from moviepy.editor import VideoClip
 from interfaces.project_interface import ProjectInterface
 from interfaces.layer_interface import LayerInterface
 from interfaces.logger_interface import LoggerInterface
 from utils.update_path_parts import update_path_parts
 from utils.check_make_dir import check_make_dir
+from utils.panorama import TiledPanorama, MemmapPanorama
+from inpaint.step_scheduler import StepScheduler
+from parallax_video.frame_profiler import FrameProfiler, profile_frames
 from termcolor import colored
 
 from constants import (
@@ -16,10 +20,11 @@ from constants import (
 
 class BaseLayer(LayerInterface):
     def __init__(
-        self, project: ProjectInterface, logger: LoggerInterface, layer_config, name_prefix, layer_index, caller_prefix="BASE LAYER"
+        self, project: ProjectInterface, logger: LoggerInterface, layer_config, name_prefix, layer_index, scheduler: StepScheduler, caller_prefix="BASE LAYER"
     ):
         self.project = project
         self.logger = logger
+        self.scheduler = scheduler
         self.layer_config = layer_config
         self.name_prefix = name_prefix
         self.index = layer_index
@@ -28,9 +33,8 @@ class BaseLayer(LayerInterface):
         self.__set_original_layer()
         self.set_step_images()
 
-        self.duration = (
-            self.project.config_file()["total_steps"] * self.project.config_file()["seconds_per_step"]
-        )
+        config = self.project.config_file()
+        self.duration = config["total_steps"] * config["seconds_per_step"]
 
         self.output_vid_width = self.original_layer["image"].width
     
@@ -38,12 +42,11 @@ class BaseLayer(LayerInterface):
         self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
 
     def get_x_velocity(self):
-        # Add logic to clean, adjust, or change type of velocity
-        return int(self.layer_config["velocity"][0])
+        # Exact, the whole-pixel shift of each step is derived from it by the scheduler
+        return float(self.layer_config["velocity"][0])
 
     def get_y_velocity(self):
-        # Add logic to clean, adjust, or change type of velocity
-        return int(self.layer_config["velocity"][1])
+        return float(self.layer_config["velocity"][1])
 
     def get_final_layer_height(self):
         # Add cleaning, adjusting, or type changing logic
@@ -53,7 +56,7 @@ class BaseLayer(LayerInterface):
         width = 0
         # Add the width of all cropped inpainted regions minus the feathering margin
         for image in self.cropped_step_images:
-            width += image["image"].width
+            width += image["width"]
             width -= FEATHERING_MARGIN
 
         # Add the length of the original layer onto which the inpainted regions are stitched
@@ -64,6 +67,56 @@ class BaseLayer(LayerInterface):
 
         return width
 
+    def __get_step_shift(self, step_count):
+        # The inpainted strip in a step's slice is as wide as the shift of the step before it
+        return self.scheduler.get_x_shift(step_count - 2, self.index - 1)
+
+    def __crop_step_image(self, step_image, shift):
+        cropped_step_image = {}
+        image = Image.open(step_image["fullpath"])
+        # TODO: Port full vector range implementation from preprocess code
+        width = abs(shift)
+        if shift < 0:
+            x = image.width - width
+        else:
+            x = 0
+        y = 0
+        height = image.height
+
+        cropped_image = image.crop((x, y, x + width, y + height))
+        # Only the width is kept, the panorama reads the saved strip when a frame needs it
+        cropped_step_image["width"] = cropped_image.width
+        filename = f"cropped-{step_image['filename']}"
+        output_dir = os.path.join(
+            self.project.cropped_steps_dir(), f"{self.name_prefix}_cropped_steps"
+        )
+        check_make_dir(output_dir)
+        fullpath = os.path.join(output_dir, filename)
+        cropped_image.save(fullpath)
+        update_path_parts(cropped_step_image, fullpath)
+        return cropped_step_image
+
+    def __start_panorama(self, width):
+        # Virtual panorama, the cropped images are placed by offset instead of pasted onto one giant canvas
+        self.panorama = TiledPanorama(self.get_final_layer_height(), width, 3)
+        self.panorama_fullpath = None
+        self.slide_distance = 0
+
+        self.panorama.add_tile(
+            np.asarray(self.original_layer["image"].convert("RGB")), 0
+        )
+        self.next_tile_x = self.original_layer["image"].width - FEATHERING_MARGIN
+
+    def __add_panorama_tile(self, cropped_step_image):
+        width = cropped_step_image["width"]
+        self.panorama.add_tile_file(cropped_step_image["fullpath"], self.next_tile_x, width)
+        self.next_tile_x += width - FEATHERING_MARGIN
+        self.slide_distance += width - FEATHERING_MARGIN
+
+    def __finish_panorama(self):
+        if self.project.config_file().get("export_stitched_layers", False):
+            self.export_stitched_image()
+
     def __set_original_layer(self):
         for original_layer in os.listdir(self.project.original_layers_dir()):
             # E.g., if the layer is layer_1, the original layer should be 1_original_layer.png
@@ -99,71 +152,118 @@ class BaseLayer(LayerInterface):
     def create_cropped_steps(self):
         self.cropped_step_images = []
 
-        for step_image in self.step_images:
+        for step_count, step_image in enumerate(self.step_images, start=1):
             # NOTE: Ignore the first image because it's just the slices of the original input image
-            if step_image == self.step_images[0]:
+            if step_count == 1:
+                continue
+            # The layer wasn't shifted in the step before, so there is no new strip
+            shift = self.__get_step_shift(step_count)
+            if not shift:
                 continue
 
-            cropped_step_image = {}
-            image = Image.open(step_image["fullpath"])
-            # TODO: Port full vector range implementation from preprocess code
-            width = abs(self.get_x_velocity())
-            if self.get_x_velocity() < 0:
-                x = image.width - width
-            else:
-                x = 0
-            y = 0
-            height = image.height
-
-            cropped_image = image.crop((x, y, x + width, y + height))
-            cropped_step_image["image"] = cropped_image
-            filename = f"cropped-{step_image['filename']}"
-            output_dir = os.path.join(
-                self.project.cropped_steps_dir(), f"{self.name_prefix}_cropped_steps"
-            )
-            check_make_dir(output_dir)
-            fullpath = os.path.join(output_dir, filename)
-            cropped_image.save(fullpath)
-            update_path_parts(cropped_step_image, fullpath)
-            self.cropped_step_images.append(cropped_step_image)
+            self.cropped_step_images.append(self.__crop_step_image(step_image, shift))
 
     def stitch_cropped_steps(self):
         # Determine the width and height of the final stitched image
-        width = self.get_final_layer_width()
-        height = self.get_final_layer_height()
+        self.__start_panorama(self.get_final_layer_width())
 
-        # Canvas for the stitched image
-        stitched_image = Image.new("RGB", (width, height))
+        for image_dict in self.cropped_step_images:
+            self.__add_panorama_tile(image_dict)
 
-        # Paste the cropped images onto the stitched image
-        x_offset = 0
-        stitched_image.paste(self.original_layer["image"], (x_offset, 0))
-        x_offset += self.original_layer["image"].width
-        x_offset -= FEATHERING_MARGIN
+        self.__finish_panorama()
 
-        for image_dict in self.cropped_step_images:
-            image = image_dict["image"]
+    def start_streaming_stitch(self, total_steps):
+        """
+        Prepares the layer to be cropped and stitched one step at a time while the inpaint loop is still running.
 
-            stitched_image.paste(image, (x_offset, 0))
-            x_offset += image.width
-            x_offset -= FEATHERING_MARGIN
-            self.slide_distance += image.width - FEATHERING_MARGIN
+        Args:
+            total_steps (int): The number of inpainting steps, used to size the panorama up front.
+        """
+        self.step_images = []
+        self.cropped_step_images = []
+        tiles_width = sum(
+            abs(shift) - FEATHERING_MARGIN
+            for shift in (
+                self.scheduler.get_x_shift(step_index, self.index - 1)
+                for step_index in range(total_steps)
+            )
+            if shift
+        )
+        self.__start_panorama(
+            self.original_layer["image"].width - 2 * FEATHERING_MARGIN + tiles_width
+        )
+
+    def append_step_image(self, step_count):
+        """
+        Crops the step image of the given step and appends it to the layer's panorama.
+
+        Args:
+            step_count (int): The step number whose layer slices were just saved by the shift preprocessor.
+        """
+        step_image = {}
+        update_path_parts(
+            step_image,
+            os.path.join(
+                self.project.layer_outputs_dir(),
+                f"{self.name_prefix}_{step_count:05d}_.png",
+            ),
+        )
+        self.step_images.append(step_image)
+        # NOTE: Ignore the first image because it's just the slices of the original input image
+        if step_count == 1:
+            return
+        shift = self.__get_step_shift(step_count)
+        if not shift:
+            return
+
+        cropped_step_image = self.__crop_step_image(step_image, shift)
+        self.cropped_step_images.append(cropped_step_image)
+        self.__add_panorama_tile(cropped_step_image)
 
-        # Save the stitched image
+    def finish_streaming_stitch(self):
+        # In case the loop ended early, the panorama ends where the last step ends
+        self.panorama.width = self.get_final_layer_width()
+        self.__finish_panorama()
+
+    def export_stitched_image(self):
         output_filename = f"{self.name_prefix}_stitched_inpainted_regions.png"
         output_fullpath = os.path.join(
             self.project.stitched_inpainted_dir(), output_filename
         )
-        stitched_image.save(output_fullpath)
+        Image.fromarray(self.panorama.to_array()).save(output_fullpath)
 
-        self.stitched_inpainted_regions = {
-            "image": stitched_image,
-        }
+        self.stitched_inpainted_regions = {}
         update_path_parts(self.stitched_inpainted_regions, output_fullpath)
+        self.log(f"Stitched image saved to: {output_fullpath}")
+
+    def get_x_offset(self, t):
+        return int(self.slide_distance * (t / self.duration))
+
+    def get_panorama(self):
+        return self.panorama
+
+    def get_stitched_fullpath(self):
+        # Only written to disk when something needs it (e.g., segmented render workers)
+        if not self.panorama_fullpath:
+            self.panorama_fullpath = self.__get_panorama_npy_path()
+            self.panorama.export_memmap(self.panorama_fullpath)
+        return self.panorama_fullpath
 
-    def create_layer_videoclip(self):
-        image_clip = ImageClip(self.stitched_inpainted_regions["fullpath"])
+    def load_stitched_panorama(self):
+        self.panorama_fullpath = self.__get_panorama_npy_path()
+        self.panorama = MemmapPanorama(self.panorama_fullpath)
+        # The panorama is the original layer plus the slide distance, minus the first and last feathering margin
+        self.slide_distance = (
+            self.panorama.width - self.original_layer["image"].width + 2 * FEATHERING_MARGIN
+        )
+
+    def __get_panorama_npy_path(self):
+        return os.path.join(
+            self.project.stitched_inpainted_dir(),
+            f"{self.name_prefix}_stitched_inpainted_regions.npy",
+        )
 
+    def create_layer_videoclip(self, frame_profiler: FrameProfiler = None):
         def make_frame(t):
             if DEV and t % 10 == 0 and t != 0:
                 print(
@@ -176,10 +276,13 @@ class BaseLayer(LayerInterface):
                         f"Layer_{self.name_prefix} current x-coordinate (self.slide_distance * (t / duration): ",
                         "light_blue",
                     ),
-                    f"{int(self.slide_distance * (t / self.duration))}",
+                    f"{self.get_x_offset(t)}",
                 )
 
-            x = int(self.slide_distance * (t / self.duration))
-            return image_clip.get_frame(t)[:, x : x + self.output_vid_width]
+            x = self.get_x_offset(t)
+            # Assemble the viewport from only the tiles that overlap it
+            return self.panorama.window(x, self.output_vid_width)
 
+        if frame_profiler:
+            make_frame = profile_frames(make_frame, frame_profiler, f"{self.name_prefix} frame")
         return VideoClip(make_frame, duration=self.duration)
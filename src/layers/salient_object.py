@@ -1,4 +1,4 @@
-from moviepy.editor import VideoClip, ImageClip
+from moviepy.editor import VideoClip
 from moviepy.video.fx import mask_color
 from interfaces.project_interface import ProjectInterface
 from interfaces.layer_interface import LayerInterface
@@ -6,12 +6,14 @@ from interfaces.logger_interface import LoggerInterface
 import os
 import shutil
 import numpy as np
-import cv2
 from PIL import Image
-from comfy_api.client import ComfyClient
-from comfy_api.server import ComfyServer
+from comfy_api.server_manager import ComfyServerManager
 from workflow_wrapper.workflow import ComfyAPIWorkflow
 from utils.update_path_parts import update_path_parts
+from utils.panorama import TiledPanorama, MemmapPanorama
+from layers.alpha_analysis import AlphaLayerAnalysis, binary_alpha_mask
+from inpaint.step_scheduler import get_displacement
+from parallax_video.frame_profiler import FrameProfiler, profile_frames
 from termcolor import colored
 from constants import (
     SALIENT_OBJECTS_WORKFLOW_PATH,
@@ -29,10 +31,12 @@ class SalientObjectLayer(LayerInterface):
         logger: LoggerInterface,
         prompt_tags: list[str],
         object_index: int,
+        server_manager: ComfyServerManager,
         caller_prefix="OBJECT LAYER",
     ):
         self.project = project
         self.logger = logger
+        self.server_manager = server_manager
         self.index = object_index
         self.caller_prefix = f"{caller_prefix} {self.index + 1}"
         self.name_prefix = f"salient_object_{self.index + 1}"
@@ -72,30 +76,38 @@ class SalientObjectLayer(LayerInterface):
         self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
 
     def extract(self):
-        # Construct comfy client with the custom workflow
         try:
-            server = ComfyServer(
-                self.project,
-                self.logger,
-                self.project.project_dir_path,
-                self.project.project_dir_path,
-                "OBJECT-SEG > SERVER",
+            self.workflow.update(
+                "LoadImage",
+                "image",
+                self.server_manager.upload_input(
+                    self.project.config_file()["input_image_path"], self.name_prefix
+                ),
             )
-            server.start()
-
-            client = ComfyClient(
-                self.project, self.workflow, self.logger, "OBJECT-SEG > CLIENT"
+            outputs = self.server_manager.run(self.workflow, "OBJECT-SEG > CLIENT")
+
+            # Download the outputs to the paths the rest of the layer expects
+            self.server_manager.download_output(
+                outputs,
+                self.workflow,
+                "Save Inpainted Base Layer",
+                os.path.join(
+                    self.project.project_dir_path,
+                    f"{BASE_LAYER_WITHOUT_OBJECTS_PREFIX}-{self.index+1}{self.filename_suffix}",
+                ),
+            )
+            self.server_manager.download_output(
+                outputs,
+                self.workflow,
+                "Save Alpha Layer",
+                os.path.join(
+                    self.project.project_dir_path,
+                    f"{SALIENT_OBJECT_ALPHA_LAYER_PREFIX}-{self.index+1}{self.filename_suffix}",
+                ),
             )
-            client.queue_workflow()
         except Exception as e:
-            self.log(f"Error starting comfy server/client: {e}")
+            self.log(f"Error with comfy server/session during object extraction: {e}")
             raise e
-        finally:
-            try:
-                server.kill()
-                client.disconnect()
-            except Exception as e:
-                self.log(f"Error stopping comfy server/client: {e}")
 
         # Set the inpainted base image (with objects removed) as the new input image
         if "input_image_original_path" not in self.project.config_file():
@@ -130,47 +142,43 @@ class SalientObjectLayer(LayerInterface):
         self.__add_self_to_config()
 
     def create_cropped_steps(self) -> None:
-        self.slide_distance = abs(self.get_x_velocity() * self.project.config_file()["total_steps"])
-        self.duration = int(
-            self.project.config_file()["total_steps"] * self.project.config_file()["seconds_per_step"]
+        # Rounded from the exact total, like the parent layer's shifts (see StepScheduler)
+        config = self.project.config_file()
+        self.slide_distance = abs(
+            get_displacement(self.get_x_velocity(), config["total_steps"])
         )
+        self.duration = int(config["total_steps"] * config["seconds_per_step"])
         self.output_vid_width = self.original_layer["image"].width
 
-        # Create an empty alpha image with height the same as the base image and width = original + slide distance
-        width = (self.project.config_file()["total_steps"] * abs(self.get_x_velocity())) - (
-            (self.project.config_file()["total_steps"] + 1) * FEATHERING_MARGIN
-        )
-        alpha_image = Image.new(
-            "RGBA",
-            (width, self.original_layer["image"].height),
-            (0, 0, 0, 0),
-        )
-        self.cropped_step_images = [
-            {
-                "image": alpha_image,
-            }
-        ]
+        # The extension of the object layer (width = slide distance) is fully transparent,
+        # so it is an empty tile of the panorama rather than an allocated alpha image
+        self.cropped_step_images = []
 
     def stitch_cropped_steps(self) -> None:
         width = self.get_final_layer_width()
         height = self.get_final_layer_height()
 
-        stitched_image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        self.panorama = TiledPanorama(height, width, 4)
+        self.panorama_fullpath = None
 
         x_offset = 0
-        stitched_image.paste(self.original_layer["image"], (x_offset, 0))
+        self.panorama.add_tile(
+            np.asarray(self.original_layer["image"].convert("RGBA")), x_offset
+        )
         x_offset += self.original_layer["image"].width - FEATHERING_MARGIN
-        stitched_image.paste(self.cropped_step_images[0]["image"], (x_offset, 0))
+        self.panorama.add_transparent_tile(x_offset)
 
+        if self.project.config_file().get("export_stitched_layers", False):
+            self.export_stitched_image()
+
+    def export_stitched_image(self):
         output_filename = f"{self.name_prefix}_stitched_alpha_layer.png"
         output_fullpath = os.path.join(
             self.project.stitched_objects_dir(), output_filename
         )
-        stitched_image.save(output_fullpath)
+        Image.fromarray(self.panorama.to_array(), "RGBA").save(output_fullpath)
 
-        self.stitched = {
-            "image": stitched_image,
-        }
+        self.stitched = {}
         update_path_parts(self.stitched, output_fullpath)
 
         self.log(
@@ -178,24 +186,12 @@ class SalientObjectLayer(LayerInterface):
             pad_with_rules=False,
         )
 
-    def create_layer_videoclip(self) -> VideoClip:
-        image_clip = ImageClip(self.stitched["fullpath"])
-
-        # Convert alpha channel to binary mask
-        cv2_image = cv2.imread(self.stitched["fullpath"], cv2.IMREAD_UNCHANGED)
-        height, width, _ = cv2_image.shape
-        alpha_channel = cv2_image[:, :, 3]
-        mask = np.zeros((height, width), dtype=np.uint8)
-        for i in range(height):
-            for j in range(width):
-                if alpha_channel[i, j] > 0:
-                    mask[i, j] = 1
-
+    def create_layer_videoclip(self, frame_profiler: FrameProfiler = None) -> VideoClip:
         def make_mask_frame(t):
             # Calculate the position based on time
-            x = round(self.slide_distance * (t / self.duration))
-            # Take a cropping of the mask from x to x + self.output_vid_width
-            return mask[:, x : x + self.output_vid_width]
+            x = self.get_x_offset(t)
+            # Convert the alpha channel of the viewport (x to x + self.output_vid_width) to a binary mask
+            return binary_alpha_mask(self.panorama.window(x, self.output_vid_width))
 
         def make_frame(t):
             if DEV and t % 10 == 0 and t != 0:
@@ -209,27 +205,57 @@ class SalientObjectLayer(LayerInterface):
                         f"Layer_{self.name_prefix} current x-coordinate (self.slide_distance * (t / duration): ",
                         "light_blue",
                     ),
-                    f"{int(self.slide_distance * (t / self.duration))}",
+                    f"{self.get_x_offset(t)}",
                 )
 
-            x = round(self.slide_distance * (t / self.duration))
-            return image_clip.get_frame(t)[:, x : x + self.output_vid_width]
+            x = self.get_x_offset(t)
+            # Assemble the viewport from only the tiles that overlap it
+            return self.panorama.window(x, self.output_vid_width)[:, :, :3]
 
+        if frame_profiler:
+            make_mask_frame = profile_frames(
+                make_mask_frame, frame_profiler, f"{self.name_prefix} mask"
+            )
+            make_frame = profile_frames(make_frame, frame_profiler, f"{self.name_prefix} frame")
         mask_video = VideoClip(make_mask_frame, duration=self.duration, ismask=True)
 
         ret = VideoClip(make_frame, duration=self.duration)
         ret = ret.set_mask(mask_video)
         return ret
 
+    def get_x_offset(self, t):
+        return round(self.slide_distance * (t / self.duration))
+
+    def get_panorama(self):
+        return self.panorama
+
+    def get_stitched_fullpath(self):
+        # Only written to disk when something needs it (e.g., segmented render workers)
+        if not self.panorama_fullpath:
+            self.panorama_fullpath = self.__get_panorama_npy_path()
+            self.panorama.export_memmap(self.panorama_fullpath)
+        return self.panorama_fullpath
+
+    def load_stitched_panorama(self):
+        # Sets the slide distance and duration, nothing is cropped for object layers
+        self.create_cropped_steps()
+        self.panorama_fullpath = self.__get_panorama_npy_path()
+        self.panorama = MemmapPanorama(self.panorama_fullpath)
+
+    def __get_panorama_npy_path(self):
+        return os.path.join(
+            self.project.stitched_objects_dir(),
+            f"{self.name_prefix}_stitched_alpha_layer.npy",
+        )
+
     def get_x_velocity(self):
         # Add logic to clean, adjust, or change type of velocity
         # NOTE: for now, make velocity of salient objects slightly slower to make them stand out
         # return int(self.layer_config["velocity"][0] * 0.6)
-        return round(self.layer_config["velocity"][0])
+        return float(self.layer_config["velocity"][0])
 
     def get_y_velocity(self):
-        # Add logic to clean, adjust, or change type of velocity
-        return round(self.layer_config["velocity"][1])
+        return float(self.layer_config["velocity"][1])
 
     def get_final_layer_height(self):
         # Add cleaning, adjusting, or type changing logic
@@ -243,6 +269,8 @@ class SalientObjectLayer(LayerInterface):
             "image": Image.open(self.alpha_layer_fullpath),
         }
         update_path_parts(self.original_layer, self.alpha_layer_fullpath)
+        # Loaded from the cache next to the alpha layer if it was already analyzed
+        self.alpha_analysis = AlphaLayerAnalysis(self.alpha_layer_fullpath)
 
     def __set_layer_breakpoints(self):
         self.layer_height_breakpoints = [0]
@@ -261,23 +289,7 @@ class SalientObjectLayer(LayerInterface):
             )
 
     def __set_lowest_non_alpha_pixel(self):
-        width, height = self.original_layer["image"].size
-        lowest_pixel = None
-        last_layer_breakpoint = self.layer_height_breakpoints[-1]
-        for y in range(height - 1, -1, -1):
-            for x in range(width):
-                pixel = self.original_layer["image"].getpixel((x, y))
-                if pixel[3] != 0:
-                    lowest_pixel = (x, y)
-                    # If the any non-alpha pixel is in the lowest layer, then we can stop searching
-                    if y >= last_layer_breakpoint:
-                        self.lowest_non_alpha_pixel = lowest_pixel
-                        return
-                    break
-            if lowest_pixel:
-                break
-
-        self.lowest_non_alpha_pixel = lowest_pixel
+        self.lowest_non_alpha_pixel = self.alpha_analysis.lowest_non_alpha_pixel
 
     def __set_parent_layer(self):
         """Determine the parent layer for this salient object.
@@ -289,35 +301,24 @@ class SalientObjectLayer(LayerInterface):
             pad_with_rules=False,
         )
 
-        # Default is the last layer (lowest) because if the loop doesn't break, then the salient object's lowest non-alpha pixel isnt below any of the layer breakpoints
-        self.parent_layer_index = len(self.layer_height_breakpoints) - 1
-        for index, breakpoint in enumerate(self.layer_height_breakpoints):
-            self.log(
-                f"Testing layer {index+1} breakpoint: {breakpoint}",
-                pad_with_rules=False,
-            )
-            if self.lowest_non_alpha_pixel[1] < breakpoint:
-                self.parent_layer_index = index
-                self.log(f"Salient object's lowest point is in layer {index+1}")
-                break
-
-    def __update_workflow(self):
-        # Set the input image for the salient object workflow as the project's input image
-        self.workflow.update(
-            "LoadImage",
-            "image",
-            os.path.basename(self.project.config_file()["input_image_path"]),
+        # Default is the last layer (lowest) if the salient object's lowest non-alpha pixel isnt below any of the layer breakpoints
+        self.parent_layer_index = self.alpha_analysis.parent_layer_index(
+            self.layer_height_breakpoints
         )
+        self.log(f"Salient object's lowest point is in layer {self.parent_layer_index+1}")
 
-        self.workflow.update(
+    def __update_workflow(self):
+        # The input image is uploaded when extracting, since the project's input image can change before then
+        self.server_manager.route_output(
+            self.workflow,
             "Save Inpainted Base Layer",
-            "filename_prefix",
+            self.name_prefix,
             f"{BASE_LAYER_WITHOUT_OBJECTS_PREFIX}-{self.index+1}",
         )
-
-        self.workflow.update(
+        self.server_manager.route_output(
+            self.workflow,
             "Save Alpha Layer",
-            "filename_prefix",
+            self.name_prefix,
             f"{SALIENT_OBJECT_ALPHA_LAYER_PREFIX}-{self.index+1}",
         )
 
@@ -1,14 +1,39 @@
-from constants import DEV, GLOABL_LOGS_DIR
+from constants import DEV, GLOABL_LOGS_DIR, DEFAULT_LOG_LEVEL, LOG_QUEUE_SIZE
 from termcolor import colored
 import os
+import sys
+import shutil
 import time
 import re
+import queue
+import atexit
+import threading
 from utils.check_make_dir import check_make_dir
+from log.sinks import ConsoleSink, TextFileSink, JsonLinesSink
 from interfaces.logger_interface import LoggerInterface
 from interfaces.project_interface import ProjectInterface
 
 
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+# Checked in order, the first one found in a message separates its header from its text
+HEADER_SEPARATORS = [
+    ":", "—", ")", "]", "}", "|", "-", ";", "=", ">", "\t", "\n",
+    "?", "*", "+", ",", "~", "/", "\\", "&", "_", " ",
+]
+ANSI_ESCAPE = re.compile(r"\x1B\[([\d]{1,2}(;[\d]{1,2})*)?[m|K]")
+
+
 class Logger(LoggerInterface):
+    """
+    Asynchronous logger. log() only checks the level and puts the unformatted arguments onto a
+    queue, a background thread formats the records and hands them to the sinks: the console (in
+    the pretty style), the session log file (same style, without colors) and a JSON lines file
+    next to it (one {time, level, caller, message} object per record).
+
+    Since arguments are formatted later, on the background thread, they shouldn't be modified
+    after they are logged.
+    """
+
     def __init__(self, project: ProjectInterface):
         self.project = project
         self.style_dict = {
@@ -28,8 +53,39 @@ class Logger(LoggerInterface):
         self.last_logged_second = None
         # How many seconds must have passed since last log message to embed text in rule, set to 0 to always embed
         self.TIME_INVERVAL_UPDATE = 40
+        self.level = LOG_LEVELS[DEFAULT_LOG_LEVEL]
 
         self.__set_log_file_fullpath()
+        self.sinks = [
+            ConsoleSink(),
+            TextFileSink(self.log_file_fullpath),
+            JsonLinesSink(os.path.splitext(self.log_file_fullpath)[0] + ".jsonl"),
+        ]
+        self.__queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self.__thread = threading.Thread(target=self.__consume, daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)
+
+    def set_level(self, level: str):
+        """Messages below the level ("debug", "info", "warning" or "error") are dropped."""
+        if level not in LOG_LEVELS:
+            raise ValueError(f"Unknown log level: {level}. Expected one of: {list(LOG_LEVELS)}")
+        self.level = LOG_LEVELS[level]
+
+    def flush(self):
+        """Waits until every queued record is written."""
+        if self.__thread.is_alive():
+            self.__queue.join()
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        """Writes the queued records and stops the background thread."""
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+        for sink in self.sinks:
+            sink.close()
 
     def session_log_exists(self):
         return os.path.exists(self.log_file_fullpath)
@@ -52,6 +108,8 @@ class Logger(LoggerInterface):
         return os.path.join(self.logs_dir, filename)
 
     def get_prompt(self):
+        # The prompt is printed right away, so the queued messages must be printed before it
+        self.flush()
         return "\n" + colored(
             self.style_dict["prompt"]["char"].strip() + " ",
             self.style_dict["prompt"]["color"],
@@ -71,6 +129,19 @@ class Logger(LoggerInterface):
         Returns:
             None
         """
+        # Drawn by the background thread, in order with the queued messages
+        self.__queue.put(
+            {
+                "kind": "progress",
+                "cur": cur,
+                "total": total,
+                "header": header,
+                "caller_prefix": caller_prefix,
+            }
+        )
+
+    def __format_progress_bar(self, cur: str, total: str, header: str, caller_prefix: str):
+        """Returns the progress bar line and the end to print it with."""
         progress_bar_charsets = {
             "stars_and_moon": {
                 "filled": [" ✨", " 🌟", " 💫", " ⭐️"],
@@ -127,12 +198,10 @@ class Logger(LoggerInterface):
         )
 
         if original_cur == 1:
-            print(" ")
+            display = " \n" + display
         if original_cur == original_total:
-            print(display)
-            print(" ")
-        else:
-            print(display, end="\r")
+            return display + "\n ", "\n"
+        return display, "\r"
 
     def get_embedded_hrule(self, embed_text) -> str:
         if not self.__time_has_changed():
@@ -179,42 +248,71 @@ class Logger(LoggerInterface):
         print_to_console: bool = DEV,
         write_to_log: bool = True,
         pad_with_rules: bool = False,
+        level: str = "info",
     ):
         """
         Prints the formatted message to the console if DEV is True,
         and logs the formatted message.
 
+        Formatting and writing happen on the background thread, a message below the logger's
+        level costs only the level check.
+
         Args:
             *args: Variable number of arguments to be formatted and logged.
             print_to_console (bool, optional): Whether to print the message to the console. Defaults to DEV.
             write_to_log (bool, optional): Whether to write the message to the log file. Defaults to True.
             pad_with_rules (bool, optional): Whether to pad the message with horizontal rules. Defaults to False.
+            level (str, optional): "debug", "info", "warning" or "error". Defaults to "info".
         """
-        if print_to_console:
-            print(
-                self.__format_log_message(
-                    *args,
-                    caller_prefix=caller_prefix,
-                    color_text=True,
-                    pad_with_rules=pad_with_rules,
-                )
-            )
+        if LOG_LEVELS[level] < self.level:
+            return
+        self.__queue.put(
+            {
+                "kind": "message",
+                "args": args,
+                "caller_prefix": caller_prefix,
+                "print_to_console": print_to_console,
+                "write_to_log": write_to_log,
+                "pad_with_rules": pad_with_rules,
+                "level": level,
+                "time": time.time(),
+            }
+        )
 
-        if write_to_log:
-            with open(
-                self.log_file_fullpath, "a" if self.session_log_exists() else "w"
-            ) as log_file:
-                log_file.write(
-                    self.__format_log_message(
-                        *args,
-                        caller_prefix=caller_prefix,
-                        color_text=False,
-                        pad_with_rules=pad_with_rules,
-                    )
-                )
+    def __consume(self):
+        while True:
+            record = self.__queue.get()
+            try:
+                if record is None:
+                    return
+                self.__format_record(record)
+                for sink in self.sinks:
+                    sink.write(record)
+            except Exception as e:
+                # A broken sink or message must not stop logging
+                print(f"Logger: Failed to write log record: {e}", file=sys.stderr)
+            finally:
+                self.__queue.task_done()
+
+    def __format_record(self, record: dict):
+        if record["kind"] == "progress":
+            record["pretty"], record["end"] = self.__format_progress_bar(
+                record["cur"], record["total"], record["header"], record["caller_prefix"]
+            )
+            return
+        record["message"] = " ".join(map(str, record["args"]))
+        record["pretty"] = self.__format_log_message(
+            record["message"],
+            caller_prefix=record["caller_prefix"],
+            color_text=True,
+            pad_with_rules=record["pad_with_rules"],
+            embed=time.strftime(" %I:%M%p ", time.localtime(record["time"])),
+        )
+        record["plain"] = self.__decolor(record["pretty"])
 
     def __terminal_length(self):
-        return os.get_terminal_size().columns - 2
+        # Falls back to 80 columns without a terminal (e.g., headless runs with output redirected)
+        return shutil.get_terminal_size().columns - 2
 
     def __set_log_file_fullpath(self):
         self.logs_dir = os.path.join(self.project.repo_root, GLOABL_LOGS_DIR)
@@ -252,19 +350,18 @@ class Logger(LoggerInterface):
         # Split the text into lines which are less than (teminal width - length of the prefix)
         prefix_len = self.__len_without_ansi(self.__get_prefix(caller_prefix))
         max_text_line_len = self.__terminal_length() - prefix_len
+        # Line breaks in the text are kept (e.g., tables), each line is split separately
         return "".join(
             [
-                "\n" + " " * prefix_len + text.strip()[i : i + max_text_line_len]
-                for i in range(0, len(text), max_text_line_len)
+                "\n" + " " * prefix_len + line[i : i + max_text_line_len]
+                for line in text.strip().split("\n")
+                for i in range(0, max(len(line), 1), max_text_line_len)
             ]
         )
 
     def __decolor(self, text: str) -> str:
-        # Define a regular expression pattern to match any ANSI escape sequence
-        ansi_escape = re.compile(r"\x1B\[([\d]{1,2}(;[\d]{1,2})*)?[m|K]")
-
-        # Use the regular expression to remove ANSI escape sequences from the text
-        return ansi_escape.sub("", text)
+        # Remove ANSI escape sequences from the text
+        return ANSI_ESCAPE.sub("", text)
 
     def __format_log_message(
         self,
@@ -309,36 +406,9 @@ class Logger(LoggerInterface):
         )
 
     def __extract_header(self, msg: str) -> list[str]:
-        separator_candidates = [
-            ":",
-            "—",
-            r"\)",  # Escaped parenthesis
-            r"\]",  # Escaped square bracket
-            r"\}",  # Escaped curly bracket
-            r"\|",
-            "-",
-            ";",
-            "=",
-            ">",
-            "\t",
-            "\n",
-            r"\?",  # Escaped question mark
-            r"\*",  # Escaped asterisk
-            r"\+",  # Escaped plus sign
-            ",",
-            "~",
-            "/",
-            r"\\",  # Escaped backslash
-            "&",
-            "_",
-            " ",
-            "",
-        ]
-        split_by_sep = lambda sep: re.split(sep, msg, 1)
-        i = 0
         # Proceed through possible separators until one actually separates the message
-        while len(split_by_sep(separator_candidates[i])) <= 1:
-            i += 1
-        separator = separator_candidates[i]
-        msg_parts = split_by_sep(separator)
-        return [msg_parts[0] + separator, msg_parts[1].strip()]
+        for separator in HEADER_SEPARATORS:
+            index = msg.find(separator)
+            if index != -1:
+                return [msg[:index] + separator, msg[index + len(separator) :].strip()]
+        return ["", msg.strip()]
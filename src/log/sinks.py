@@ -0,0 +1,77 @@
+import json
+import sys
+
+
+class ConsoleSink:
+    """Prints records in the pretty console style (colored, with rules and headers) and draws progress bars."""
+
+    def write(self, record: dict):
+        if record["kind"] == "progress":
+            print(record["pretty"], end=record["end"])
+        elif record["print_to_console"]:
+            print(record["pretty"])
+
+    def flush(self):
+        sys.stdout.flush()
+
+    def close(self):
+        self.flush()
+
+
+class TextFileSink:
+    """Appends records to the session log file in the console style, without colors."""
+
+    def __init__(self, fullpath: str):
+        self.fullpath = fullpath
+        # Opened on the first record, so an unused logger doesn't create a file
+        self.file = None
+
+    def write(self, record: dict):
+        if record["kind"] != "message" or not record["write_to_log"]:
+            return
+        if not self.file:
+            self.file = open(self.fullpath, "a")
+        self.file.write(record["plain"])
+
+    def flush(self):
+        if self.file:
+            self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class JsonLinesSink:
+    """Appends one JSON object per record (time, level, caller, message) for machine consumption."""
+
+    def __init__(self, fullpath: str):
+        self.fullpath = fullpath
+        self.file = None
+
+    def write(self, record: dict):
+        if record["kind"] != "message" or not record["write_to_log"]:
+            return
+        if not self.file:
+            self.file = open(self.fullpath, "a")
+        self.file.write(
+            json.dumps(
+                {
+                    "time": record["time"],
+                    "level": record["level"],
+                    "caller": record["caller_prefix"],
+                    "message": record["message"],
+                }
+            )
+            + "\n"
+        )
+
+    def flush(self):
+        if self.file:
+            self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
@@ -1,10 +1,149 @@
 from project.project import ParallaxProject
+from project.project_spec import load_project_spec
 from test.delete_test_project import delete_test_projects
+from utils.repo_paths import get_projects_dir
 from constants import DEV
+from termcolor import colored
+import argparse
+import traceback
+import sys
 import os
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Infinite Parallax. Without a command, prompts for a project to create or load."
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    stage_options = argparse.ArgumentParser(add_help=False)
+    stage_options.add_argument(
+        "--stage",
+        action="append",
+        dest="stages",
+        help="Only run this stage, even if it is up to date (repeatable). Stages: objects, slices, "
+        + "inpaint, stitch_layer_<n>, extend_objects, render",
+    )
+    stage_options.add_argument(
+        "--downstream",
+        action="store_true",
+        help="Also run the stages downstream of --stage, if they are stale",
+    )
+    stage_options.add_argument(
+        "--force", action="store_true", help="Run the stages even if they are up to date"
+    )
+
+    run_parser = subparsers.add_parser(
+        "run",
+        parents=[stage_options],
+        help="Run project specs (YAML/JSON) headless, one after another, without any prompts",
+    )
+    run_parser.add_argument("specs", nargs="+", help="Project spec files")
+    run_parser.add_argument("--author", help="Project author, defaults to $USER")
+    run_parser.add_argument(
+        "--stop-on-error",
+        action="store_true",
+        help="Stop at the first failed project instead of continuing with the next spec",
+    )
+
+    validate_parser = subparsers.add_parser(
+        "validate", help="Validate project specs without running them"
+    )
+    validate_parser.add_argument("specs", nargs="+", help="Project spec files")
+
+    make_parser = subparsers.add_parser(
+        "make",
+        parents=[stage_options],
+        help="Run the stale stages of an existing project headless, without any prompts",
+    )
+    make_parser.add_argument("project", help="Project name")
+    make_parser.add_argument("--author", help="Project author, defaults to $USER")
+
+    status_parser = subparsers.add_parser(
+        "status", help="Show which stages of an existing project are up to date"
+    )
+    status_parser.add_argument("project", help="Project name")
+    return parser.parse_args()
+
+
+def get_pipeline_options(args):
+    return {
+        "stages": args.stages,
+        "downstream": args.downstream,
+        "force": args.force,
+    }
+
+
+def run_existing_project(project_name, author=None, pipeline_options=None):
+    project_dir = os.path.join(get_projects_dir(), project_name)
+    if not os.path.isdir(project_dir):
+        print(colored(f"No project named {project_name} in {os.path.dirname(project_dir)}", "red"))
+        return 1
+    ParallaxProject(
+        project_name, author, interactive=False, pipeline_options=pipeline_options
+    )
+    return 0
+
+
+def load_specs(spec_paths):
+    """Loads every spec before anything runs, so a typo doesn't surface hours into a batch."""
+    specs = []
+    for spec_path in spec_paths:
+        try:
+            specs.append(load_project_spec(spec_path))
+            print(colored(f"Valid project spec: {spec_path}", "cyan"))
+        except (OSError, ValueError, ImportError) as e:
+            print(colored(str(e), "red"))
+            specs.append(None)
+    return specs
+
+
+def run_specs(spec_paths, author=None, stop_on_error=False, pipeline_options=None):
+    specs = load_specs(spec_paths)
+    if None in specs:
+        return 1
+
+    failed = []
+    for spec_path, spec in zip(spec_paths, specs):
+        print(colored(f"\nRunning project spec: {spec_path}", "cyan"))
+        try:
+            ParallaxProject(
+                spec["name"], author, spec=spec, pipeline_options=pipeline_options
+            )
+        except Exception:
+            traceback.print_exc()
+            failed.append(spec_path)
+            if stop_on_error:
+                break
+
+    print(
+        colored(
+            f"\n{len(specs) - len(failed)}/{len(specs)} projects completed",
+            "red" if failed else "cyan",
+        )
+    )
+    for spec_path in failed:
+        print(colored(f"Failed: {spec_path}", "red"))
+    return 1 if failed else 0
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "run":
+        sys.exit(
+            run_specs(
+                args.specs, args.author, args.stop_on_error, get_pipeline_options(args)
+            )
+        )
+    if args.command == "validate":
+        sys.exit(1 if None in load_specs(args.specs) else 0)
+    if args.command == "make":
+        sys.exit(
+            run_existing_project(args.project, args.author, get_pipeline_options(args))
+        )
+    if args.command == "status":
+        sys.exit(run_existing_project(args.project, pipeline_options={"dry_run": True}))
+
     if DEV:
         os.system("clear")
     project_name = input("\nEnter the name of the project:\n> ")
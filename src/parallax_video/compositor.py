@@ -0,0 +1,301 @@
+import time
+import subprocess
+import numpy as np
+from moviepy.config import get_setting
+from interfaces.project_interface import ProjectInterface
+from interfaces.layer_interface import LayerInterface
+from interfaces.logger_interface import LoggerInterface
+from layers.alpha_analysis import binary_alpha_mask, bounding_box
+from parallax_video.frame_profiler import FrameProfiler
+
+
+class NumpyCompositor:
+    """
+    Render engine which composites the layer strips directly into a preallocated
+    uint8 frame buffer and pipes the raw frames to an ffmpeg subprocess.
+
+    Produces the same frames as compositing the layer videoclips with moviepy's
+    CompositeVideoClip, without allocating new arrays for every frame:
+        - The x-offset of every layer for every frame is computed up front.
+        - Base layers' viewports are assembled straight into the frame buffer.
+        - Object layers are blended over the frame with premultiplied alpha, using
+          integer math in a preallocated scratch buffer, and only inside the object's
+          bounding box.
+    """
+
+    def __init__(
+        self,
+        project: ProjectInterface,
+        logger: LoggerInterface,
+        base_layers: list[LayerInterface],
+        object_layers: list[LayerInterface],
+        video_size: tuple[int, int],
+        fps: int,
+        frame_profiler: FrameProfiler = None,
+        caller_prefix="COMPOSITOR",
+    ):
+        """
+        Args:
+            frame_profiler (FrameProfiler, optional): If given, the time of each base layer's frame
+                fetch, of compositing the object layers and of each encoder write is recorded for every frame.
+        """
+        self.project = project
+        self.frame_profiler = frame_profiler
+        self.logger = logger
+        self.caller_prefix = caller_prefix
+        self.width, self.height = video_size
+        self.fps = fps
+
+        self.duration = base_layers[0].duration
+        # Same frame times that moviepy's iter_frames uses
+        self.frame_times = np.arange(0, self.duration, 1.0 / self.fps)
+
+        self.frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        self.__scratch = np.zeros((self.height, self.width, 3), dtype=np.uint16)
+
+        self.__set_base_layer_panoramas(base_layers)
+        self.__set_overlay_strips(object_layers)
+
+    def log(self, *args, **kwargs):
+        self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
+
+    def n_frames(self) -> int:
+        return len(self.frame_times)
+
+    def compose_frame(self, frame_index: int) -> np.ndarray:
+        """
+        Composes the frame at the given index into the shared frame buffer.
+
+        The returned array is the compositor's frame buffer, it is overwritten by the
+        next call.
+
+        Args:
+            frame_index (int): The index of the frame in self.frame_times.
+
+        Returns:
+            np.ndarray: The (height, width, 3) uint8 frame buffer.
+        """
+        profiler = self.frame_profiler
+        for layer_number, (panorama, y, offsets) in enumerate(self.__base_panoramas, start=1):
+            if profiler:
+                fetch_start = time.perf_counter()
+            # Assemble the layer's viewport straight into its rows of the frame buffer
+            window = panorama.window(
+                offsets[frame_index], self.width, out=self.frame[y : y + panorama.height]
+            )
+            # Panorama ran out before the right edge of the frame, show the background
+            if window.shape[1] < self.width:
+                self.frame[y : y + panorama.height, window.shape[1] :] = 0
+            if profiler:
+                profiler.record(
+                    f"layer_{layer_number} frame", frame_index, time.perf_counter() - fetch_start
+                )
+
+        if profiler:
+            composite_start = time.perf_counter()
+        for premultiplied, inverse_alpha, offsets, (left, top) in self.__overlay_strips:
+            x = offsets[frame_index]
+            # Only blend the part of the object's bounding box that is inside the viewport
+            start = max(x, left)
+            stop = min(x + self.width, left + premultiplied.shape[1])
+            if start >= stop:
+                continue
+            rgb_window = premultiplied[:, start - left : stop - left]
+            alpha_window = inverse_alpha[:, start - left : stop - left]
+            h = min(rgb_window.shape[0], self.height - top)
+            frame_view = self.frame[top : top + h, start - x : stop - x]
+            scratch_view = self.__scratch[top : top + h, start - x : stop - x]
+
+            # out = premultiplied_rgb + frame * (1 - alpha)
+            np.multiply(frame_view, alpha_window[:h], out=scratch_view, dtype=np.uint16)
+            scratch_view //= 255
+            scratch_view += rgb_window[:h]
+            frame_view[:] = scratch_view
+
+        if profiler:
+            profiler.record("composite", frame_index, time.perf_counter() - composite_start)
+        return self.frame
+
+    def render(
+        self,
+        output_path: str,
+        codec: str,
+        preset: str,
+        ffmpeg_params: list[str],
+        threads: int,
+    ) -> None:
+        """
+        Composes every frame and writes it to an ffmpeg subprocess's stdin.
+
+        The encoder arguments mirror the ones moviepy's write_videofile passes to ffmpeg.
+
+        Args:
+            output_path (str): The path to write the encoded video to.
+            codec (str): The video codec to encode with.
+            preset (str): The ffmpeg preset.
+            ffmpeg_params (list[str]): Extra ffmpeg output arguments.
+            threads (int): The number of threads ffmpeg should use.
+
+        Raises:
+            IOError: If the ffmpeg process exits before all frames are written.
+        """
+        encoder_logfile_path = self.logger.get_isolated_child_logfile(
+            f"{self.caller_prefix} > FFMPEG"
+        )
+        self.log(f"Encoder log: {encoder_logfile_path}")
+        self.render_frames(
+            range(self.n_frames()),
+            output_path,
+            encoder_logfile_path,
+            codec,
+            preset,
+            ffmpeg_params,
+            threads,
+        )
+
+    def render_frames(
+        self,
+        frame_indices: range,
+        output_path: str,
+        encoder_logfile_path: str,
+        codec: str,
+        preset: str,
+        ffmpeg_params: list[str],
+        threads: int,
+        show_progress: bool = True,
+    ) -> None:
+        """
+        Composes the given frames and encodes them into their own video file.
+
+        Args:
+            frame_indices (range): The indices (into self.frame_times) of the frames to encode.
+            output_path (str): The path to write the encoded video to.
+            encoder_logfile_path (str): The path to redirect ffmpeg's stderr to.
+            codec (str): The video codec to encode with.
+            preset (str): The ffmpeg preset.
+            ffmpeg_params (list[str]): Extra ffmpeg output arguments.
+            threads (int): The number of threads ffmpeg should use.
+            show_progress (bool, optional): Whether to display a progress bar. Defaults to True.
+
+        Raises:
+            IOError: If the ffmpeg process exits before all frames are written.
+        """
+        with open(encoder_logfile_path, "w") as encoder_logfile:
+            encoder = subprocess.Popen(
+                self.__get_ffmpeg_cli_args(
+                    output_path, codec, preset, ffmpeg_params, threads
+                ),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=encoder_logfile,
+            )
+
+            try:
+                for n_written, frame_index in enumerate(frame_indices, start=1):
+                    frame = self.compose_frame(frame_index)
+                    if self.frame_profiler:
+                        start = time.perf_counter()
+                    # Blocks while ffmpeg's pipe is full
+                    encoder.stdin.write(memoryview(frame))
+                    if self.frame_profiler:
+                        self.frame_profiler.record(
+                            "encoder write", frame_index, time.perf_counter() - start
+                        )
+                    if show_progress and (
+                        n_written % self.fps == 0 or n_written == len(frame_indices)
+                    ):
+                        self.logger.progress_bar(
+                            n_written,
+                            len(frame_indices),
+                            "Compositing Frames",
+                            self.caller_prefix,
+                        )
+            except BrokenPipeError:
+                encoder.wait()
+                raise IOError(
+                    f"ffmpeg exited with code {encoder.returncode} while encoding {output_path}. See: {encoder_logfile_path}"
+                )
+            finally:
+                if encoder.stdin and not encoder.stdin.closed:
+                    try:
+                        encoder.stdin.close()
+                    except BrokenPipeError:
+                        pass
+
+            if encoder.wait() != 0:
+                raise IOError(
+                    f"ffmpeg exited with code {encoder.returncode} while encoding {output_path}. See: {encoder_logfile_path}"
+                )
+
+    def __get_ffmpeg_cli_args(
+        self, output_path, codec, preset, ffmpeg_params, threads
+    ) -> list[str]:
+        args = [
+            get_setting("FFMPEG_BINARY"),
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-vcodec",
+            "rawvideo",
+            "-s",
+            f"{self.width}x{self.height}",
+            "-pix_fmt",
+            "rgb24",
+            "-r",
+            f"{self.fps:.02f}",
+            "-an",
+            "-i",
+            "-",
+            "-vcodec",
+            codec,
+            "-preset",
+            preset,
+        ]
+        args.extend(ffmpeg_params)
+        if threads is not None:
+            args.extend(["-threads", str(threads)])
+        if codec == "libx264" and self.width % 2 == 0 and self.height % 2 == 0:
+            args.extend(["-pix_fmt", "yuv420p"])
+        args.append(output_path)
+        return args
+
+    def __get_offsets(self, layer: LayerInterface) -> np.ndarray:
+        return np.array(
+            [layer.get_x_offset(t) for t in self.frame_times], dtype=np.int64
+        )
+
+    def __set_base_layer_panoramas(self, base_layers: list[LayerInterface]):
+        self.__base_panoramas = []
+        y = 0
+        for layer in base_layers:
+            self.__base_panoramas.append(
+                (layer.get_panorama(), y, self.__get_offsets(layer))
+            )
+            y += layer.get_final_layer_height()
+
+    def __set_overlay_strips(self, object_layers: list[LayerInterface]):
+        """
+        Premultiply each object strip once so that blending a frame is one multiply-add.
+        The strips are cropped to the object's bounding box, since the rest is fully transparent.
+        """
+        self.__overlay_strips = []
+        for layer in object_layers:
+            # Everything after the covered width is transparent
+            panorama = layer.get_panorama()
+            rgba = panorama.window(0, panorama.covered_width())
+            # Same binary mask that the moviepy path uses (any non-zero alpha is opaque)
+            mask = binary_alpha_mask(rgba)
+            bbox = bounding_box(mask)
+            if bbox is None:
+                continue
+            left, top, right, bottom = bbox
+            alpha = mask[top:bottom, left:right, np.newaxis] * np.uint8(255)
+            premultiplied = (
+                rgba[top:bottom, left:right, :3].astype(np.uint16) * alpha // 255
+            ).astype(np.uint8)
+            inverse_alpha = 255 - alpha
+            self.__overlay_strips.append(
+                (premultiplied, inverse_alpha, self.__get_offsets(layer), (left, top))
+            )
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import numpy as np
+from interfaces.project_interface import ProjectInterface
+from interfaces.logger_interface import LoggerInterface
+from constants import RUN_REPORTS_DIR
+
+
+class FrameProfiler:
+    """
+    Records how long each phase of rendering a frame took, for every frame: each layer's frame fetch,
+    the object layers' mask fetch, compositing and the encoder write (how long ffmpeg made the
+    renderer wait, i.e., backpressure).
+
+    Only holds plain lists, so the segmented render's worker processes can return their profilers
+    to be merged.
+    """
+
+    def __init__(self, fps: int):
+        self.fps = fps
+        # phase -> (frame indices, seconds)
+        self.samples = {}
+
+    def frame_index(self, t: float) -> int:
+        return round(t * self.fps)
+
+    def record(self, phase: str, frame_index: int, seconds: float):
+        frames, durations = self.samples.setdefault(phase, ([], []))
+        frames.append(frame_index)
+        durations.append(seconds)
+
+    def merge(self, other: "FrameProfiler"):
+        for phase, (frames, durations) in other.samples.items():
+            own_frames, own_durations = self.samples.setdefault(phase, ([], []))
+            own_frames.extend(frames)
+            own_durations.extend(durations)
+
+    def summary(self, n_slowest: int = 5) -> dict:
+        """
+        Returns:
+            dict: For each phase, its number of samples, total and mean time, p50/p95/p99 and max
+                (ms), and its slowest frames. Also the slowest frames overall, by the sum of
+                their phases, with the time of each phase.
+        """
+        phases = {}
+        frame_totals = {}
+        for phase, (frames, durations) in self.samples.items():
+            durations_ms = np.array(durations) * 1000
+            p50, p95, p99 = np.percentile(durations_ms, [50, 95, 99])
+            slowest = np.argsort(durations_ms)[::-1][:n_slowest]
+            phases[phase] = {
+                "samples": len(durations_ms),
+                "total_s": round(float(durations_ms.sum()) / 1000, 3),
+                "mean_ms": round(float(durations_ms.mean()), 3),
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+                "max_ms": round(float(durations_ms.max()), 3),
+                "slowest_frames": [
+                    {"frame": int(frames[i]), "ms": round(float(durations_ms[i]), 3)}
+                    for i in slowest
+                ],
+            }
+            for frame, duration_ms in zip(frames, durations_ms):
+                frame_totals.setdefault(frame, {})
+                frame_totals[frame][phase] = (
+                    frame_totals[frame].get(phase, 0) + float(duration_ms)
+                )
+
+        slowest_frames = sorted(
+            frame_totals.items(), key=lambda item: sum(item[1].values()), reverse=True
+        )[:n_slowest]
+        return {
+            "fps": self.fps,
+            "frames": len(frame_totals),
+            "phases": phases,
+            "slowest_frames": [
+                {
+                    "frame": int(frame),
+                    "t": round(frame / self.fps, 3),
+                    "total_ms": round(sum(phase_ms.values()), 3),
+                    "phases_ms": {
+                        phase: round(duration_ms, 3) for phase, duration_ms in phase_ms.items()
+                    },
+                }
+                for frame, phase_ms in slowest_frames
+            ],
+        }
+
+    def report(
+        self,
+        project: ProjectInterface,
+        logger: LoggerInterface,
+        caller_prefix: str,
+    ) -> str:
+        """
+        Writes the summary to the project's reports dir and logs it as a table.
+
+        Returns:
+            str: The path the summary is written to.
+        """
+        summary = self.summary()
+        reports_dir = os.path.join(project.project_dir_path, RUN_REPORTS_DIR)
+        os.makedirs(reports_dir, exist_ok=True)
+        version = ".".join(str(part) for part in project.version)
+        report_path = os.path.join(reports_dir, f"render_profile_v{version}.json")
+        with open(report_path, "w") as report_file:
+            json.dump(summary, report_file, indent=4)
+
+        columns = ["p50_ms", "p95_ms", "p99_ms", "max_ms", "total_s"]
+        name_width = max([len(phase) for phase in summary["phases"]] + [5]) + 2
+        header = "phase".ljust(name_width) + "".join(column.rjust(9) for column in columns)
+        lines = [header, "-" * len(header)]
+        for phase, stats in summary["phases"].items():
+            lines.append(
+                phase.ljust(name_width)
+                + "".join(f"{stats[column]:.2f}".rjust(9) for column in columns)
+            )
+        lines.append("Slowest frames:")
+        for frame in summary["slowest_frames"]:
+            slowest_phase = max(frame["phases_ms"], key=frame["phases_ms"].get)
+            lines.append(
+                f"  frame {frame['frame']} ({frame['t']}s): {frame['total_ms']:.1f} ms, "
+                + f"mostly {slowest_phase} ({frame['phases_ms'][slowest_phase]:.1f} ms)"
+            )
+        logger.log(
+            f"Render profile: {summary['frames']} frames\n" + "\n".join(lines),
+            caller_prefix=caller_prefix,
+            pad_with_rules=True,
+        )
+        logger.log("Render profile saved to:", report_path, caller_prefix=caller_prefix)
+        return report_path
+
+
+def profile_frames(make_frame, frame_profiler: FrameProfiler, phase: str):
+    """Wraps a videoclip's make_frame function so the time of every call is recorded as the given phase."""
+
+    def profiled_make_frame(t):
+        start = time.perf_counter()
+        frame = make_frame(t)
+        frame_profiler.record(phase, frame_profiler.frame_index(t), time.perf_counter() - start)
+        return frame
+
+    return profiled_make_frame
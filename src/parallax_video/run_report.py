@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from interfaces.project_interface import ProjectInterface
+from interfaces.logger_interface import LoggerInterface
+from constants import RUN_REPORTS_DIR, RUN_REPORT_HISTORY_FILENAME, RSS_SAMPLE_INTERVAL
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+class ResourceSampler:
+    """
+    Reads the process' resource counters: CPU time (including finished child processes, e.g. render
+    workers and ffmpeg), resident memory and bytes read/written.
+
+    Memory and IO are read from /proc on Linux, or with psutil (if installed) elsewhere. A counter
+    that can't be read on this platform is None.
+    """
+
+    def __init__(self):
+        self.psutil_process = None
+        if not os.path.exists("/proc/self/statm"):
+            try:
+                import psutil
+
+                self.psutil_process = psutil.Process()
+            except ImportError:
+                pass
+        self.page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def cpu_seconds(self) -> float:
+        times = os.times()
+        return times.user + times.system + times.children_user + times.children_system
+
+    def rss_bytes(self):
+        if self.psutil_process:
+            return self.psutil_process.memory_info().rss
+        try:
+            with open("/proc/self/statm", "r") as statm:
+                return int(statm.read().split()[1]) * self.page_size
+        except OSError:
+            return None
+
+    def peak_rss_bytes(self):
+        """Peak resident memory of the process so far, or of the largest finished child process."""
+        if not resource:
+            return None
+        # ru_maxrss is in KB on Linux, in bytes on macOS
+        scale = 1 if os.uname().sysname == "Darwin" else 1024
+        return scale * max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        )
+
+    def io_bytes(self):
+        """Returns (bytes read, bytes written) by the process (storage IO, not page cache hits)."""
+        if self.psutil_process:
+            counters = self.psutil_process.io_counters()
+            return counters.read_bytes, counters.write_bytes
+        try:
+            with open("/proc/self/io", "r") as io:
+                fields = dict(line.split(": ") for line in io.read().splitlines())
+            return int(fields["read_bytes"]), int(fields["write_bytes"])
+        except (OSError, KeyError, ValueError):
+            return None, None
+
+
+class RunReport:
+    """
+    Records the wall time, CPU time, peak resident memory and bytes read/written of each stage (and
+    of each layer within a stage) of a project run, and writes them as a JSON report to the
+    project's reports dir at the end of the run.
+
+    Stages that run concurrently share the process, so their CPU time, memory and IO overlap.
+    Concurrent sections are marked as such in the report. Memory is sampled on a background thread
+    while a section runs.
+    """
+
+    def __init__(
+        self,
+        project: ProjectInterface,
+        logger: LoggerInterface,
+        caller_prefix="RUN REPORT",
+    ):
+        self.project = project
+        self.logger = logger
+        self.caller_prefix = caller_prefix
+        self.sampler = ResourceSampler()
+        self.sections = {}
+        self.skipped = []
+        self.active = {}
+        self.mutex = threading.Lock()
+        self.started_at = time.time()
+        self.start = self.__read_counters()
+
+    def log(self, *args, **kwargs):
+        self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
+
+    @contextmanager
+    def measure(self, name: str, parent: str = None):
+        """
+        Measures the enclosed code as a section of the report.
+
+        Args:
+            name (str): The section's name, e.g. a stage name or "layer_1".
+            parent (str, optional): The stage the section is part of, e.g. "extend_objects".
+        """
+        key = f"{parent}/{name}" if parent else name
+        peak = [self.sampler.rss_bytes() or 0]
+        with self.mutex:
+            # Sections already running at the same time as this one
+            overlaps = set(self.active)
+            for other in self.active.values():
+                other["overlaps"].add(key)
+            self.active[key] = {"peak": peak, "overlaps": overlaps}
+            if len(self.active) == 1:
+                self.__start_memory_sampling()
+
+        start = self.__read_counters()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            end = self.__read_counters()
+            with self.mutex:
+                active = self.active.pop(key)
+                if not self.active:
+                    self.sampling.set()
+            section = self.__get_usage(
+                start, end, None if end["rss"] is None else max(peak[0], end["rss"])
+            )
+            # The stage a section is part of, and the sections of a stage, don't count as concurrent
+            concurrent = sorted(
+                other
+                for other in active["overlaps"]
+                if other != parent and not other.startswith(f"{key}/")
+            )
+            if concurrent:
+                section["concurrent_with"] = concurrent
+            if error is not None:
+                section["error"] = self.__describe_error(error)
+            with self.mutex:
+                self.sections[key] = section
+
+    def mark_skipped(self, name: str):
+        """Records a stage that was up to date and didn't run."""
+        with self.mutex:
+            self.skipped.append(name)
+
+    def finish(self, error: BaseException = None) -> dict:
+        """
+        Writes the report to the project's reports dir, logs a summary table and returns the report.
+
+        Args:
+            error (BaseException, optional): The exception the run failed with, if it failed.
+        """
+        total = self.__get_usage(self.start, self.__read_counters(), None)
+        total["peak_rss_mb"] = self.__to_mb(self.sampler.peak_rss_bytes())
+        # Sections of a stage (e.g. its layers) are nested under the stage
+        stages = {
+            name: dict(section) for name, section in self.sections.items() if "/" not in name
+        }
+        for key, section in self.sections.items():
+            if "/" in key:
+                parent, name = key.split("/", 1)
+                stages[parent].setdefault("sections", {})[name] = section
+        report = {
+            "project": self.project.name,
+            "version": ".".join(str(part) for part in self.project.version),
+            "author": self.project.author,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "status": "failed" if error is not None else "completed",
+            "total": total,
+            "stages": stages,
+            "up_to_date": self.skipped,
+        }
+        if error is not None:
+            report["error"] = self.__describe_error(error)
+
+        reports_dir = os.path.join(self.project.project_dir_path, RUN_REPORTS_DIR)
+        os.makedirs(reports_dir, exist_ok=True)
+        report_path = os.path.join(reports_dir, f"run_v{report['version']}.json")
+        with open(report_path, "w") as report_file:
+            json.dump(report, report_file, indent=4)
+        # One line per run, to compare runs of different versions of the project
+        with open(os.path.join(reports_dir, RUN_REPORT_HISTORY_FILENAME), "a") as history_file:
+            history_file.write(
+                json.dumps(
+                    {
+                        "version": report["version"],
+                        "started_at": report["started_at"],
+                        "status": report["status"],
+                        "total": total,
+                        "stages": {name: stage["wall_s"] for name, stage in stages.items()},
+                    }
+                )
+                + "\n"
+            )
+
+        self.__log_summary(report)
+        self.log("Run report saved to:", report_path)
+        return report
+
+    def __log_summary(self, report: dict):
+        columns = {
+            "wall_s": "wall s",
+            "cpu_s": "cpu s",
+            "peak_rss_mb": "rss MB",
+            "read_mb": "read MB",
+            "written_mb": "write MB",
+        }
+        rows = []
+        for name, stage in report["stages"].items():
+            rows.append((name, stage))
+            rows += [
+                ("  " + section_name, section)
+                for section_name, section in stage.get("sections", {}).items()
+            ]
+        rows.append(("total", report["total"]))
+        name_width = max(len(name) for name, _ in rows) + 2
+        header = "stage".ljust(name_width) + "".join(
+            title.rjust(9) for title in columns.values()
+        )
+        lines = [header, "-" * len(header)]
+        for name, section in rows:
+            lines.append(
+                name.ljust(name_width)
+                + "".join(
+                    ("-" if section.get(column) is None else f"{section[column]:.1f}").rjust(9)
+                    for column in columns
+                )
+            )
+        if report["up_to_date"]:
+            lines.append("Up to date (not run): " + ", ".join(report["up_to_date"]))
+        failed = [name.strip() for name, section in rows if "error" in section]
+        if failed:
+            lines.append("Failed: " + ", ".join(failed))
+        self.log(
+            f"Run report: {report['project']} v{report['version']} ({report['status']})\n"
+            + "\n".join(lines),
+            pad_with_rules=True,
+        )
+
+    def __start_memory_sampling(self):
+        self.sampling = threading.Event()
+        threading.Thread(
+            target=self.__sample_memory, args=(self.sampling,), daemon=True
+        ).start()
+
+    def __sample_memory(self, stop: threading.Event):
+        while not stop.wait(RSS_SAMPLE_INTERVAL):
+            rss = self.sampler.rss_bytes()
+            if rss is None:
+                return
+            with self.mutex:
+                for active in self.active.values():
+                    active["peak"][0] = max(active["peak"][0], rss)
+
+    def __read_counters(self) -> dict:
+        read_bytes, written_bytes = self.sampler.io_bytes()
+        return {
+            "wall": time.perf_counter(),
+            "cpu": self.sampler.cpu_seconds(),
+            "rss": self.sampler.rss_bytes(),
+            "read": read_bytes,
+            "written": written_bytes,
+        }
+
+    def __get_usage(self, start: dict, end: dict, peak_rss) -> dict:
+        delta = lambda key: None if start[key] is None else end[key] - start[key]
+        return {
+            "wall_s": round(end["wall"] - start["wall"], 3),
+            "cpu_s": round(end["cpu"] - start["cpu"], 3),
+            "peak_rss_mb": self.__to_mb(peak_rss),
+            "read_mb": self.__to_mb(delta("read")),
+            "written_mb": self.__to_mb(delta("written")),
+        }
+
+    def __describe_error(self, error: BaseException) -> str:
+        return f"{type(error).__name__}: {error}"
+
+    def __to_mb(self, n_bytes):
+        return None if n_bytes is None else round(n_bytes / 2**20, 2)
@@ -0,0 +1,303 @@
+import os
+import json
+import hashlib
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from moviepy.config import get_setting
+from parallax_video.compositor import NumpyCompositor
+from parallax_video.frame_profiler import FrameProfiler
+from utils.panorama import MemmapPanorama
+from interfaces.project_interface import ProjectInterface
+from interfaces.layer_interface import LayerInterface
+from interfaces.logger_interface import LoggerInterface
+
+
+class StitchedLayerFile:
+    """
+    Picklable stand-in for a layer, used by the segment worker processes.
+
+    Holds the path to the layer's memory-mapped panorama and the layer's precomputed x-offset
+    for every frame, and maps the panorama only once it is inside the worker.
+    """
+
+    def __init__(self, layer: LayerInterface, frame_times: np.ndarray, fps: int):
+        self.fullpath = layer.get_stitched_fullpath()
+        self.duration = layer.duration
+        self.height = layer.get_final_layer_height()
+        self.fps = fps
+        self.offsets = [layer.get_x_offset(t) for t in frame_times]
+
+    def get_x_offset(self, t):
+        return self.offsets[round(t * self.fps)]
+
+    def get_panorama(self):
+        return MemmapPanorama(self.fullpath)
+
+    def get_final_layer_height(self):
+        return self.height
+
+
+def render_segment(
+    base_layers: list[StitchedLayerFile],
+    object_layers: list[StitchedLayerFile],
+    video_size: tuple[int, int],
+    fps: int,
+    frame_indices: range,
+    output_path: str,
+    encoder_logfile_path: str,
+    encoder_settings: dict,
+    profile_frames: bool = False,
+) -> FrameProfiler:
+    """
+    Worker process entry point. Composites and encodes one segment of the timeline.
+
+    The segment is encoded to a temporary file and renamed once ffmpeg exits cleanly, so
+    a file at output_path is always a complete segment.
+
+    Returns:
+        FrameProfiler: The segment's frame timings if profile_frames is set, otherwise None.
+    """
+    frame_profiler = FrameProfiler(fps) if profile_frames else None
+    compositor = NumpyCompositor(
+        None, None, base_layers, object_layers, video_size, fps, frame_profiler
+    )
+    partial_path = output_path.replace(".mp4", ".partial.mp4")
+    compositor.render_frames(
+        frame_indices,
+        partial_path,
+        encoder_logfile_path,
+        show_progress=False,
+        **encoder_settings,
+    )
+    os.replace(partial_path, output_path)
+    return frame_profiler
+
+
+class SegmentedRenderer:
+    """
+    Render engine which splits the timeline into segments, renders and encodes each segment
+    in its own worker process, and joins the segments losslessly with ffmpeg's concat demuxer.
+
+    Finished segments are recorded in a manifest in the render segments directory. If a render
+    is interrupted, the next render with the same layers and encoder settings only renders
+    the segments which are not in the manifest.
+    """
+
+    def __init__(
+        self,
+        project: ProjectInterface,
+        logger: LoggerInterface,
+        base_layers: list[LayerInterface],
+        object_layers: list[LayerInterface],
+        video_size: tuple[int, int],
+        fps: int,
+        n_workers: int,
+        n_segments: int,
+        frame_profiler: FrameProfiler = None,
+        caller_prefix="SEGMENTED RENDER",
+    ):
+        """
+        Args:
+            frame_profiler (FrameProfiler, optional): If given, the workers record their frame
+                timings, which are merged into it (segments rendered by an earlier run are not profiled).
+        """
+        self.project = project
+        self.frame_profiler = frame_profiler
+        self.logger = logger
+        self.caller_prefix = caller_prefix
+        self.video_size = video_size
+        self.fps = fps
+        self.n_workers = n_workers
+
+        duration = base_layers[0].duration
+        self.frame_times = np.arange(0, duration, 1.0 / self.fps)
+        self.base_layers = [
+            StitchedLayerFile(layer, self.frame_times, fps) for layer in base_layers
+        ]
+        self.object_layers = [
+            StitchedLayerFile(layer, self.frame_times, fps) for layer in object_layers
+        ]
+        self.segments = self.__split_frames(len(self.frame_times), n_segments)
+        self.segments_dir = self.project.render_segments_dir()
+        self.manifest_path = os.path.join(
+            self.segments_dir, f"{self.project.name}-segments.json"
+        )
+
+    def log(self, *args, **kwargs):
+        self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
+
+    def render(
+        self,
+        output_path: str,
+        codec: str,
+        preset: str,
+        ffmpeg_params: list[str],
+        threads: int,
+    ) -> None:
+        """
+        Renders every unfinished segment in parallel, then concatenates all segments.
+
+        Args:
+            output_path (str): The path to write the final video to.
+            codec (str): The video codec to encode with.
+            preset (str): The ffmpeg preset.
+            ffmpeg_params (list[str]): Extra ffmpeg output arguments.
+            threads (int): The total number of threads, divided among the workers' ffmpeg processes.
+        """
+        encoder_settings = {
+            "codec": codec,
+            "preset": preset,
+            "ffmpeg_params": ffmpeg_params,
+            "threads": max(1, threads // self.n_workers),
+        }
+        signature = self.__get_signature(encoder_settings)
+        completed = self.__load_completed_segments(signature)
+        remaining = [
+            index for index in range(len(self.segments)) if index not in completed
+        ]
+        self.log(
+            f"Segments: {len(self.segments)} total, {len(completed)} already rendered,",
+            f"{len(remaining)} to render with {self.n_workers} workers",
+        )
+
+        if remaining:
+            with ProcessPoolExecutor(max_workers=self.n_workers) as executor:
+                futures = {
+                    executor.submit(
+                        render_segment,
+                        self.base_layers,
+                        self.object_layers,
+                        self.video_size,
+                        self.fps,
+                        self.segments[index],
+                        self.__get_segment_path(index),
+                        self.logger.get_isolated_child_logfile(
+                            f"{self.caller_prefix} > FFMPEG {index+1:05d}"
+                        ),
+                        encoder_settings,
+                        self.frame_profiler is not None,
+                    ): index
+                    for index in remaining
+                }
+                errors = {}
+                for future in as_completed(futures):
+                    index = futures[future]
+                    if future.cancelled():
+                        continue
+                    try:
+                        segment_profiler = future.result()
+                    except Exception as e:
+                        if not errors:
+                            # Segments that haven't started are dropped, the running ones still finish and are kept
+                            for pending in futures:
+                                pending.cancel()
+                        errors[index] = e
+                        self.__remove_partial_segment(index)
+                        continue
+                    if segment_profiler:
+                        self.frame_profiler.merge(segment_profiler)
+                    completed.add(index)
+                    self.__save_completed_segments(signature, completed)
+                    self.logger.progress_bar(
+                        len(completed),
+                        len(self.segments),
+                        "Rendered Segments",
+                        self.caller_prefix,
+                    )
+
+            if errors:
+                for index, error in sorted(errors.items()):
+                    self.log(f"Segment {index+1} failed: {error}", level="error")
+                raise errors[min(errors)]
+
+        self.__concat_segments(output_path)
+
+    def __split_frames(self, n_frames: int, n_segments: int) -> list[range]:
+        n_segments = max(1, min(n_segments, n_frames))
+        bounds = np.linspace(0, n_frames, n_segments + 1).astype(int)
+        return [range(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def __get_segment_path(self, index: int) -> str:
+        return os.path.join(self.segments_dir, f"segment_{index+1:05d}.mp4")
+
+    def __remove_partial_segment(self, index: int):
+        # A failed worker leaves its unfinished segment at the partial path (see render_segment)
+        try:
+            os.remove(self.__get_segment_path(index).replace(".mp4", ".partial.mp4"))
+        except FileNotFoundError:
+            pass
+
+    def __get_signature(self, encoder_settings: dict) -> str:
+        """Hash of everything that determines the segments' contents. Segments rendered with a different signature are stale."""
+        layers = []
+        for layer in self.base_layers + self.object_layers:
+            # Hash the contents rather than the mtime, since the layers are re-stitched on every run
+            file_hash = hashlib.sha1()
+            with open(layer.fullpath, "rb") as panorama_file:
+                for chunk in iter(lambda: panorama_file.read(1 << 20), b""):
+                    file_hash.update(chunk)
+            layers.append([file_hash.hexdigest(), layer.offsets])
+        signature_dict = {
+            "video_size": list(self.video_size),
+            "fps": self.fps,
+            "segments": [[s.start, s.stop] for s in self.segments],
+            "encoder_settings": encoder_settings,
+            "layers": layers,
+        }
+        return hashlib.sha1(
+            json.dumps(signature_dict, sort_keys=True, default=int).encode("utf-8")
+        ).hexdigest()
+
+    def __load_completed_segments(self, signature: str) -> set[int]:
+        if not os.path.exists(self.manifest_path):
+            return set()
+        with open(self.manifest_path, "r") as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest["signature"] != signature:
+            self.log("Segment manifest: Layers or encoder settings changed, re-rendering all segments")
+            return set()
+
+        return {
+            index
+            for index in manifest["completed"]
+            if os.path.exists(self.__get_segment_path(index))
+        }
+
+    def __save_completed_segments(self, signature: str, completed: set[int]):
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as manifest_file:
+            json.dump(
+                {"signature": signature, "completed": sorted(completed)},
+                manifest_file,
+                indent=4,
+            )
+        os.replace(temp_path, self.manifest_path)
+
+    def __concat_segments(self, output_path: str):
+        concat_list_path = os.path.join(self.segments_dir, "concat_list.txt")
+        with open(concat_list_path, "w") as concat_list:
+            for index in range(len(self.segments)):
+                # Quoted for ffmpeg's concat demuxer, a ' is closed, escaped and reopened
+                segment_path = self.__get_segment_path(index).replace("'", "'\\''")
+                concat_list.write(f"file '{segment_path}'\n")
+
+        self.log(f"Concatenating {len(self.segments)} segments")
+        subprocess.run(
+            [
+                get_setting("FFMPEG_BINARY"),
+                "-y",
+                "-loglevel",
+                "error",
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                concat_list_path,
+                "-c",
+                "copy",
+                output_path,
+            ],
+            check=True,
+        )
@@ -0,0 +1,244 @@
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from interfaces.project_interface import ProjectInterface
+from interfaces.logger_interface import LoggerInterface
+from parallax_video.run_report import RunReport
+from constants import STAGE_STATE_FILENAME
+
+
+class Stage:
+    """
+    A named step of the pipeline with declared inputs and outputs.
+
+    Inputs and outputs are callables, so they are evaluated right before the stage is checked,
+    i.e., after the stages it depends on have run (e.g., the number of step images is only known
+    after the inpaint loop).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run,
+        depends_on: list[str] = None,
+        input_files=None,
+        params=None,
+        output_files=None,
+    ):
+        """
+        Args:
+            name (str): The stage's name, used on the command line.
+            run (callable): Runs the stage.
+            depends_on (list[str], optional): Names of the stages that must run first.
+            input_files (callable, optional): Returns the paths of the files the stage reads.
+            params (callable, optional): Returns a JSON-serializable dict of the settings the stage depends on.
+            output_files (callable, optional): Returns the paths of the files the stage writes.
+        """
+        self.name = name
+        self.run = run
+        self.depends_on = depends_on or []
+        self.input_files = input_files or (lambda: [])
+        self.params = params or (lambda: {})
+        self.output_files = output_files or (lambda: [])
+
+
+class StageRunner:
+    """
+    Make-style runner for the pipeline's stages.
+
+    A stage is up to date if its fingerprint (a hash of the contents of its input files and of its
+    params) is the one recorded the last time it completed, and all of its output files exist.
+    Only stale stages run, so e.g. after a change to the render settings only the render stage
+    runs, and a stage whose inputs were rewritten with the same content stays up to date.
+
+    Stages whose dependencies are done run concurrently. The fingerprints, and a cache of file
+    hashes keyed by (size, mtime) so unchanged files aren't re-read, are kept in the project dir.
+    """
+
+    def __init__(
+        self,
+        project: ProjectInterface,
+        logger: LoggerInterface,
+        stages: list[Stage],
+        max_workers: int = None,
+        report: RunReport = None,
+        caller_prefix="STAGE RUNNER",
+    ):
+        self.project = project
+        self.report = report
+        self.logger = logger
+        self.caller_prefix = caller_prefix
+        self.stages = {stage.name: stage for stage in stages}
+        self.max_workers = max_workers or os.cpu_count()
+        # Stages are defined in dependency order, so the definition order is a valid run order
+        defined = set()
+        for stage in stages:
+            for dependency in stage.depends_on:
+                if dependency not in defined:
+                    raise ValueError(
+                        f"Stage {stage.name} depends on {dependency}, which is not defined before it"
+                    )
+            defined.add(stage.name)
+
+        self.state_path = os.path.join(self.project.project_dir_path, STAGE_STATE_FILENAME)
+        self.state_lock = threading.Lock()
+        self.__load_state()
+
+    def log(self, *args, **kwargs):
+        self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
+
+    def has_run(self, stage_name: str) -> bool:
+        """Whether the stage has completed before (in this or an earlier run)."""
+        return stage_name in self.state["stages"]
+
+    def get_downstream(self, stage_name: str) -> list[str]:
+        """Returns the stage and every stage that (transitively) depends on it, in definition order."""
+        downstream = {stage_name}
+        for stage in self.stages.values():
+            if downstream.intersection(stage.depends_on):
+                downstream.add(stage.name)
+        return [name for name in self.stages if name in downstream]
+
+    def status(self) -> dict:
+        """
+        Returns:
+            dict: Stage name -> "up to date" or the reason the stage is stale. A stage is also
+                stale if a stage it depends on is stale, since that may change its inputs.
+        """
+        statuses = {}
+        for stage in self.stages.values():
+            stale_dependencies = [
+                name for name in stage.depends_on if statuses[name] != "up to date"
+            ]
+            if stale_dependencies:
+                statuses[stage.name] = f"stale (depends on {', '.join(stale_dependencies)})"
+            else:
+                statuses[stage.name] = self.__get_stale_reason(stage) or "up to date"
+        return statuses
+
+    def run(self, stage_names: list[str] = None, force: list[str] = ()):
+        """
+        Runs the stale stages. Raises the first exception of a failed stage, after the stages
+        running at that time have finished (stages that depend on the failed one are not started).
+
+        Args:
+            stage_names (list[str], optional): Only consider these stages, the others are skipped
+                (their outputs are expected to exist). Defaults to all stages.
+            force (list[str], optional): Stages to run even if they are up to date.
+        """
+        for name in list(stage_names or []) + list(force):
+            if name not in self.stages:
+                raise ValueError(
+                    f"Unknown stage: {name}. Expected one of: {list(self.stages)}"
+                )
+        selected = [
+            name for name in self.stages if not stage_names or name in stage_names
+        ]
+        pending = list(selected)
+        done = set(self.stages) - set(selected)
+        futures = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or futures:
+                for name in list(pending):
+                    if all(dependency in done for dependency in self.stages[name].depends_on):
+                        pending.remove(name)
+                        futures[
+                            executor.submit(self.__run_stage, name, name in force)
+                        ] = name
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = futures.pop(future)
+                    # Re-raises the stage's exception, the running stages are waited for on exit
+                    future.result()
+                    done.add(name)
+
+        self.__save_state()
+
+    def __run_stage(self, name: str, force: bool):
+        stage = self.stages[name]
+        reason = "forced" if force else self.__get_stale_reason(stage)
+        if not reason:
+            self.log(f"Stage {name}: Up to date")
+            if self.report:
+                self.report.mark_skipped(name)
+            return
+
+        self.log(f"Stage {name}: Running ({reason})")
+        # Fingerprint of the inputs the stage runs with, so changes made while it runs make it stale
+        fingerprint = self.__get_fingerprint(stage)
+        if self.report:
+            with self.report.measure(name):
+                stage.run()
+        else:
+            stage.run()
+        with self.state_lock:
+            self.state["stages"][name] = fingerprint
+            self.__save_state()
+        self.log(f"Stage {name}: Completed")
+
+    def __get_stale_reason(self, stage: Stage):
+        """Returns why the stage needs to run, or None if it is up to date."""
+        if stage.name not in self.state["stages"]:
+            return "never completed"
+        missing = [path for path in stage.output_files() if not os.path.exists(path)]
+        if missing:
+            return f"missing output {os.path.basename(missing[0])}"
+        if self.__get_fingerprint(stage) != self.state["stages"][stage.name]:
+            return "inputs changed"
+        return None
+
+    def __get_fingerprint(self, stage: Stage) -> str:
+        fingerprint = hashlib.sha256(
+            json.dumps(stage.params(), sort_keys=True, default=str).encode("utf-8")
+        )
+        for path in sorted(stage.input_files()):
+            fingerprint.update(path.encode("utf-8"))
+            fingerprint.update(self.__hash_file(path).encode("utf-8"))
+        return fingerprint.hexdigest()
+
+    def __hash_file(self, path: str) -> str:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return "missing"
+        with self.state_lock:
+            cached = self.state["file_hashes"].get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        file_hash = hashlib.sha1()
+        with open(path, "rb") as input_file:
+            for chunk in iter(lambda: input_file.read(1 << 20), b""):
+                file_hash.update(chunk)
+        with self.state_lock:
+            self.state["file_hashes"][path] = [
+                stat.st_size,
+                stat.st_mtime_ns,
+                file_hash.hexdigest(),
+            ]
+        return file_hash.hexdigest()
+
+    def __load_state(self):
+        try:
+            with open(self.state_path, "r") as state_file:
+                self.state = json.load(state_file)
+        except (OSError, ValueError):
+            self.state = {}
+        self.state.setdefault("stages", {})
+        self.state.setdefault("file_hashes", {})
+
+    def __save_state(self):
+        # Forget the hashes of files that no longer exist
+        self.state["file_hashes"] = {
+            path: cached
+            for path, cached in self.state["file_hashes"].items()
+            if os.path.exists(path)
+        }
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as state_file:
+            json.dump(self.state, state_file, indent=4)
+        os.replace(temp_path, self.state_path)
@@ -0,0 +1,75 @@
+import queue
+import threading
+from interfaces.project_interface import ProjectInterface
+from interfaces.layer_interface import LayerInterface
+from interfaces.logger_interface import LoggerInterface
+
+
+class StreamingStitcher:
+    """
+    Consumer side of the pipelined inpaint -> stitch mode.
+
+    The inpaint loop (producer) puts the step number onto self.queue as soon as that step's
+    layer slices are saved. A background thread crops the step for every base layer and appends
+    it to the layer's panorama, so stitching is done by the time the last inpaint step returns.
+    The inpaint loop puts None onto the queue when it is done (or fails).
+    """
+
+    def __init__(
+        self,
+        project: ProjectInterface,
+        logger: LoggerInterface,
+        base_layers: list[LayerInterface],
+        total_steps: int,
+        caller_prefix="STREAM STITCHER",
+    ):
+        self.project = project
+        self.logger = logger
+        self.base_layers = base_layers
+        self.total_steps = total_steps
+        self.caller_prefix = caller_prefix
+        self.queue = queue.Queue()
+        self.__error = None
+        self.__thread = threading.Thread(target=self.__consume, daemon=True)
+
+    def log(self, *args, **kwargs):
+        self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
+
+    def start(self):
+        for layer in self.base_layers:
+            layer.start_streaming_stitch(self.total_steps)
+        self.__thread.start()
+
+    def finish(self):
+        """
+        Waits for every queued step to be stitched and finalizes the layers' panoramas.
+
+        Raises:
+            RuntimeError: If cropping or stitching a step failed in the consumer thread.
+        """
+        self.__thread.join()
+        if self.__error:
+            raise RuntimeError(f"Streaming stitcher failed: {self.__error}") from self.__error
+
+        for layer in self.base_layers:
+            layer.finish_streaming_stitch()
+        self.log("Stitching: Completed")
+
+    def __consume(self):
+        while True:
+            step_count = self.queue.get()
+            if step_count is None:
+                return
+            # After an error, keep draining the queue until the producer is done
+            if self.__error:
+                continue
+            try:
+                for layer in self.base_layers:
+                    layer.append_step_image(step_count)
+                self.log(
+                    f"Stitched step {step_count} into all layers",
+                    print_to_console=False,
+                    level="debug",
+                )
+            except Exception as e:
+                self.__error = e
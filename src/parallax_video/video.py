@@ -1,57 +1,134 @@
 import os
+import time
 from PIL import Image
 from moviepy.editor import CompositeVideoClip, VideoClip
 from layers.base import BaseLayer
 from layers.salient_object import SalientObjectLayer
 from inpaint.inpaint_loop import InpaintLooper
+from inpaint.step_scheduler import StepScheduler
+from comfy_api.server_manager import ComfyServerManager
+from parallax_video.compositor import NumpyCompositor
+from parallax_video.segmented_render import SegmentedRenderer
+from parallax_video.streaming_stitcher import StreamingStitcher
+from parallax_video.stage_runner import Stage, StageRunner
+from parallax_video.run_report import RunReport
+from parallax_video.frame_profiler import FrameProfiler
 from interfaces.project_interface import ProjectInterface
 from interfaces.layer_interface import LayerInterface
 from interfaces.logger_interface import LoggerInterface
 from constants import (
     VIDEO_CODEC,
+    DEFAULT_RENDER_ENGINE,
     DEV,
+    SALIENT_OBJECTS_WORKFLOW_PATH,
+    INPAINT_WORKFLOW_PATH,
+    INPAINT_MANIFEST_FILENAME,
 )
 
 
 class ParallaxVideo:
+    """
+    The pipeline, as stages run by a StageRunner (only the stale stages run):
+
+        objects -> slices -> inpaint -> stitch_layer_<n> (one per base layer) -> render
+        objects -> extend_objects -> render
+
+    With "stream_stitching", the base layers are stitched by the inpaint stage and there are no
+    stitch_layer_<n> stages.
+
+    The time and resources used by each stage (and each layer within it) are written to a run
+    report in the project's reports dir (see RunReport).
+    """
+
     def __init__(
         self,
         project: ProjectInterface,
         logger: LoggerInterface,
+        stages: list[str] = None,
+        downstream: bool = False,
+        force: bool = False,
+        dry_run: bool = False,
         caller_prefix="VIDEO EDITOR",
     ):
+        """
+        Args:
+            project (ProjectInterface): The project.
+            logger (LoggerInterface): The logger.
+            stages (list[str], optional): Only run these stages, even if they are up to date.
+                Defaults to every stale stage.
+            downstream (bool, optional): Also run the stages downstream of the given stages, if they are stale.
+            force (bool, optional): Run the stages even if they are up to date.
+            dry_run (bool, optional): Only log which stages are up to date.
+        """
         self.project = project
         self.logger = logger
         self.caller_prefix = caller_prefix
 
-        self.object_layers = self.__create_object_layers()
-        self.create_original_layer_slices()
+        # One warm comfy server for object extraction and the inpaint loop, only started if either runs
+        self.server_manager = ComfyServerManager(self.project, self.logger)
+        self.scheduler = StepScheduler(self.project, self.logger)
+        self.report = RunReport(self.project, self.logger)
+        self.stage_runner = StageRunner(
+            self.project,
+            self.logger,
+            self.__define_stages(),
+            self.project.config_file().get("stage_workers"),
+            self.report,
+        )
 
-        inpainter = InpaintLooper(project, logger)
-        inpainter.iterative_inpaint(int(self.project.config_file()["total_steps"]))
+        if dry_run:
+            for name, status in self.stage_runner.status().items():
+                self.log(f"Stage {name}: {status}")
+            return
 
-        self.log("Creating: Base layers")
-        self.base_layers = self.__create_base_layers()
-        for layer in self.base_layers:
-            self.log(f"Stitching: Layer {layer.index}")
-            layer.create_cropped_steps()
-            layer.stitch_cropped_steps()
-        for obj_layer in self.object_layers:
-            self.log(f"Extending: Oject layer {obj_layer.index+1}")
-            obj_layer.create_cropped_steps()
-            obj_layer.stitch_cropped_steps()
-
-        self.log("Generating videoclips", pad_with_rules=True)
-        self.log("Generating videoclips for each base layer")
-        self.layer_videoclips = self.create_layer_videoclips()
-        self.log("Generating videoclips and mask videoclips for each object layer")
-        self.object_layer_videoclips = self.create_object_layer_videoclips()
-        self.log("Compositing layer videoclips\n")
-        self.composite_layer_videoclips()
+        # The given stages always run, the stages downstream of them only if they are stale
+        stage_names = stages
+        if stages and downstream:
+            stage_names = [
+                name
+                for name in self.stage_runner.stages
+                if any(name in self.stage_runner.get_downstream(stage) for stage in stages)
+            ]
+        if force:
+            forced_stages = stage_names or list(self.stage_runner.stages)
+        else:
+            forced_stages = stages or []
+        error = None
+        try:
+            self.stage_runner.run(stage_names, force=forced_stages)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            cleanup_error = self.__finish_run(error)
+            # A stage's error is the one that is raised, errors while cleaning up after it are only logged
+            if cleanup_error and error is None:
+                raise cleanup_error
 
     def log(self, *args, **kwargs):
         self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
 
+    def __finish_run(self, error: BaseException = None):
+        """
+        Shuts down the comfy server, saves the config and writes the run report (also if a stage
+        failed, with the stages that completed and the error). Every step runs even if one fails.
+
+        Returns:
+            Exception | None: The first error while finishing, which is logged.
+        """
+        first_error = None
+        for finish_step in (
+            self.server_manager.shutdown,
+            self.project.save_config,
+            lambda: self.report.finish(error),
+        ):
+            try:
+                finish_step()
+            except Exception as e:
+                self.log(f"Error while finishing the run: {e}", level="error")
+                first_error = first_error or e
+        return first_error
+
     def create_original_layer_slices(self):
         """
         Creates and saves individual slices of the original layers from the input image.
@@ -72,11 +149,7 @@ class ParallaxVideo:
         for index, layer in enumerate(self.project.config_file()["layers"]):
             height = layer["height"]
             input_layer_image = input_image.crop((x, y, x + width, y + height))
-            input_layer_image.save(
-                os.path.join(
-                    self.project.original_layers_dir(), f"{index+1}_original_layer.png"
-                )
-            )
+            input_layer_image.save(self.__get_original_layer_slice_path(index))
             y += height
 
     def create_layer_videoclips(self) -> list[VideoClip]:
@@ -87,7 +160,7 @@ class ParallaxVideo:
         for layer, layer_config in zip(
             self.base_layers, self.project.config_file()["layers"]
         ):
-            layer_videoclip = layer.create_layer_videoclip()
+            layer_videoclip = layer.create_layer_videoclip(self.frame_profiler)
             layer_videoclip = layer_videoclip.set_position((x, y))
             layer_clips.append(layer_videoclip)
             y += layer_config["height"]
@@ -97,7 +170,7 @@ class ParallaxVideo:
     def create_object_layer_videoclips(self) -> list[VideoClip]:
         layer_clips = []
         for layer in self.object_layers:
-            layer_videoclip = layer.create_layer_videoclip()
+            layer_videoclip = layer.create_layer_videoclip(self.frame_profiler)
             layer_videoclip = layer_videoclip.set_position((0, 0))
             if layer_videoclip:
                 layer_clips.append(layer_videoclip)
@@ -118,22 +191,348 @@ class ParallaxVideo:
         This function creates a final video by compositing the layer clips and saving it to the specified output path.
         """
 
-        video_composite = CompositeVideoClip(
-            self.layer_videoclips + self.object_layer_videoclips,
-            size=self.__get_video_size(),
+        output_path = self.__get_output_path()
+        render_engine = self.__get_render_engine()
+        self.log(f"Render engine: {render_engine}")
+
+        if render_engine == "numpy":
+            compositor = NumpyCompositor(
+                self.project,
+                self.logger,
+                self.base_layers,
+                self.object_layers,
+                self.__get_video_size(),
+                self.project.config_file()["fps"],
+                self.frame_profiler,
+            )
+            compositor.render(output_path, **self.__get_encoder_settings())
+        elif render_engine == "segmented":
+            n_workers = self.project.config_file().get("render_workers", os.cpu_count())
+            renderer = SegmentedRenderer(
+                self.project,
+                self.logger,
+                self.base_layers,
+                self.object_layers,
+                self.__get_video_size(),
+                self.project.config_file()["fps"],
+                n_workers,
+                self.project.config_file().get("render_segments", n_workers),
+                self.frame_profiler,
+            )
+            renderer.render(output_path, **self.__get_encoder_settings())
+        elif render_engine == "moviepy":
+            video_composite = CompositeVideoClip(
+                self.layer_videoclips + self.object_layer_videoclips,
+                size=self.__get_video_size(),
+            )
+            if self.frame_profiler:
+                self.__profile_composite(video_composite)
+            video_composite.write_videofile(
+                output_path,
+                fps=self.project.config_file()["fps"],
+                **self.__get_encoder_settings(),
+            )
+        else:
+            raise ValueError(
+                f"Unknown render engine: {render_engine}. Expected 'moviepy', 'numpy' or 'segmented'"
+            )
+
+        self.log(f"Final video saved to: {output_path}", pad_with_rules=True)
+        if self.frame_profiler:
+            self.frame_profiler.report(self.project, self.logger, self.caller_prefix)
+
+    def __define_stages(self) -> list[Stage]:
+        config = self.project.config_file
+        n_layers = len(config()["layers"])
+        stream_stitching = config().get("stream_stitching", False)
+
+        stages = [
+            Stage(
+                "objects",
+                self.__run_objects_stage,
+                input_files=lambda: [
+                    self.__get_original_input_image_path(),
+                    os.path.join(self.project.repo_root, SALIENT_OBJECTS_WORKFLOW_PATH),
+                ],
+                params=lambda: {"salient_objects": config()["salient_objects"]},
+                output_files=lambda: [
+                    path
+                    for object_config in config().get("salient_object_layers", [])
+                    for path in (
+                        object_config["alpha_layer_fullpath"],
+                        object_config["base_layer_fullpath"],
+                    )
+                ],
+            ),
+            Stage(
+                "slices",
+                self.create_original_layer_slices,
+                depends_on=["objects"],
+                input_files=lambda: [config()["input_image_path"]],
+                params=lambda: {"layers": config()["layers"]},
+                output_files=lambda: [
+                    self.__get_original_layer_slice_path(index) for index in range(n_layers)
+                ],
+            ),
+            Stage(
+                "inpaint",
+                self.__run_inpaint_stage,
+                depends_on=["slices"],
+                input_files=lambda: [
+                    config()["input_image_path"],
+                    os.path.join(self.project.repo_root, INPAINT_WORKFLOW_PATH),
+                ],
+                params=lambda: self.__get_config_values(
+                    "layers",
+                    "total_steps",
+                    "prompt_prepend",
+                    "min_inpaint_gap",
+                    "roi_inpainting",
+                    "roi_context_margin",
+                    "inpaint_backend",
+                    "opencv_inpaint_method",
+                    "opencv_inpaint_radius",
+                    "stream_stitching",
+                ),
+                output_files=lambda: [
+                    os.path.join(self.project.layer_outputs_dir(), INPAINT_MANIFEST_FILENAME),
+                ]
+                + [
+                    os.path.join(
+                        self.project.layer_outputs_dir(),
+                        f"end_step_{step:05d}_.png",
+                    )
+                    for step in range(1, self.scheduler.n_steps() + 1)
+                ]
+                # The layer slices of every step, read by the stitch_layer_<n> stages
+                + [path for index in range(n_layers) for path in self.__get_step_slice_paths(index)]
+                + (
+                    [self.__get_base_panorama_path(index) for index in range(n_layers)]
+                    if stream_stitching
+                    else []
+                ),
+            ),
+        ]
+
+        base_stitch_stages = ["inpaint"]
+        if not stream_stitching:
+            base_stitch_stages = [f"stitch_layer_{index+1}" for index in range(n_layers)]
+            for index in range(n_layers):
+                stages.append(
+                    Stage(
+                        base_stitch_stages[index],
+                        lambda index=index: self.__stitch_base_layer(index),
+                        depends_on=["inpaint"],
+                        input_files=lambda index=index: [
+                            self.__get_original_layer_slice_path(index)
+                        ]
+                        + self.__get_step_slice_paths(index),
+                        params=lambda index=index: self.__get_stitch_params(index),
+                        output_files=lambda index=index: [
+                            self.__get_base_panorama_path(index)
+                        ],
+                    )
+                )
+
+        stages += [
+            Stage(
+                "extend_objects",
+                self.__run_extend_objects_stage,
+                depends_on=["objects"],
+                input_files=lambda: [
+                    object_config["alpha_layer_fullpath"]
+                    for object_config in config().get("salient_object_layers", [])
+                ],
+                params=lambda: self.__get_config_values(
+                    "layers",
+                    "total_steps",
+                    "seconds_per_step",
+                    "export_stitched_layers",
+                ),
+                output_files=self.__get_object_panorama_paths,
+            ),
+            Stage(
+                "render",
+                self.__run_render_stage,
+                depends_on=base_stitch_stages + ["extend_objects"],
+                input_files=lambda: [
+                    path
+                    for index in range(n_layers)
+                    for path in (
+                        self.__get_original_layer_slice_path(index),
+                        self.__get_base_panorama_path(index),
+                    )
+                ]
+                + self.__get_object_panorama_paths(),
+                params=lambda: {
+                    "settings": self.__get_config_values(
+                        "fps",
+                        "total_steps",
+                        "seconds_per_step",
+                        "render_engine",
+                        "render_workers",
+                        "render_segments",
+                    ),
+                    "encoder_settings": self.__get_encoder_settings(),
+                },
+                output_files=lambda: [self.__get_output_path()],
+            ),
+        ]
+        return stages
+
+    def __run_objects_stage(self):
+        if self.stage_runner.has_run("objects"):
+            # The tags or the input image changed since the last extraction, start over from the original input image
+            self.project.update_config(
+                "input_image_path", self.__get_original_input_image_path()
+            )
+            self.project.update_config("salient_object_layers", [])
+        self.log("Creating: Object layers")
+        self.__create_object_layers()
+        # Object extraction replaces the input image, persist it before the long inpaint loop
+        self.project.save_config()
+
+    def __run_inpaint_stage(self):
+        n_inpaint_steps = self.scheduler.n_steps()
+        inpainter = InpaintLooper(
+            self.project, self.logger, self.server_manager, self.scheduler
+        )
+        if self.project.config_file().get("stream_stitching", False):
+            # Crop and stitch each step as soon as it is inpainted, while the loop keeps running
+            self.log("Creating: Base layers (streaming stitching)")
+            base_layers = self.__create_base_layers()
+            stitcher = StreamingStitcher(
+                self.project, self.logger, base_layers, n_inpaint_steps
+            )
+            stitcher.start()
+            inpainter.iterative_inpaint(n_inpaint_steps, step_queue=stitcher.queue)
+            stitcher.finish()
+            for layer in base_layers:
+                layer.get_stitched_fullpath()
+        else:
+            inpainter.iterative_inpaint(n_inpaint_steps)
+
+    def __stitch_base_layer(self, index):
+        layer = self.__create_base_layer(index)
+        stage_name = f"stitch_layer_{index+1}"
+        self.log(f"Stitching: Layer {layer.index}")
+        with self.report.measure("crop", stage_name):
+            layer.create_cropped_steps()
+        with self.report.measure("stitch", stage_name):
+            layer.stitch_cropped_steps()
+            layer.get_stitched_fullpath()
+
+    def __run_extend_objects_stage(self):
+        for obj_layer in self.__create_object_layers():
+            self.log(f"Extending: Oject layer {obj_layer.index+1}")
+            with self.report.measure(f"object_layer_{obj_layer.index+1}", "extend_objects"):
+                obj_layer.create_cropped_steps()
+                obj_layer.stitch_cropped_steps()
+                obj_layer.get_stitched_fullpath()
+
+    def __run_render_stage(self):
+        self.frame_profiler = (
+            FrameProfiler(self.project.config_file()["fps"])
+            if self.project.config_file().get("profile_render", False)
+            else None
+        )
+        self.base_layers = self.__create_base_layers()
+        self.object_layers = self.__create_object_layers()
+        with self.report.measure("load_layers", "render"):
+            for layer in self.base_layers + self.object_layers:
+                layer.load_stitched_panorama()
+
+        # The numpy and segmented render engines read the stitched layers directly and don't need videoclips
+        if self.__get_render_engine() == "moviepy":
+            with self.report.measure("videoclips", "render"):
+                self.log("Generating videoclips", pad_with_rules=True)
+                self.log("Generating videoclips for each base layer")
+                self.layer_videoclips = self.create_layer_videoclips()
+                self.log("Generating videoclips and mask videoclips for each object layer")
+                self.object_layer_videoclips = self.create_object_layer_videoclips()
+        self.log("Compositing layer videoclips\n")
+        with self.report.measure("encode", "render"):
+            self.composite_layer_videoclips()
+
+    def __profile_composite(self, video_composite: CompositeVideoClip):
+        """
+        Records the time of compositing each frame (including the layers' frame fetches, which are
+        also recorded on their own), and the time between frames, i.e., moviepy writing the
+        previous frame to ffmpeg.
+        """
+        profiler = self.frame_profiler
+        last_frame_end = [None]
+
+        def make_frame(t):
+            start = time.perf_counter()
+            frame_index = profiler.frame_index(t)
+            if last_frame_end[0] is not None:
+                profiler.record("encoder write", frame_index - 1, start - last_frame_end[0])
+            frame = composite_make_frame(t)
+            last_frame_end[0] = time.perf_counter()
+            profiler.record("composite", frame_index, last_frame_end[0] - start)
+            return frame
+
+        composite_make_frame = video_composite.make_frame
+        video_composite.make_frame = make_frame
+
+    def __get_config_values(self, *keys: str) -> dict:
+        """The values of the config keys (None if not set), from one read of the config."""
+        config = self.project.config_file()
+        return {key: config.get(key) for key in keys}
+
+    def __get_stitch_params(self, index: int) -> dict:
+        config = self.project.config_file()
+        return {
+            "layer": config["layers"][index],
+            "shifts": [shifts[index] for shifts in self.scheduler.shifts],
+            "export_stitched_layers": config.get("export_stitched_layers"),
+        }
+
+    def __get_original_input_image_path(self) -> str:
+        """The input image from before the salient objects were removed from it."""
+        config = self.project.config_file()
+        return config.get("input_image_original_path", config["input_image_path"])
+
+    def __get_original_layer_slice_path(self, index):
+        return os.path.join(
+            self.project.original_layers_dir(), f"{index+1}_original_layer.png"
         )
 
-        output_path = os.path.join(
+    def __get_step_slice_paths(self, index):
+        # The shift preprocessor saves the layer slices of the input image and of every step's output
+        return [
+            os.path.join(self.project.layer_outputs_dir(), f"layer_{index+1}_{step:05d}_.png")
+            for step in range(1, self.scheduler.n_steps() + 2)
+        ]
+
+    def __get_base_panorama_path(self, index):
+        return os.path.join(
+            self.project.stitched_inpainted_dir(),
+            f"layer_{index+1}_stitched_inpainted_regions.npy",
+        )
+
+    def __get_object_panorama_paths(self):
+        return [
+            os.path.join(
+                self.project.stitched_objects_dir(),
+                f"{object_config['name_prefix']}_stitched_alpha_layer.npy",
+            )
+            for object_config in self.project.config_file().get("salient_object_layers", [])
+        ]
+
+    def __get_output_path(self):
+        return os.path.join(
             self.project.output_video_dir(),
             f"{self.project.name}-final_parallax_video.mp4",
         )
 
-        video_composite.write_videofile(
-            output_path,
-            codec=VIDEO_CODEC,
-            fps=self.project.config_file()["fps"],
-            preset="slow" if DEV else "medium",
-            ffmpeg_params=(
+    def __get_encoder_settings(self):
+        """Encoder settings shared by every render engine."""
+        return {
+            "codec": VIDEO_CODEC,
+            "preset": "slow" if DEV else "medium",
+            "ffmpeg_params": (
                 [
                     "-crf",
                     "18",
@@ -149,33 +548,40 @@ class ParallaxVideo:
                 if DEV
                 else ["-crf", "18", "-b:v", "2M", "-pix_fmt", "yuv420p"]
             ),
-            threads=12 if DEV else 4,
-        )
-
-        self.log(f"Final video saved to: {output_path}", pad_with_rules=True)
+            "threads": 12 if DEV else 4,
+        }
 
     def __create_base_layers(self) -> list[LayerInterface]:
-        layers = []
-        for index, layer_config in enumerate(self.project.config_file()["layers"]):
-            name_prefix = f"layer_{index+1}"
-            layers.append(
-                BaseLayer(
-                    self.project, self.logger, layer_config, name_prefix, index + 1
-                )
-            )
+        return [
+            self.__create_base_layer(index)
+            for index in range(len(self.project.config_file()["layers"]))
+        ]
 
-        return layers
+    def __create_base_layer(self, index) -> LayerInterface:
+        return BaseLayer(
+            self.project,
+            self.logger,
+            self.project.config_file()["layers"][index],
+            f"layer_{index+1}",
+            index + 1,
+            self.scheduler,
+        )
 
     def __create_object_layers(self) -> list[LayerInterface]:
         layers = []
         for index, tags in enumerate(self.project.config_file()["salient_objects"]):
             # Sometimes layers will return False (because nothing was segmented/extracted)
-            object_layer = SalientObjectLayer(self.project, self.logger, tags, index)
+            object_layer = SalientObjectLayer(
+                self.project, self.logger, tags, index, self.server_manager
+            )
             if object_layer and object_layer.is_layer:
                 layers.append(object_layer)
 
         return layers
 
+    def __get_render_engine(self):
+        return self.project.config_file().get("render_engine", DEFAULT_RENDER_ENGINE)
+
     def __get_video_size(self):
         input_image = Image.open(self.project.config_file()["input_image_path"])
         return input_image.size
@@ -1,22 +1,89 @@
 from PIL import Image
 import os
+import cv2
+import numpy as np
 from interfaces.project_interface import ProjectInterface
 from interfaces.logger_interface import LoggerInterface
+from inpaint.step_scheduler import StepScheduler
+
+
+def shift_layers(
+    image: np.ndarray,
+    layer_rows: list[tuple[int, int]],
+    shifts: list[tuple[int, int]],
+    canvas: np.ndarray,
+    gap_mask: np.ndarray,
+    opaque: bool = True,
+):
+    """
+    Copies each layer of the image into the canvas at its shifted position, and marks the pixels no
+    layer covers in the gap mask. Nothing is allocated, the canvas and the mask are overwritten.
+
+    Layers are placed from top to bottom, so where a layer moving vertically overlaps its neighbor,
+    the lower layer covers the upper one. Parts shifted past the canvas's edges are cut off.
+
+    Args:
+        image (np.ndarray): The (height, width, 4) C-contiguous uint8 RGBA input image.
+        layer_rows (list[tuple[int, int]]): The (top, bottom) rows of each layer, bottom exclusive.
+        shifts (list[tuple[int, int]]): The (x, y) shift of each layer in px, positive is right and down.
+        canvas (np.ndarray): The (height, width, 4) C-contiguous uint8 RGBA output, transparent (0, 0, 0, 0) in the gaps.
+        gap_mask (np.ndarray): The (height, width) bool output, True in the gaps.
+        opaque (bool, optional): Whether every pixel of the image is opaque. Otherwise, the
+            image's transparent pixels are gaps too. Defaults to True.
+    """
+    height, width = image.shape[:2]
+    # One 32-bit word per pixel, so each row of a layer is copied as one block
+    image_pixels = image.view(np.uint32)[:, :, 0]
+    canvas_pixels = canvas.view(np.uint32)[:, :, 0]
+    canvas_pixels.fill(0)
+    gap_mask.fill(True)
+    for (top, bottom), (dx, dy) in zip(layer_rows, shifts):
+        dst_top, dst_bottom = max(0, top + dy), min(height, bottom + dy)
+        dst_left, dst_right = max(0, dx), min(width, width + dx)
+        if dst_top >= dst_bottom or dst_left >= dst_right:
+            continue
+        canvas_pixels[dst_top:dst_bottom, dst_left:dst_right] = image_pixels[
+            dst_top - dy : dst_bottom - dy, dst_left - dx : dst_right - dx
+        ]
+        gap_mask[dst_top:dst_bottom, dst_left:dst_right] = False
+    if not opaque:
+        gap_mask |= canvas[:, :, 3] == 0
 
 
 class LayerShifter:
+    """
+    Shifts the layers of each step's input image by their velocities, leaving transparent gaps to inpaint.
+
+    The shifted canvas and its gap mask are preallocated arrays that are reused every step (see
+    shift_layers), so the image returned by create_shifted_canvas is overwritten by the next call.
+    Layers can move in either direction on both axes.
+    """
+
     def __init__(
         self,
         project: ProjectInterface,
         logger: LoggerInterface,
+        scheduler: StepScheduler,
         caller_prefix="PREPROCESS > SHIFT",
     ):
         self.project = project
         self.logger = logger
-        self.start_image_fullpath = project.config_file()["input_image_path"]
-        self.start_image_pil = Image.open(self.start_image_fullpath)
+        self.scheduler = scheduler
         self.caller_prefix = caller_prefix
         self.step_count = 1
+        # If set, start step images are saved in the background (they are only kept for archival)
+        self.image_writer = None
+
+        self.layer_rows = []
+        top = 0
+        for layer_config in self.project.config_file()["layers"]:
+            self.layer_rows.append((top, top + layer_config["height"]))
+            top += layer_config["height"]
+        # Allocated on the first step, with the input image's size
+        self.canvas = None
+        self.gap_mask = None
+        # RGB input images are converted into this buffer
+        self.rgba = None
 
     def log(self, *args, **kwargs):
         self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
@@ -26,105 +93,99 @@ class LayerShifter:
             self.project.layer_outputs_dir(),
             f"start_step_{self.step_count:05d}_.png",
         )
-        img.save(path)
+        if self.image_writer:
+            # The canvas buffer is reused by the next step, before the writer gets to it
+            self.image_writer.write_image(img.copy(), path)
+        else:
+            img.save(path)
         return path
 
-    def x_velocity(self, layer_config):
-        return round(layer_config["velocity"][0])
+    def x_velocity(self, layer_index):
+        # How far the layer is shifted in the current step (see StepScheduler)
+        return self.scheduler.get_x_shift(self.step_count - 1, layer_index)
 
-    def y_velocity(self, layer_config):
-        return round(layer_config["velocity"][1])
+    def y_velocity(self, layer_index):
+        return self.scheduler.get_y_shift(self.step_count - 1, layer_index)
 
     def create_shifted_image(self, input_image_pil: Image.Image) -> str:
-        self.slice_and_shift_layers(input_image_pil)
-        canvas = Image.new("RGBA", input_image_pil.size, (0, 0, 0, 0))
-
-        y = 0
-        for layer, layer_config in zip(
-            self.cropped_shifted_layers, self.project.config_file()["layers"]
-        ):
-            # Moving right
-            if self.x_velocity(layer_config) >= 0:
-                # Moving down
-                if self.y_velocity(layer_config) >= 0:
-                    canvas.paste(
-                        layer,
-                        (
-                            self.x_velocity(layer_config),
-                            y + self.y_velocity(layer_config),
-                        ),
-                    )
-                # Moving up
-                else:
-                    canvas.paste(layer, (self.x_velocity(layer_config), y))
-            # Moving left
-            else:
-                # Moving down
-                if self.y_velocity(layer_config) >= 0:
-                    canvas.paste(layer, (0, y + self.y_velocity(layer_config)))
-                # Moving up
-                else:
-                    canvas.paste(layer, (0, y))
-
-            y += layer.height
-
-        save_path = self.save_img(canvas)
+        """Shifts the layers of the input image, saves the result, and returns the saved image's path."""
+        return self.create_shifted_canvas(input_image_pil)[1]
+
+    def create_shifted_canvas(
+        self, input_image_pil: Image.Image
+    ) -> tuple[Image.Image, str]:
+        """
+        Saves the unshifted layer slices (read by the layers' stitching), shifts the layers of the
+        input image and saves the result.
+
+        Returns:
+            tuple[Image.Image, str]: The shifted image (with transparent gaps) and the path it is
+                saved to. The image shares the shifter's canvas buffer, which the next call overwrites.
+        """
+        if input_image_pil.mode not in ("RGB", "RGBA"):
+            input_image_pil = input_image_pil.convert("RGB")
+        image = np.asarray(input_image_pil)
+        self.save_layer_slices(image)
+        canvas, _ = self.shift(image)
+
+        canvas_pil = Image.fromarray(canvas, "RGBA")
+        save_path = self.save_img(canvas_pil)
         self.step_count += 1
 
-        return save_path
+        return canvas_pil, save_path
 
-    def slice_and_shift_layers(self, input_image_pil: Image.Image):
+    def recreate_shifted_canvas(
+        self, input_image_pil: Image.Image, step_count: int
+    ) -> Image.Image:
         """
-        Cuts the input image into slices defined by each layers' dimensions.
+        Shifts the layers of the input image the way the given step did, without saving anything
+        or changing the step count (see InpaintCheckpoint).
+
+        Returns:
+            Image.Image: The shifted image. It shares the shifter's canvas buffer, like create_shifted_canvas.
         """
-        self.log("Separating layers")
-        self.cropped_shifted_layers = []
-        top = 0
-        bottom = 0
-        layer_n = 0
-        for layer_config in self.project.config_file()["layers"]:
-            x_velocity = self.x_velocity(layer_config)
-            y_velocity = self.y_velocity(layer_config)
-            bottom += layer_config["height"]
-            if x_velocity < 0:
-                left = abs(x_velocity)
-                right = input_image_pil.width
-            else:
-                left = 0
-                right = input_image_pil.width - x_velocity
-
-            # If bottom layer, and y_velocity is negative, then crop
-            if (
-                y_velocity < 0
-                and layer_n == len(self.project.config_file()["layers"]) - 1
-            ):
-                bottom -= abs(y_velocity)
-            # If top layer, and y_velocity is positive, then crop
-            elif y_velocity > 0 and layer_n == 0:
-                top += y_velocity
-
-            layer_pil = input_image_pil.crop((left, top, right, bottom))
-
-            # Save unshifted layers for base Layer to use in stitching
-            layer_pil_unshifted = input_image_pil.crop((0, top, input_image_pil.width, bottom))
-            layer_pil_unshifted.save(
+        if input_image_pil.mode not in ("RGB", "RGBA"):
+            input_image_pil = input_image_pil.convert("RGB")
+        current_step_count = self.step_count
+        self.step_count = step_count
+        try:
+            canvas, _ = self.shift(np.asarray(input_image_pil))
+        finally:
+            self.step_count = current_step_count
+        return Image.fromarray(canvas, "RGBA")
+
+    def shift(self, image: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Shifts the layers of the input image by their velocities in the current step, without saving anything.
+
+        Args:
+            image (np.ndarray): The (height, width, 3) RGB or (height, width, 4) RGBA uint8 input image.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The shifter's RGBA canvas and gap mask buffers.
+        """
+        if self.canvas is None or self.canvas.shape[:2] != image.shape[:2]:
+            self.canvas = np.zeros((*image.shape[:2], 4), dtype=np.uint8)
+            self.gap_mask = np.zeros(image.shape[:2], dtype=bool)
+            self.rgba = np.zeros((*image.shape[:2], 4), dtype=np.uint8)
+        opaque = image.shape[2] == 3
+        if opaque:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2RGBA, dst=self.rgba)
+        shifts = [
+            (self.x_velocity(layer_index), self.y_velocity(layer_index))
+            for layer_index in range(len(self.layer_rows))
+        ]
+        shift_layers(
+            np.ascontiguousarray(image), self.layer_rows, shifts, self.canvas, self.gap_mask, opaque
+        )
+        return self.canvas, self.gap_mask
+
+    def save_layer_slices(self, image: np.ndarray):
+        """Saves the unshifted slice of each layer, for the layers to crop the newly inpainted strips from."""
+        for layer_index, (top, bottom) in enumerate(self.layer_rows):
+            Image.fromarray(image[top:bottom]).save(
                 os.path.join(
                     self.project.layer_outputs_dir(),
-                    f"layer_{layer_n+1}_{self.step_count:05d}_.png",
+                    f"layer_{layer_index+1}_{self.step_count:05d}_.png",
                 )
             )
-
-            # Readjust y position so rest of layers arent also cropped horizontally (only layer bordering on the horizontal edge towards the direction of movement)
-            # If bottom layer, and y_velocity is negative
-            if (
-                y_velocity < 0
-                and layer_n == len(self.project.config_file()["layers"]) - 1
-            ):
-                bottom += abs(y_velocity)
-            # If top layer, and y_velocity is positive
-            if y_velocity > 0 and layer_n == 0:
-                top -= y_velocity
-
-            self.cropped_shifted_layers.append(layer_pil)
-            top += layer_config["height"]
-            layer_n += 1
@@ -0,0 +1,131 @@
+import numpy as np
+from PIL import Image
+from interfaces.project_interface import ProjectInterface
+from interfaces.logger_interface import LoggerInterface
+from constants import ROI_CONTEXT_MARGIN, ROI_SIZE_MULTIPLE, FEATHERING_MARGIN
+
+
+class RegionOfInterestPacker:
+    """
+    Region-of-interest inpainting: instead of sending the whole shifted canvas to the inpaint
+    workflow, only the transparent gaps (plus some context around them) are sent.
+
+    pack() finds the bounding box of the transparent pixels in each layer's rows, expands it by
+    the context margin, and places the crops side by side in one opaque "atlas" image, so every
+    gap is inpainted by one prompt. unpack() pastes the inpainted gaps (grown by the inpaint
+    workflow's mask feathering) from the atlas back into the canvas. The rest of the canvas is
+    never round-tripped through the VAE.
+    """
+
+    def __init__(
+        self,
+        project: ProjectInterface,
+        logger: LoggerInterface,
+        caller_prefix="PREPROCESS > ROI",
+    ):
+        self.project = project
+        self.logger = logger
+        self.caller_prefix = caller_prefix
+        self.context_margin = int(
+            self.project.config_file().get("roi_context_margin", ROI_CONTEXT_MARGIN)
+        )
+        # Same amount the inpaint workflow grows the mask by, plus its blur radius (must be inside the crop)
+        self.paste_margin = min(
+            int(FEATHERING_MARGIN * 1.85) + int(np.ceil(FEATHERING_MARGIN / 4)),
+            self.context_margin,
+        )
+        # Read once, __find_regions runs for every step
+        self.layer_heights = [
+            int(layer_config["height"])
+            for layer_config in self.project.config_file()["layers"]
+        ]
+        # (crop_box, paste_box, atlas_x) for every packed region, boxes are (left, top, right, bottom)
+        self.regions = []
+
+    def log(self, *args, **kwargs):
+        self.logger.log(caller_prefix=self.caller_prefix, *args, **kwargs)
+
+    def pack(self, canvas: Image.Image, gap_mask: np.ndarray = None):
+        """
+        Packs the canvas's gap regions into one atlas image.
+
+        Args:
+            canvas (Image.Image): The shifted RGBA canvas, transparent where it needs inpainting.
+            gap_mask (np.ndarray, optional): The canvas's transparent pixels, if already known (see LayerShifter).
+
+        Returns:
+            Image.Image | None: The RGBA atlas, or None if the canvas has no transparent pixels.
+        """
+        rgba = np.asarray(canvas.convert("RGBA"))
+        if gap_mask is None:
+            gap_mask = rgba[:, :, 3] == 0
+        self.regions = []
+        atlas_width = 0
+        atlas_height = 0
+        for crop_box, paste_box in self.__find_regions(gap_mask):
+            self.regions.append((crop_box, paste_box, atlas_width))
+            atlas_width += crop_box[2] - crop_box[0]
+            atlas_height = max(atlas_height, crop_box[3] - crop_box[1])
+        if not self.regions:
+            return None
+
+        # Diffusion models need dimensions that are a multiple of the latent scale
+        atlas_width = -(-atlas_width // ROI_SIZE_MULTIPLE) * ROI_SIZE_MULTIPLE
+        atlas_height = -(-atlas_height // ROI_SIZE_MULTIPLE) * ROI_SIZE_MULTIPLE
+        atlas = np.zeros((atlas_height, atlas_width, 4), dtype=np.uint8)
+        # Padding is opaque (not inpainted) and repeats the edge of the crops
+        atlas[:, :, 3] = 255
+        for (left, top, right, bottom), _, atlas_x in self.regions:
+            crop = rgba[top:bottom, left:right]
+            atlas[: crop.shape[0], atlas_x : atlas_x + crop.shape[1]] = crop
+            atlas[crop.shape[0] :, atlas_x : atlas_x + crop.shape[1], :3] = crop[-1, :, :3]
+        last_x = self.regions[-1][2] + self.regions[-1][0][2] - self.regions[-1][0][0]
+        atlas[:, last_x:, :3] = atlas[:, last_x - 1 : last_x, :3]
+
+        self.log(
+            f"ROI: {len(self.regions)} regions packed into {atlas_width}x{atlas_height}",
+            f"({100 * atlas_width * atlas_height / (canvas.width * canvas.height):.1f}% of the canvas area)",
+        )
+        return Image.fromarray(atlas, "RGBA")
+
+    def unpack(self, inpainted_atlas: Image.Image, canvas: Image.Image) -> Image.Image:
+        """
+        Pastes the inpainted regions of the atlas back into the canvas packed by the last pack() call.
+
+        Returns:
+            Image.Image: The inpainted RGB canvas.
+        """
+        result = np.array(canvas.convert("RGB"))
+        atlas = np.asarray(inpainted_atlas.convert("RGB"))
+        for (crop_left, crop_top, _, _), (left, top, right, bottom), atlas_x in self.regions:
+            ax = atlas_x + left - crop_left
+            ay = top - crop_top
+            result[top:bottom, left:right] = atlas[
+                ay : ay + bottom - top, ax : ax + right - left
+            ]
+        return Image.fromarray(result, "RGB")
+
+    def __find_regions(self, transparent: np.ndarray):
+        """Yields (crop_box, paste_box) for the transparent pixels in each layer's rows."""
+        height, width = transparent.shape
+        y = 0
+        for layer_height in self.layer_heights:
+            band_bottom = min(y + layer_height, height)
+            band = transparent[y:band_bottom]
+            rows = np.flatnonzero(band.any(axis=1))
+            if rows.size:
+                cols = np.flatnonzero(band.any(axis=0))
+                gap_box = (cols[0], y + rows[0], cols[-1] + 1, y + rows[-1] + 1)
+                yield self.__expand(gap_box, self.context_margin, width, height), self.__expand(
+                    gap_box, self.paste_margin, width, height
+                )
+            y = band_bottom
+
+    def __expand(self, box, margin, width, height):
+        left, top, right, bottom = box
+        return (
+            int(max(0, left - margin)),
+            int(max(0, top - margin)),
+            int(min(width, right + margin)),
+            int(min(height, bottom + margin)),
+        )
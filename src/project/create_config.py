@@ -1,8 +1,7 @@
-import time
 from PIL import Image
-import math
 import re
 from termcolor import colored
+from .project_spec import config_from_spec
 
 
 def create_config():
@@ -19,13 +18,12 @@ def create_config():
     using_depth_maps = False
     using_segmentation = False
 
-    config = {"created_at": time.ctime()}
+    # The answers are collected into a project spec (see project_spec.py)
+    spec = {}
 
     original_input_image_path = input("Enter the input image path: ")
-    config["original_input_image_path"] = original_input_image_path
+    spec["input_image"] = original_input_image_path
     input_image = Image.open(original_input_image_path)
-    config["input_image_width"] = input_image.width
-    config["input_image_height"] = input_image.height
 
     print_list(
         [
@@ -37,28 +35,7 @@ def create_config():
         ]
     )
     direction = float(input("> "))
-    # handle if given negative angle
-    if direction < 0:
-        direction = 360 + direction
-    # convert to 0-360 form
-    direction = direction % 360
-    direction_theta = math.radians(direction)
-    config["direction"] = direction
-    config["direction_theta"] = direction_theta
-    int_direction = int(direction)
-    if int_direction == 0:
-        config["velocity_vector"] = (1, 0)
-    elif int_direction == 180:
-        config["velocity_vector"] = (-1, 0)
-    elif int_direction == 90:
-        config["velocity_vector"] = (0, 1)
-    elif int_direction == 270:
-        config["velocity_vector"] = (0, -1)
-    else:
-        config["velocity_vector"] = (
-            math.cos(direction_theta),
-            math.sin(direction_theta),
-        )
+    spec["direction"] = direction
 
     layers = []
     if not using_segmentation:
@@ -108,10 +85,7 @@ def create_config():
             layers[i]["distance"] = re.sub("[^0-9]", "", layers[i]["distance"])
             layers[i]["distance"] = float(layers[i]["distance"])
 
-    # Convert distances to ratios
-    total_distance = sum([layer["distance"] for layer in layers])
-    for i in range(num_layers):
-        layers[i]["distance_ratio"] = layers[i]["distance"] / total_distance
+    spec["layers"] = layers
 
     print_list(
         [
@@ -122,7 +96,7 @@ def create_config():
         ]
     )
 
-    config["smoothness"] = int(1000 / int(input("(int) Smoothness (0-100):\n> ")))
+    spec["smoothness"] = int(input("(int) Smoothness (1-100):\n> "))
 
     print_list(
         [
@@ -132,7 +106,7 @@ def create_config():
             "\nRecommended: 6-20, assuming a smoothness of ~80",
         ]
     )
-    config["seconds_per_step"] = int(input("(int) Seconds Per Step:\n> "))
+    spec["seconds_per_step"] = int(input("(int) Seconds Per Step:\n> "))
 
     print_list(
         [
@@ -145,7 +119,7 @@ def create_config():
             "Recommended: 30",
         ]
     )
-    config["fps"] = int(input("(int) FPS of the Output Video:\n> "))
+    spec["fps"] = int(input("(int) FPS of the Output Video:\n> "))
     
     print_list(
         [
@@ -173,47 +147,16 @@ def create_config():
             'man, person, silhouette, human, 1boy, 2boys'
         ]
     )
-    config["salient_objects"] = []
+    spec["salient_objects"] = []
     for i in range(num_salient_objects):
         salient_object_tags = input(f"Salient Object Tags for Object {i+1}:\n> ").split(",")
         salient_object_tags = [
             tag.strip("\n").strip("'").strip('"').strip()
             for tag in salient_object_tags
         ]
-        config["salient_objects"].append(salient_object_tags)
-
-    for i in range(num_layers):
-        layers[i]["velocity"] = (
-            config["velocity_vector"][0]
-            * (1 / layers[i]["distance_ratio"])
-            * config["smoothness"],
-            config["velocity_vector"][1]
-            * (1 / layers[i]["distance_ratio"])
-            * config["smoothness"],
-        )
-        # Round to 1 decimal place
-        layers[i]["velocity"] = (
-            round(layers[i]["velocity"][0], 1),
-            round(layers[i]["velocity"][1], 1),
-        )
+        spec["salient_objects"].append(salient_object_tags)
 
-    # Each layer requires enough steps so that it can move the full distance of the image
-    # This is calculated by dividing the distance of the layer by the velocity of the layer
-    for i in range(num_layers):
-        if layers[i]["velocity"][0] == 0:
-            layers[i]["steps_x"] = 0
-        else:
-            layers[i]["steps_x"] = abs(
-                int(input_image.width / layers[i]["velocity"][0])
-            )
-        if layers[i]["velocity"][1] == 0:
-            layers[i]["steps_y"] = 0
-        else:
-            layers[i]["steps_y"] = abs(
-                int(input_image.height / layers[i]["velocity"][1])
-            )
-
-    config["max_steps"] = abs(max([layers[i]["steps_x"] for i in range(num_layers)]))
+    config = config_from_spec(spec)
 
     if input(f"\nRecommended steps/iterations: {config['max_steps']}. Use? (y/n): ") == "n":
         config["total_steps"] = int(input("(int) Enter the number of steps/iterations:\n> "))
@@ -229,5 +172,4 @@ def create_config():
     ])
     config["prompt_prepend"] = input("(str) Enter a prompt/description to prepend to each step (optional):\n> ")
 
-    config["layers"] = layers
     return config
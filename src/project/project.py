@@ -1,7 +1,5 @@
 import os
-import json
 from constants import (
-    PROJECT_DATA_REL_PATH,
     CONFIG_FILENAME,
     ORIGINAL_LAYERS_DIR,
     OUTPUT_VIDEO_PATH,
@@ -11,9 +9,14 @@ from constants import (
     CROPPED_STEPS_DIR,
     STITCHED_INPAINT_DIR,
     STITCHED_OBJECTS_DIR,
+    RENDER_SEGMENTS_DIR,
+    DEFAULT_LOG_LEVEL,
 )
 from .create_config import create_config
+from .project_spec import config_from_spec
+from .project_config import ProjectConfig
 from utils.check_make_dir import check_make_dir
+from utils.repo_paths import get_repo_root, get_projects_dir
 from interfaces.project_interface import ProjectInterface
 from parallax_video.video import ParallaxVideo
 from log.logging import Logger
@@ -28,24 +31,49 @@ class ParallaxProject(ProjectInterface):
     creating layer video clips, and generating the final parallax video.
     """
 
-    def __init__(self, project_name, author=None):
+    def __init__(
+        self,
+        project_name,
+        author=None,
+        spec: dict = None,
+        interactive: bool = None,
+        pipeline_options: dict = None,
+    ):
+        """
+        Args:
+            project_name (str): The name of the project.
+            author (str, optional): The author of the project. Defaults to the current user.
+            spec (dict, optional): A validated project spec (see project_spec.py). If given, a new
+                project's config is created from the spec instead of prompting for it.
+            interactive (bool, optional): Whether anything may prompt for input. Defaults to False
+                if a spec is given, True otherwise.
+            pipeline_options (dict, optional): Which stages to run (keyword arguments of ParallaxVideo).
+                Defaults to every stale stage.
+        """
         self.name = project_name
+        self.spec = spec
+        # A dry run (e.g. `main.py status`) only reads the project, so it doesn't bump the version
+        self.read_only = bool((pipeline_options or {}).get("dry_run"))
+        self.interactive = spec is None if interactive is None else interactive
         if not author:
             self.__set_author()
         else:
             self.author = author
 
-        self.repo_root = os.path.join(
-            os.path.dirname(__file__).split("infinite-parallax")[0], "infinite-parallax"
-        )
+        self.repo_root = get_repo_root()
         self.logger = Logger(self)
         self.init_project_structure()
+        self.logger.set_level(self.config_file().get("log_level", DEFAULT_LOG_LEVEL))
 
         if self.NEW_PROJECT:
             self.copy_input_image_to_project_dir()
             self.update_config("version", self.version)
+            self.save_config()
 
-        ParallaxVideo(self, self.logger)
+        try:
+            ParallaxVideo(self, self.logger, **(pipeline_options or {}))
+        finally:
+            self.logger.flush()
 
     def log(self, *args, **kwargs):
         self.logger.log(caller_prefix="PROJECT MANAGER", *args, **kwargs)
@@ -57,10 +85,10 @@ class ParallaxProject(ProjectInterface):
             pad_with_rules=True,
         )
         self.log("Repo root: ", f"{self.repo_root}")
-        self.project_dir_path = os.path.join(
-            self.repo_root, PROJECT_DATA_REL_PATH, self.name
-        )
+        self.project_dir_path = os.path.join(get_projects_dir(), self.name)
         self.log("Project dir path: ", f"{self.project_dir_path}")
+        self.config_path = os.path.join(self.project_dir_path, CONFIG_FILENAME)
+        self.config = ProjectConfig(self.config_path)
 
         if not check_make_dir(self.project_dir_path):
             self.log(
@@ -75,21 +103,29 @@ class ParallaxProject(ProjectInterface):
                 f"{self.project_dir_path}",
             )
             self.NEW_PROJECT = False
+            if self.spec:
+                self.log(
+                    "Project spec: The existing project's config is used,",
+                    "the spec is only used to create new projects",
+                )
 
         self.config_file()
         if not self.NEW_PROJECT:
-            self.version = self.config_file()["version"]
+            self.version = list(self.config_file()["version"])
+            if self.read_only:
+                return
             self.version[2] += 1
             self.update_config("version", self.version)
+        self.save_config()
 
     def set_config(self):
-        config = create_config()
+        # create_config prints and prompts directly
+        self.logger.flush()
+        config = config_from_spec(self.spec) if self.spec else create_config()
         config["project_dir_path"] = self.project_dir_path
         config["config_path"] = self.config_path
         config["project_name"] = self.name
-
-        with open(self.config_path, "w") as config_file:
-            json.dump(config, config_file, indent=4)
+        self.config.create(config)
 
     def copy_input_image_to_project_dir(self):
         config = self.config_file()
@@ -102,19 +138,15 @@ class ParallaxProject(ProjectInterface):
         self.update_config("input_image_path", input_image_dest_path)
 
     def update_config(self, key, value):
-        config = self.config_file()
-        config[key] = value
-        with open(self.config_path, "w") as config_file:
-            json.dump(config, config_file, indent=4)
+        self.config.set(key, value)
+
+    def save_config(self):
+        self.config.flush()
 
     def config_file(self):
-        path = os.path.join(self.project_dir_path, CONFIG_FILENAME)
-        self.config_path = path
-        if not os.path.exists(path):
+        if not self.config.exists():
             self.set_config()
-
-        with open(path, "r") as config_file:
-            return json.load(config_file)
+        return self.config.get()
 
     def workflow_dir(self):
         path = os.path.join(self.project_dir_path, PROJECT_WORKFLOW_DIR)
@@ -164,9 +196,15 @@ class ParallaxProject(ProjectInterface):
         # Add stitched objects logic
         return path
 
+    def render_segments_dir(self):
+        path = os.path.join(self.project_dir_path, RENDER_SEGMENTS_DIR)
+        check_make_dir(path)
+        # Add render segments logic
+        return path
+
     def __set_author(self):
         try:
-            self.author = os.getenv("USER")
+            self.author = os.getenv("USER") or os.getenv("USERNAME") or "unknown_user"
         except KeyError:
             # USER environment variable not set
             self.author = "windows_user"
@@ -0,0 +1,108 @@
+import os
+import copy
+import json
+import atexit
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+class ProjectConfig:
+    """
+    In-memory project config (config.json) with write-behind.
+
+    The file is parsed once, and reads return a deep copy of the cached dict, so changes to it
+    (e.g., version[2] += 1) never reach the cache without going through set(). set() only
+    updates the cached dict and marks the key dirty; flush() writes the dirty keys in one batch.
+    A flush holds an exclusive lock on a lock file next to the config, merges the dirty keys into
+    the config as it is on disk (so keys updated by another process in the meantime are kept),
+    and replaces the file atomically (temp file + rename), so the config on disk is never half
+    written.
+
+    Pending updates are also flushed when the interpreter exits.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.data = None
+        self.dirty_keys = set()
+        self.mutex = threading.RLock()
+        atexit.register(self.flush)
+
+    def exists(self) -> bool:
+        return self.data is not None or os.path.exists(self.path)
+
+    def get(self) -> dict:
+        """
+        Returns a copy of the config. Modifying it doesn't update the config, use set() for that.
+        """
+        with self.mutex:
+            return copy.deepcopy(self.__get_data())
+
+    def create(self, config: dict):
+        """Replaces the whole config and writes it immediately."""
+        with self.mutex:
+            self.data = copy.deepcopy(config)
+            self.dirty_keys = set(self.data)
+            self.flush()
+
+    def set(self, key: str, value):
+        with self.mutex:
+            # Copied, so later changes to the caller's value don't reach the cache unflushed either
+            self.__get_data()[key] = copy.deepcopy(value)
+            self.dirty_keys.add(key)
+
+    def flush(self):
+        """Writes the pending updates, if any."""
+        with self.mutex:
+            if not self.dirty_keys:
+                return
+            with self.__file_lock():
+                merged = self.__read() if os.path.exists(self.path) else {}
+                for key in self.dirty_keys:
+                    merged[key] = self.data[key]
+                temp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(temp_path, "w") as config_file:
+                    json.dump(merged, config_file, indent=4)
+                    config_file.flush()
+                    os.fsync(config_file.fileno())
+                os.replace(temp_path, self.path)
+
+            # Pick up the keys other processes updated
+            for key, value in merged.items():
+                if key not in self.dirty_keys:
+                    self.data[key] = value
+            self.dirty_keys.clear()
+
+    def __get_data(self) -> dict:
+        if self.data is None:
+            self.data = self.__read()
+        return self.data
+
+    def __read(self) -> dict:
+        with open(self.path, "r") as config_file:
+            return json.load(config_file)
+
+    @contextmanager
+    def __file_lock(self):
+        with open(self.lock_path, "a+") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,236 @@
+import os
+import json
+import math
+import time
+from PIL import Image
+
+
+SPEC_KEYS = {
+    "name": "(str, optional) Project name, defaults to the spec's filename",
+    "input_image": "(str) Input image path, relative to the spec file",
+    "direction": "(float) Direction of parallax in degrees, 0 is right, 90 is up",
+    "layers": "(list) Layers from top to bottom, each with a height (px) and a distance",
+    "smoothness": "(int) 1-100, more smoothness means more intermediate frames",
+    "seconds_per_step": "(int) Base speed of the final video",
+    "fps": "(int) FPS of the output video",
+    "salient_objects": "(list, optional) A list of tags for each salient object",
+    "prompt": "(str, optional) Description prepended to the prompt of each inpaint step",
+    "total_steps": "(int, optional) Number of inpaint steps, defaults to the recommended steps",
+    "options": "(dict, optional) Optional config keys, copied into the config as is",
+}
+
+
+def load_project_spec(spec_path: str) -> dict:
+    """
+    Loads and validates a declarative project spec (YAML or JSON).
+
+    Relative image paths in the spec are resolved relative to the spec file.
+
+    Args:
+        spec_path (str): Path to a .yaml/.yml or .json project spec.
+
+    Returns:
+        dict: The validated spec.
+
+    Raises:
+        ValueError: If the spec is invalid, with every problem found listed.
+    """
+    with open(spec_path, "r") as spec_file:
+        if spec_path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(
+                    "PyYAML is required for YAML project specs (pip install pyyaml), or use a JSON spec"
+                )
+            spec = yaml.safe_load(spec_file)
+        else:
+            spec = json.load(spec_file)
+
+    if not isinstance(spec, dict):
+        raise ValueError(f"Invalid project spec {spec_path}: Expected a mapping of keys")
+    spec.setdefault("name", os.path.splitext(os.path.basename(spec_path))[0])
+    if isinstance(spec.get("input_image"), str):
+        spec["input_image"] = os.path.join(
+            os.path.dirname(os.path.abspath(spec_path)),
+            os.path.expanduser(spec["input_image"]),
+        )
+
+    errors = validate_spec(spec)
+    if errors:
+        raise ValueError(
+            f"Invalid project spec {spec_path}:\n" + "\n".join(f"  - {e}" for e in errors)
+        )
+    return spec
+
+
+def validate_spec(spec: dict) -> list[str]:
+    """
+    Checks a project spec without running anything.
+
+    Returns:
+        list[str]: A description of every problem found, empty if the spec is valid.
+    """
+    errors = []
+    for key in spec:
+        if key not in SPEC_KEYS:
+            errors.append(f"Unknown key '{key}'. Known keys: {', '.join(SPEC_KEYS)}")
+
+    is_number = lambda value: isinstance(value, (int, float)) and not isinstance(value, bool)
+    is_int = lambda value: isinstance(value, int) and not isinstance(value, bool)
+
+    image_height = None
+    input_image = spec.get("input_image")
+    if not isinstance(input_image, str):
+        errors.append("'input_image' is required: " + SPEC_KEYS["input_image"])
+    else:
+        try:
+            with Image.open(input_image) as image:
+                image_height = image.height
+        except OSError as e:
+            errors.append(f"'input_image' could not be opened: {e}")
+
+    if not is_number(spec.get("direction")):
+        errors.append("'direction' is required: " + SPEC_KEYS["direction"])
+
+    layers = spec.get("layers")
+    if not isinstance(layers, list) or not layers:
+        errors.append("'layers' is required: " + SPEC_KEYS["layers"])
+    else:
+        for i, layer in enumerate(layers):
+            if not isinstance(layer, dict):
+                errors.append(f"Layer {i+1}: Expected a mapping with 'height' and 'distance'")
+                continue
+            unknown = set(layer) - {"height", "distance"}
+            if unknown:
+                errors.append(f"Layer {i+1}: Unknown keys {sorted(unknown)}")
+            # The last layer's height is the rest of the image
+            if i < len(layers) - 1 or "height" in layer:
+                if not is_int(layer.get("height")) or layer["height"] <= 0:
+                    errors.append(f"Layer {i+1}: 'height' must be a positive int (px)")
+            if not is_number(layer.get("distance")) or layer["distance"] <= 0:
+                errors.append(f"Layer {i+1}: 'distance' must be a positive number")
+        heights = [layer.get("height") for layer in layers if isinstance(layer, dict)]
+        if image_height and all(is_int(height) for height in heights[:-1]):
+            if sum(heights[:-1]) >= image_height:
+                errors.append(
+                    f"The layers above the last one are {sum(heights[:-1])}px high, "
+                    + f"the input image is only {image_height}px high"
+                )
+            elif is_int(heights[-1]) and sum(heights) != image_height:
+                errors.append(
+                    f"The layer heights add up to {sum(heights)}px, "
+                    + f"the input image is {image_height}px high (the last layer's height can be left out)"
+                )
+
+    smoothness = spec.get("smoothness")
+    if not is_int(smoothness) or not 1 <= smoothness <= 100:
+        errors.append("'smoothness' must be an int from 1 to 100")
+    for key in ("seconds_per_step", "fps"):
+        if not is_int(spec.get(key)) or spec[key] <= 0:
+            errors.append(f"'{key}' must be a positive int")
+    if "total_steps" in spec and (not is_int(spec["total_steps"]) or spec["total_steps"] <= 0):
+        errors.append("'total_steps' must be a positive int")
+
+    salient_objects = spec.get("salient_objects", [])
+    if not isinstance(salient_objects, list) or not all(
+        isinstance(tags, list) and tags and all(isinstance(tag, str) for tag in tags)
+        for tags in salient_objects
+    ):
+        errors.append("'salient_objects' must be a list of tag lists, e.g. [[building, dome]]")
+    if not isinstance(spec.get("prompt", ""), str):
+        errors.append("'prompt' must be a string")
+    if not isinstance(spec.get("options", {}), dict):
+        errors.append("'options' must be a mapping of optional config keys")
+    return errors
+
+
+def config_from_spec(spec: dict) -> dict:
+    """
+    Creates the configuration dictionary for the infinite parallax effect from a validated project spec.
+
+    Returns:
+        dict: The configuration dictionary, the same as create_config() creates.
+    """
+    config = {"created_at": time.ctime()}
+
+    config["original_input_image_path"] = spec["input_image"]
+    input_image = Image.open(spec["input_image"])
+    config["input_image_width"] = input_image.width
+    config["input_image_height"] = input_image.height
+
+    # convert to 0-360 form
+    direction = spec["direction"] % 360
+    direction_theta = math.radians(direction)
+    config["direction"] = direction
+    config["direction_theta"] = direction_theta
+    int_direction = int(direction)
+    if int_direction == 0:
+        config["velocity_vector"] = (1, 0)
+    elif int_direction == 180:
+        config["velocity_vector"] = (-1, 0)
+    elif int_direction == 90:
+        config["velocity_vector"] = (0, 1)
+    elif int_direction == 270:
+        config["velocity_vector"] = (0, -1)
+    else:
+        config["velocity_vector"] = (
+            math.cos(direction_theta),
+            math.sin(direction_theta),
+        )
+
+    layers = [
+        {"height": layer.get("height"), "distance": float(layer["distance"])}
+        for layer in spec["layers"]
+    ]
+    # The last layer covers the rest of the image
+    layers[-1]["height"] = int(
+        input_image.height - sum([layer["height"] for layer in layers[:-1]])
+    )
+    num_layers = len(layers)
+
+    # Convert distances to ratios
+    total_distance = sum([layer["distance"] for layer in layers])
+    for i in range(num_layers):
+        layers[i]["distance_ratio"] = layers[i]["distance"] / total_distance
+
+    config["smoothness"] = int(1000 / spec["smoothness"])
+    config["seconds_per_step"] = spec["seconds_per_step"]
+    config["fps"] = spec["fps"]
+    config["salient_objects"] = [
+        [tag.strip() for tag in tags] for tags in spec.get("salient_objects", [])
+    ]
+
+    for i in range(num_layers):
+        layers[i]["velocity"] = (
+            config["velocity_vector"][0]
+            * (1 / layers[i]["distance_ratio"])
+            * config["smoothness"],
+            config["velocity_vector"][1]
+            * (1 / layers[i]["distance_ratio"])
+            * config["smoothness"],
+        )
+        # Not rounded, the scheduler accumulates the exact velocity (see StepScheduler)
+
+    # Each layer requires enough steps so that it can move the full distance of the image
+    # This is calculated by dividing the distance of the layer by the velocity of the layer
+    for i in range(num_layers):
+        if layers[i]["velocity"][0] == 0:
+            layers[i]["steps_x"] = 0
+        else:
+            layers[i]["steps_x"] = abs(
+                int(input_image.width / layers[i]["velocity"][0])
+            )
+        if layers[i]["velocity"][1] == 0:
+            layers[i]["steps_y"] = 0
+        else:
+            layers[i]["steps_y"] = abs(
+                int(input_image.height / layers[i]["velocity"][1])
+            )
+
+    config["max_steps"] = abs(max([layers[i]["steps_x"] for i in range(num_layers)]))
+    config["total_steps"] = spec.get("total_steps", config["max_steps"])
+    config["prompt_prepend"] = spec.get("prompt", "")
+    config["layers"] = layers
+    config.update(spec.get("options", {}))
+    return config
@@ -0,0 +1,607 @@
+"""
+Benchmarks of the pipeline's hot paths on synthetic projects, on the CPU only (no ComfyUI).
+
+Each synthetic project is generated in a temporary dir: a textured input image cut into layers,
+a config derived from it the same way as from a project spec, and salient object alpha layers
+that are loaded from the config (as if they were already extracted). The step images are created
+by the layer shifter, with the shifted image taken as the inpainted image (the gaps stay black).
+
+Run from src/, e.g. a scaling curve over image width and steps:
+
+    python -m test.benchmark --widths 512 1024 2048 --steps 10 20 40
+    python -m test.benchmark --compare old.json new.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import numpy as np
+from PIL import Image
+from preprocessors.preprocess_step_input import LayerShifter
+from inpaint.step_scheduler import StepScheduler
+from layers.base import BaseLayer
+from layers.salient_object import SalientObjectLayer
+from layers.alpha_analysis import AlphaLayerAnalysis, binary_alpha_mask
+from comfy_api.server_manager import ComfyServerManager
+from parallax_video.compositor import NumpyCompositor
+from project.project_spec import config_from_spec
+from interfaces.project_interface import ProjectInterface
+from log.logging import Logger
+from utils.check_make_dir import check_make_dir
+from constants import (
+    VIDEO_CODEC,
+    GLOABL_LOGS_DIR,
+    LAYER_OUTPUT_DIR,
+    ORIGINAL_LAYERS_DIR,
+    SALIENT_OBJECTS_DIR,
+    PROJECT_WORKFLOW_DIR,
+    CROPPED_STEPS_DIR,
+    STITCHED_INPAINT_DIR,
+    STITCHED_OBJECTS_DIR,
+    OUTPUT_VIDEO_PATH,
+    RENDER_SEGMENTS_DIR,
+    SALIENT_OBJECTS_WORKFLOW_PATH,
+    SALIENT_OBJECT_ALPHA_LAYER_PREFIX,
+    BASE_LAYER_WITHOUT_OBJECTS_PREFIX,
+)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+BENCHMARK_RESULTS_DIR = os.path.join(REPO_ROOT, GLOABL_LOGS_DIR, "benchmarks")
+# Fast encoder settings, the render benchmark measures compositing and piping, not x264
+BENCHMARK_ENCODER_SETTINGS = {
+    "codec": VIDEO_CODEC,
+    "preset": "ultrafast",
+    "ffmpeg_params": ["-crf", "23", "-pix_fmt", "yuv420p"],
+    "threads": 4,
+}
+
+
+class SyntheticProject(ProjectInterface):
+    """A project whose config is kept in memory, with its dirs in a temporary dir."""
+
+    def __init__(self, root_dir: str, name: str):
+        self.name = name
+        self.version = [0, 1, 0]
+        self.author = "benchmark"
+        self.interactive = False
+        # The repo root only needs the salient object workflow template (and receives the logs)
+        self.repo_root = root_dir
+        self.project_dir_path = os.path.join(root_dir, name)
+        check_make_dir(self.project_dir_path)
+        template_path = os.path.join(self.repo_root, SALIENT_OBJECTS_WORKFLOW_PATH)
+        os.makedirs(os.path.dirname(template_path), exist_ok=True)
+        shutil.copy(os.path.join(REPO_ROOT, SALIENT_OBJECTS_WORKFLOW_PATH), template_path)
+        self.config = {}
+
+    def update_config(self, key, value):
+        self.config[key] = value
+
+    def save_config(self):
+        pass
+
+    def config_file(self):
+        return self.config
+
+    def workflow_dir(self):
+        return self.__get_dir(PROJECT_WORKFLOW_DIR)
+
+    def layer_outputs_dir(self):
+        return self.__get_dir(LAYER_OUTPUT_DIR)
+
+    def salient_objects_dir(self):
+        return self.__get_dir(SALIENT_OBJECTS_DIR)
+
+    def original_layers_dir(self):
+        return self.__get_dir(ORIGINAL_LAYERS_DIR)
+
+    def cropped_steps_dir(self):
+        return self.__get_dir(CROPPED_STEPS_DIR)
+
+    def stitched_inpainted_dir(self):
+        return self.__get_dir(STITCHED_INPAINT_DIR)
+
+    def output_video_dir(self):
+        return self.__get_dir(OUTPUT_VIDEO_PATH)
+
+    def stitched_objects_dir(self):
+        return self.__get_dir(STITCHED_OBJECTS_DIR)
+
+    def render_segments_dir(self):
+        return self.__get_dir(RENDER_SEGMENTS_DIR)
+
+    def __get_dir(self, rel_path):
+        path = os.path.join(self.project_dir_path, rel_path)
+        check_make_dir(path)
+        return path
+
+
+def create_synthetic_project(
+    root_dir: str,
+    width: int,
+    height: int,
+    n_layers: int,
+    total_steps: int,
+    n_objects: int,
+    velocities: list[float] = None,
+    fps: int = 24,
+    seed: int = 0,
+) -> SyntheticProject:
+    """
+    Generates a synthetic project.
+
+    Args:
+        root_dir (str): The dir to create the project in.
+        width (int): Width of the input image (px).
+        height (int): Height of the input image (px).
+        n_layers (int): Number of base layers, of equal height.
+        total_steps (int): Number of inpaint steps.
+        n_objects (int): Number of salient objects (ellipses) on the input image.
+        velocities (list[float], optional): x-velocity (px/step) of each layer, repeated if there are
+            fewer velocities than layers. Defaults to the velocities the layer distances give, like a spec.
+        fps (int, optional): FPS of the rendered video. Defaults to 24.
+        seed (int, optional): Seed of the image noise and the object positions. Defaults to 0.
+
+    Returns:
+        SyntheticProject: The project, with its input image, original layer slices and objects created.
+    """
+    rng = np.random.default_rng(seed)
+    project = SyntheticProject(
+        root_dir, f"bench_{width}x{height}_{n_layers}l_{total_steps}s_{n_objects}o"
+    )
+
+    # Smooth gradients plus noise, so PNG encoding costs about what it costs for a photo
+    x_gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    y_gradient = np.linspace(0, 255, height, dtype=np.float32)[:, None, None]
+    noise = rng.normal(0, 24, (height, width, 3)).astype(np.float32)
+    pixels = np.clip(
+        0.5 * x_gradient + 0.3 * y_gradient * np.array([1.0, 0.6, 0.2]) + noise, 0, 255
+    ).astype(np.uint8)
+    input_image_path = os.path.join(project.project_dir_path, "input.png")
+    Image.fromarray(pixels).save(input_image_path)
+
+    layer_height = height // n_layers
+    spec = {
+        "input_image": input_image_path,
+        "direction": 0,
+        "layers": [
+            {"height": layer_height, "distance": 10.0 * (index + 1)}
+            for index in range(n_layers - 1)
+        ]
+        + [{"distance": 10.0 * n_layers}],
+        "smoothness": 50,
+        "seconds_per_step": 1,
+        "fps": fps,
+        "total_steps": total_steps,
+    }
+    config = config_from_spec(spec)
+    if velocities:
+        for index, layer in enumerate(config["layers"]):
+            layer["velocity"] = (float(velocities[index % len(velocities)]), 0.0)
+    config.update(
+        {
+            "input_image_path": input_image_path,
+            "project_dir_path": project.project_dir_path,
+            "project_name": project.name,
+            "salient_objects": [[f"object_{index+1}"] for index in range(n_objects)],
+            "salient_object_layers": [],
+            "comfy_cache": False,
+        }
+    )
+    project.config = config
+
+    y = 0
+    for index, layer in enumerate(config["layers"]):
+        Image.fromarray(pixels[y : y + layer["height"]]).save(
+            os.path.join(project.original_layers_dir(), f"{index+1}_original_layer.png")
+        )
+        y += layer["height"]
+
+    breakpoints = [0]
+    for layer in config["layers"][:-1]:
+        breakpoints.append(breakpoints[-1] + layer["height"])
+    yy, xx = np.mgrid[0:height, 0:width]
+    for index in range(n_objects):
+        center_x, center_y = rng.uniform(0.2, 0.8) * width, rng.uniform(0.3, 0.8) * height
+        radius_x, radius_y = width / 12, height / 8
+        inside = ((xx - center_x) / radius_x) ** 2 + ((yy - center_y) / radius_y) ** 2 <= 1
+        alpha_layer = np.zeros((height, width, 4), dtype=np.uint8)
+        alpha_layer[inside, :3] = pixels[inside]
+        alpha_layer[inside, 3] = 255
+        alpha_layer_path = os.path.join(
+            project.salient_objects_dir(),
+            f"{SALIENT_OBJECT_ALPHA_LAYER_PREFIX}-{index+1}.png",
+        )
+        Image.fromarray(alpha_layer, "RGBA").save(alpha_layer_path)
+        base_layer_path = os.path.join(
+            project.project_dir_path,
+            f"{BASE_LAYER_WITHOUT_OBJECTS_PREFIX}-{index+1}_00001_.png",
+        )
+        shutil.copy(input_image_path, base_layer_path)
+
+        parent_layer_index = AlphaLayerAnalysis(alpha_layer_path).parent_layer_index(
+            breakpoints
+        )
+        config["salient_object_layers"].append(
+            {
+                "index": index,
+                "name_prefix": f"salient_object_{index+1}",
+                "prompt_tags": f"object_{index+1}",
+                "parent_layer_index": parent_layer_index,
+                "alpha_layer_fullpath": alpha_layer_path,
+                "base_layer_fullpath": base_layer_path,
+                "layer_height_breakpoints": breakpoints,
+                "layer_config": config["layers"][parent_layer_index],
+            }
+        )
+    return project
+
+
+def time_runs(run, repeat: int, calls: int = 1) -> dict:
+    """
+    Times a callable.
+
+    Args:
+        run (callable): Runs the benchmarked code once.
+        repeat (int): How many times to run it.
+        calls (int, optional): How many calls of the hot path one run makes, for the per-call time.
+
+    Returns:
+        dict: The time of each run, their min and median (s), and the min per call (ms).
+    """
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        runs.append(time.perf_counter() - start)
+    return {
+        "calls": calls,
+        "runs_s": [round(seconds, 6) for seconds in runs],
+        "min_s": round(min(runs), 6),
+        "median_s": round(statistics.median(runs), 6),
+        "min_per_call_ms": round(1000 * min(runs) / max(calls, 1), 4),
+    }
+
+
+class HotPathBenchmark:
+    """Times the pipeline's hot paths, each in isolation, on a synthetic project."""
+
+    def __init__(self, project: SyntheticProject, logger: Logger, repeat: int, render: bool):
+        self.project = project
+        self.logger = logger
+        self.repeat = repeat
+        self.render = render
+        self.scheduler = StepScheduler(self.project, self.logger)
+        self.server_manager = ComfyServerManager(self.project, self.logger)
+        self.timings = {}
+
+    def run(self) -> dict:
+        """Runs every benchmark, in pipeline order (each one needs the files of the one before)."""
+        self.bench_shift()
+        self.bench_crop_and_stitch()
+        self.bench_alpha_masks()
+        self.bench_make_frame()
+        if self.render:
+            self.bench_render()
+        return self.timings
+
+    def bench_shift(self):
+        n_steps = self.scheduler.n_steps()
+        input_image = Image.open(self.project.config_file()["input_image_path"]).convert("RGB")
+
+        def shift_all_steps():
+            shifter = LayerShifter(self.project, self.logger, self.scheduler)
+            image = input_image
+            for _ in range(n_steps):
+                canvas, _ = shifter.create_shifted_canvas(image)
+                image = canvas.convert("RGB")
+
+        self.timings["layer_shifter.create_shifted_image"] = time_runs(
+            shift_all_steps, self.repeat, n_steps
+        )
+
+        # The shift alone, without saving the layer slices and the shifted image
+        image_array = np.asarray(input_image)
+
+        def shift_arrays():
+            shifter = LayerShifter(self.project, self.logger, self.scheduler)
+            for _ in range(n_steps):
+                shifter.shift(image_array)
+                shifter.step_count += 1
+
+        self.timings["layer_shifter.shift"] = time_runs(shift_arrays, self.repeat, n_steps)
+
+    def bench_crop_and_stitch(self):
+        layers = self.__create_base_layers()
+        n_steps = self.scheduler.n_steps()
+        self.timings["base_layer.create_cropped_steps"] = time_runs(
+            lambda: [layer.create_cropped_steps() for layer in layers],
+            self.repeat,
+            n_steps * len(layers),
+        )
+        self.timings["base_layer.stitch_cropped_steps"] = time_runs(
+            lambda: [layer.stitch_cropped_steps() for layer in layers],
+            self.repeat,
+            len(layers),
+        )
+        for layer in layers:
+            layer.get_stitched_fullpath()
+
+        object_layers = self.__create_object_layers()
+        for layer in object_layers:
+            layer.create_cropped_steps()
+            layer.stitch_cropped_steps()
+            layer.get_stitched_fullpath()
+
+    def bench_alpha_masks(self):
+        object_configs = self.project.config_file()["salient_object_layers"]
+        if not object_configs:
+            return
+
+        def analyze_alpha_layers():
+            for object_config in object_configs:
+                # Analyze from scratch instead of loading the cached analysis
+                cache_path = (
+                    os.path.splitext(object_config["alpha_layer_fullpath"])[0]
+                    + "-alpha_analysis.npz"
+                )
+                if os.path.exists(cache_path):
+                    os.remove(cache_path)
+                AlphaLayerAnalysis(object_config["alpha_layer_fullpath"])
+
+        self.timings["alpha_analysis.analyze"] = time_runs(
+            analyze_alpha_layers, self.repeat, len(object_configs)
+        )
+
+        object_layers = self.__create_object_layers()
+        for layer in object_layers:
+            layer.load_stitched_panorama()
+        offsets = self.__get_sample_offsets()
+
+        def build_masks():
+            for layer in object_layers:
+                for x in offsets:
+                    binary_alpha_mask(layer.get_panorama().window(x, layer.output_vid_width))
+
+        self.timings["salient_object.alpha_mask"] = time_runs(
+            build_masks, self.repeat, len(offsets) * len(object_layers)
+        )
+
+    def bench_make_frame(self):
+        layers = self.__create_base_layers() + self.__create_object_layers()
+        for layer in layers:
+            layer.load_stitched_panorama()
+        clips = [layer.create_layer_videoclip() for layer in layers]
+        times = self.__get_sample_times()
+
+        self.timings["videoclip.make_frame"] = time_runs(
+            lambda: [clip.get_frame(t) for clip in clips for t in times],
+            self.repeat,
+            len(times) * len(clips),
+        )
+
+    def bench_render(self):
+        base_layers = self.__create_base_layers()
+        object_layers = self.__create_object_layers()
+        for layer in base_layers + object_layers:
+            layer.load_stitched_panorama()
+        input_image = Image.open(self.project.config_file()["input_image_path"])
+        compositor = NumpyCompositor(
+            self.project,
+            self.logger,
+            base_layers,
+            object_layers,
+            input_image.size,
+            self.project.config_file()["fps"],
+        )
+        n_frames = compositor.n_frames()
+
+        self.timings["compositor.compose_frame"] = time_runs(
+            lambda: [compositor.compose_frame(index) for index in range(n_frames)],
+            self.repeat,
+            n_frames,
+        )
+        output_path = os.path.join(self.project.output_video_dir(), "benchmark.mp4")
+        self.timings["render.numpy"] = time_runs(
+            lambda: compositor.render_frames(
+                range(n_frames),
+                output_path,
+                os.path.join(self.project.output_video_dir(), "ffmpeg.log"),
+                show_progress=False,
+                **BENCHMARK_ENCODER_SETTINGS,
+            ),
+            self.repeat,
+            n_frames,
+        )
+
+    def __create_base_layers(self) -> list[BaseLayer]:
+        return [
+            BaseLayer(
+                self.project,
+                self.logger,
+                layer_config,
+                f"layer_{index+1}",
+                index + 1,
+                self.scheduler,
+            )
+            for index, layer_config in enumerate(self.project.config_file()["layers"])
+        ]
+
+    def __create_object_layers(self) -> list[SalientObjectLayer]:
+        return [
+            SalientObjectLayer(self.project, self.logger, tags, index, self.server_manager)
+            for index, tags in enumerate(self.project.config_file()["salient_objects"])
+        ]
+
+    def __get_sample_times(self) -> list[float]:
+        # Mid-frame times of up to 100 frames spread over the video
+        config = self.project.config_file()
+        duration = config["total_steps"] * config["seconds_per_step"]
+        n_frames = int(duration * config["fps"])
+        return [
+            (frame + 0.5) / config["fps"]
+            for frame in range(0, n_frames, max(1, n_frames // 100))
+        ]
+
+    def __get_sample_offsets(self) -> list[int]:
+        config = self.project.config_file()
+        duration = config["total_steps"] * config["seconds_per_step"]
+        return [
+            round(abs(config["layers"][0]["velocity"][0]) * config["total_steps"] * t / duration)
+            for t in self.__get_sample_times()
+        ]
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args) -> dict:
+    results = {
+        "commit": get_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "cases": [],
+    }
+    root_dir = tempfile.mkdtemp(prefix="parallax_benchmark_")
+    try:
+        for width in args.widths:
+            for total_steps in args.steps:
+                case = {
+                    "width": width,
+                    "height": args.height,
+                    "layers": args.layers,
+                    "total_steps": total_steps,
+                    "objects": args.objects,
+                    "velocities": args.velocities,
+                }
+                print(f"Benchmarking: {case}")
+                project = create_synthetic_project(
+                    root_dir,
+                    width,
+                    args.height,
+                    args.layers,
+                    total_steps,
+                    args.objects,
+                    args.velocities,
+                    args.fps,
+                )
+                logger = Logger(project)
+                logger.set_level("warning")
+                case["layer_velocities"] = [
+                    layer["velocity"][0] for layer in project.config_file()["layers"]
+                ]
+                case["timings"] = HotPathBenchmark(
+                    project, logger, args.repeat, not args.no_render
+                ).run()
+                logger.close()
+                results["cases"].append(case)
+                shutil.rmtree(project.project_dir_path)
+    finally:
+        shutil.rmtree(root_dir, ignore_errors=True)
+    return results
+
+
+def print_results(results: dict):
+    for case in results["cases"]:
+        print(
+            f"\nwidth {case['width']}, {case['total_steps']} steps, {case['layers']} layers, "
+            + f"{case['objects']} objects"
+        )
+        for name, timing in case["timings"].items():
+            print(
+                f"  {name:<40} {timing['min_s']:>10.4f} s {timing['min_per_call_ms']:>12.4f} ms/call"
+            )
+
+
+def compare_results(old: dict, new: dict):
+    """Prints the min times of the cases and hot paths two results have in common, and their ratio."""
+    print(f"Comparing {old.get('commit')} (old) to {new.get('commit')} (new)")
+    case_key = lambda case: (
+        case["width"],
+        case["height"],
+        case["layers"],
+        case["total_steps"],
+        case["objects"],
+    )
+    old_cases = {case_key(case): case for case in old["cases"]}
+    for case in new["cases"]:
+        old_case = old_cases.get(case_key(case))
+        if not old_case:
+            continue
+        print(f"\nwidth {case['width']}, {case['total_steps']} steps")
+        for name, timing in case["timings"].items():
+            if name not in old_case["timings"]:
+                continue
+            old_s = old_case["timings"][name]["min_s"]
+            print(
+                f"  {name:<40} {old_s:>10.4f} s {timing['min_s']:>10.4f} s "
+                + f"{old_s / timing['min_s'] if timing['min_s'] else float('inf'):>8.2f}x"
+            )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline's hot paths on synthetic projects (CPU only)"
+    )
+    parser.add_argument("--widths", type=int, nargs="+", default=[512, 1024])
+    parser.add_argument("--height", type=int, default=384)
+    parser.add_argument("--steps", type=int, nargs="+", default=[10, 20])
+    parser.add_argument("--layers", type=int, default=3)
+    parser.add_argument("--objects", type=int, default=1)
+    parser.add_argument(
+        "--velocities",
+        type=float,
+        nargs="+",
+        help="x-velocity (px/step) of each layer, defaults to the velocities the layer distances give",
+    )
+    parser.add_argument("--fps", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-render", action="store_true", help="Skip the full render benchmark")
+    parser.add_argument(
+        "--output", help=f"Results JSON path, defaults to a new file in {BENCHMARK_RESULTS_DIR}"
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="Compare two results files instead of running the benchmarks",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.compare:
+        with open(args.compare[0], "r") as old_file, open(args.compare[1], "r") as new_file:
+            compare_results(json.load(old_file), json.load(new_file))
+        sys.exit(0)
+
+    results = run_benchmarks(args)
+    print_results(results)
+    output_path = args.output or os.path.join(
+        BENCHMARK_RESULTS_DIR,
+        f"benchmark-{results['commit'] or 'nocommit'}-{time.strftime('%Y%m%d-%H%M%S')}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as output_file:
+        json.dump(results, output_file, indent=4)
+    print(f"\nResults saved to: {output_path}")
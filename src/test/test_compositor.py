@@ -0,0 +1,64 @@
+import time
+import numpy as np
+from parallax_video.compositor import NumpyCompositor
+from parallax_video.frame_profiler import FrameProfiler
+from utils.panorama import TiledPanorama
+
+FPS = 10
+WIDTH = 64
+HEIGHT = 32
+PANORAMA_WIDTH = 4096
+
+
+class StubLayer:
+    """Layer that scrolls over a panorama at a constant velocity."""
+
+    def __init__(self, panorama: TiledPanorama, velocity: int, duration: float = 2.0):
+        self.panorama = panorama
+        self.velocity = velocity
+        self.duration = duration
+
+    def get_panorama(self):
+        return self.panorama
+
+    def get_x_offset(self, t: float) -> int:
+        return int(self.velocity * t)
+
+    def get_final_layer_height(self) -> int:
+        return self.panorama.height
+
+
+def create_panorama(channels: int, fill) -> TiledPanorama:
+    panorama = TiledPanorama(HEIGHT, PANORAMA_WIDTH, channels)
+    tile = np.zeros((HEIGHT, PANORAMA_WIDTH, channels), dtype=np.uint8)
+    fill(tile)
+    panorama.add_tile(tile, 0)
+    return panorama
+
+
+def fill_object(tile: np.ndarray):
+    # An opaque object far enough right that the first frames don't overlap it
+    tile[8:24, 2000:2400] = (255, 0, 0, 255)
+
+
+def test_composite_samples_are_durations():
+    base_layer = StubLayer(create_panorama(3, lambda tile: tile.fill(100)), velocity=40)
+    object_layer = StubLayer(create_panorama(4, fill_object), velocity=1200)
+    profiler = FrameProfiler(FPS)
+    compositor = NumpyCompositor(
+        None, None, [base_layer], [object_layer], (WIDTH, HEIGHT), FPS, profiler
+    )
+
+    time_before = time.perf_counter()
+    overlapping_frames = 0
+    for frame_index in range(compositor.n_frames()):
+        frame = compositor.compose_frame(frame_index)
+        overlapping_frames += int((frame == (255, 0, 0)).all(axis=2).any())
+    elapsed = time.perf_counter() - time_before
+
+    # The frames with the object in view are the ones a column index could leak into
+    assert overlapping_frames > 0
+    frames, durations = profiler.samples["composite"]
+    assert frames == list(range(compositor.n_frames()))
+    assert all(0 <= duration <= elapsed for duration in durations)
+    assert all(0 <= duration <= elapsed for duration in profiler.samples["layer_1 frame"][1])
@@ -1 +1,60 @@
-""""""
\ No newline at end of file
+import itertools
+import numpy as np
+from preprocessors.preprocess_step_input import shift_layers
+
+HEIGHT = 12
+WIDTH = 16
+LAYER_ROWS = [(0, 4), (4, 9), (9, 12)]
+# Left/up, none and right/down, including shifts past the canvas's edges
+OFFSETS = [-WIDTH - 1, -5, -1, 0, 1, 5, WIDTH + 1]
+
+
+def reference_shift(image, layer_rows, shifts):
+    """Places every pixel of every layer one by one, from the top layer to the bottom one."""
+    canvas = np.zeros((HEIGHT, WIDTH, 4), dtype=np.uint8)
+    for (top, bottom), (dx, dy) in zip(layer_rows, shifts):
+        for y in range(top, bottom):
+            for x in range(WIDTH):
+                if 0 <= y + dy < HEIGHT and 0 <= x + dx < WIDTH:
+                    canvas[y + dy, x + dx] = image[y, x]
+    return canvas
+
+
+def test_shift_layers_full_vector_range():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (HEIGHT, WIDTH, 4), dtype=np.uint8)
+    image[:, :, 3] = 255
+    canvas = np.empty((HEIGHT, WIDTH, 4), dtype=np.uint8)
+    gap_mask = np.empty((HEIGHT, WIDTH), dtype=bool)
+
+    for dx, dy in itertools.product(OFFSETS, OFFSETS):
+        # Every layer moves differently, the middle one in the opposite direction
+        shifts = [(dx, dy), (-dx, -dy), (dx // 2, 0)]
+        shift_layers(image, LAYER_ROWS, shifts, canvas, gap_mask)
+        expected = reference_shift(image, LAYER_ROWS, shifts)
+        assert np.array_equal(canvas, expected), f"shifts {shifts}"
+        assert np.array_equal(gap_mask, expected[:, :, 3] == 0), f"shifts {shifts}"
+
+
+def test_shift_layers_reuses_buffers():
+    image = np.full((HEIGHT, WIDTH, 4), 255, dtype=np.uint8)
+    canvas = np.empty((HEIGHT, WIDTH, 4), dtype=np.uint8)
+    gap_mask = np.empty((HEIGHT, WIDTH), dtype=bool)
+
+    shift_layers(image, LAYER_ROWS, [(5, 0)] * 3, canvas, gap_mask)
+    shift_layers(image, LAYER_ROWS, [(-3, 0)] * 3, canvas, gap_mask)
+    # Nothing is left over from the first shift
+    assert not canvas[:, WIDTH - 3 :].any()
+    assert gap_mask[:, WIDTH - 3 :].all()
+    assert not gap_mask[:, : WIDTH - 3].any()
+
+
+def test_shift_layers_keeps_input_transparency():
+    image = np.full((HEIGHT, WIDTH, 4), 255, dtype=np.uint8)
+    image[0, 0, 3] = 0
+    canvas = np.empty((HEIGHT, WIDTH, 4), dtype=np.uint8)
+    gap_mask = np.empty((HEIGHT, WIDTH), dtype=bool)
+
+    shift_layers(image, LAYER_ROWS, [(2, 0)] * 3, canvas, gap_mask, opaque=False)
+    assert gap_mask[0, 2] and not gap_mask[0, 3]
+    assert gap_mask[:, :2].all()
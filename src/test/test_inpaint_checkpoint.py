@@ -0,0 +1,92 @@
+import os
+import json
+import pytest
+from PIL import Image, ImageChops
+from inpaint.checkpoint import InpaintCheckpoint
+
+N_STEPS = 4
+
+
+class StubProject:
+    def __init__(self, project_dir_path):
+        self.project_dir_path = project_dir_path
+        self.config = {
+            "input_image_path": os.path.join(project_dir_path, "input.png"),
+            "layers": [{"height": 8, "velocity": [2, 0]}],
+            "total_steps": N_STEPS,
+            "inpaint_backend": "opencv",
+        }
+
+    def config_file(self):
+        return self.config
+
+    def layer_outputs_dir(self):
+        return self.project_dir_path
+
+
+class StubLogger:
+    def log(self, *args, **kwargs):
+        pass
+
+
+def shift_canvas(source_image: Image.Image, step_count: int) -> Image.Image:
+    """Stand-in for LayerShifter.recreate_shifted_canvas, different for every step count."""
+    return ImageChops.offset(source_image.convert("RGBA"), step_count, 0)
+
+
+def inpaint(input_image: Image.Image) -> Image.Image:
+    return ImageChops.invert(input_image.convert("RGB"))
+
+
+@pytest.fixture
+def project(tmp_path):
+    """A project whose inpaint loop recorded N_STEPS steps, the way InpaintLooper does."""
+    project = StubProject(str(tmp_path))
+    # Varies along x, so that shifting it changes it
+    input_image = Image.linear_gradient("L").transpose(Image.Transpose.ROTATE_90)
+    input_image.resize((16, 8)).convert("RGB").save(project.config["input_image_path"])
+    checkpoint = InpaintCheckpoint(project, StubLogger(), N_STEPS)
+    step_count = 1
+    source_image = Image.open(project.config["input_image_path"])
+    for step in range(1, N_STEPS + 1):
+        source_image.save(os.path.join(project.project_dir_path, f"layer_1_{step:05d}_.png"))
+        input_image = shift_canvas(source_image, step_count)
+        step_count += 1
+        end_image = inpaint(input_image)
+        end_image.save(checkpoint.get_end_image_path(step))
+        checkpoint.record_step(step, input_image, end_image, step_count)
+        source_image = end_image
+    return project
+
+
+def get_resume_step(project) -> int:
+    return InpaintCheckpoint(project, StubLogger(), N_STEPS).get_resume_step(shift_canvas)
+
+
+def test_resumes_after_last_step(project):
+    assert get_resume_step(project) == N_STEPS
+
+
+def test_changed_output_moves_resume_step_back(project):
+    checkpoint = InpaintCheckpoint(project, StubLogger(), N_STEPS)
+    Image.new("RGB", (16, 8), "red").save(checkpoint.get_end_image_path(3))
+    # Step 3's output is also step 4's source, so neither can be resumed after
+    assert get_resume_step(project) == 2
+
+
+def test_changed_input_moves_resume_step_back(project):
+    manifest_path = InpaintCheckpoint(project, StubLogger(), N_STEPS).manifest_path
+    with open(manifest_path, "r") as manifest_file:
+        manifest = json.load(manifest_file)
+    manifest["steps"][N_STEPS - 1]["input_hash"] = "0" * 40
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    assert get_resume_step(project) == N_STEPS - 1
+
+
+def test_changed_shift_moves_resume_step_back(project):
+    def shift_last_step_differently(source_image, step_count):
+        return shift_canvas(source_image, step_count + (step_count == N_STEPS))
+
+    checkpoint = InpaintCheckpoint(project, StubLogger(), N_STEPS)
+    assert checkpoint.get_resume_step(shift_last_step_differently) == N_STEPS - 1
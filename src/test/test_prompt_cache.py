@@ -0,0 +1,79 @@
+from comfy_api.server_manager import ComfyServerManager
+
+STAGE = "inpaint"
+
+
+class StubProject:
+    def __init__(self, repo_root, name):
+        self.repo_root = repo_root
+        self.name = name
+
+    def config_file(self):
+        return {}
+
+
+class StubLogger:
+    def log(self, *args, **kwargs):
+        pass
+
+
+class StubWorkflow:
+    """LoadImage -> SaveImage, routed the way the stages route them."""
+
+    filename = "stub_workflow.json"
+
+    def __init__(self, manager: ComfyServerManager, image_bytes: bytes):
+        self.workflow_dict = {
+            "1": {
+                "class_type": "LoadImage",
+                "inputs": {"image": manager.upload_input_bytes(image_bytes, "step.png", STAGE)},
+            },
+            "2": {
+                "class_type": "SaveImage",
+                "inputs": {
+                    "images": ["1", 0],
+                    "filename_prefix": f"{manager.stage_subfolder(STAGE)}/end_step",
+                },
+            },
+        }
+
+    def get_workflow_dict(self):
+        return self.workflow_dict
+
+    def get_node_id(self, node_name):
+        return "2"
+
+
+def test_projects_with_same_inputs_share_keys(tmp_path):
+    manager_a = ComfyServerManager(StubProject(str(tmp_path), "project-a"), StubLogger())
+    manager_b = ComfyServerManager(StubProject(str(tmp_path), "project-b"), StubLogger())
+    assert manager_a.cache_key(StubWorkflow(manager_a, b"image")) == manager_b.cache_key(
+        StubWorkflow(manager_b, b"image")
+    )
+    assert manager_a.cache_key(StubWorkflow(manager_a, b"image")) != manager_b.cache_key(
+        StubWorkflow(manager_b, b"other image")
+    )
+
+
+def test_cached_outputs_are_served_to_other_projects(tmp_path):
+    manager_a = ComfyServerManager(StubProject(str(tmp_path), "project-a"), StubLogger())
+    workflow_a = StubWorkflow(manager_a, b"image")
+    outputs = {
+        "2": {
+            "images": [
+                {
+                    "filename": "end_step_00001_.png",
+                    "subfolder": manager_a.stage_subfolder(STAGE),
+                    "type": "output",
+                }
+            ]
+        }
+    }
+    manager_a.cache.put(manager_a.cache_key(workflow_a), outputs, {("2", 0): b"end image"})
+
+    manager_b = ComfyServerManager(StubProject(str(tmp_path), "project-b"), StubLogger())
+    workflow_b = StubWorkflow(manager_b, b"image")
+    outputs_b = manager_b.run(workflow_b)
+    # Answered from project-a's entry, without starting a server
+    assert manager_b.session is None
+    assert manager_b.fetch_output(outputs_b, workflow_b, "SaveImage") == b"end image"
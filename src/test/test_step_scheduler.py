@@ -0,0 +1,96 @@
+import itertools
+import pytest
+from inpaint.step_scheduler import StepScheduler, get_displacement
+from constants import FEATHERING_MARGIN
+
+TOTAL_STEPS = 50
+# Horizontal, vertical and diagonal, sub-pixel and fast, in both directions
+VELOCITIES = [
+    (13.3, 0),
+    (-0.37, 0),
+    (0, 3.3),
+    (0, -0.7),
+    (-2.6, 7.5),
+    (13.3, 0.4),
+    (4.25, -4.25),
+]
+
+
+class StubProject:
+    def __init__(self, config):
+        self.config = config
+
+    def config_file(self):
+        return self.config
+
+
+class StubLogger:
+    def __init__(self):
+        self.messages = []
+
+    def log(self, *args, **kwargs):
+        self.messages.append((" ".join(str(arg) for arg in args), kwargs.get("level", "info")))
+
+
+def create_scheduler(velocities, total_steps=TOTAL_STEPS, min_inpaint_gap=0):
+    config = {
+        "total_steps": total_steps,
+        "min_inpaint_gap": min_inpaint_gap,
+        "layers": [{"velocity": velocity} for velocity in velocities],
+    }
+    logger = StubLogger()
+    return StepScheduler(StubProject(config), logger), logger
+
+
+def get_total_shifts(scheduler, layer_index):
+    steps = range(scheduler.n_steps())
+    return (
+        sum(scheduler.get_x_shift(step, layer_index) for step in steps),
+        sum(scheduler.get_y_shift(step, layer_index) for step in steps),
+    )
+
+
+@pytest.mark.parametrize("min_inpaint_gap", [0, 10, 40])
+def test_shifts_add_up_to_exact_displacement(min_inpaint_gap):
+    scheduler, _ = create_scheduler(VELOCITIES, min_inpaint_gap=min_inpaint_gap)
+    for layer_index, (x_velocity, y_velocity) in enumerate(VELOCITIES):
+        assert get_total_shifts(scheduler, layer_index) == (
+            get_displacement(x_velocity, TOTAL_STEPS),
+            get_displacement(y_velocity, TOTAL_STEPS),
+        ), f"velocity {(x_velocity, y_velocity)}"
+
+
+@pytest.mark.parametrize("min_inpaint_gap", [0, 10])
+def test_horizontal_shifts_extend_the_panorama(min_inpaint_gap):
+    scheduler, _ = create_scheduler(VELOCITIES, min_inpaint_gap=min_inpaint_gap)
+    for step, layer_index in itertools.product(range(scheduler.n_steps()), range(len(VELOCITIES))):
+        shift = scheduler.get_x_shift(step, layer_index)
+        # Stitched strips overlap by the feathering margin
+        assert shift == 0 or abs(shift) > FEATHERING_MARGIN
+
+
+def test_vertical_layers_are_scheduled():
+    scheduler, _ = create_scheduler([(0, 3.3)])
+    assert scheduler.n_steps() > 0
+    assert all(scheduler.get_x_shift(step, 0) == 0 for step in range(scheduler.n_steps()))
+
+
+def test_min_inpaint_gap_reduces_steps():
+    without_gap, _ = create_scheduler(VELOCITIES)
+    with_gap, _ = create_scheduler(VELOCITIES, min_inpaint_gap=40)
+    assert with_gap.n_steps() < without_gap.n_steps()
+
+
+def test_too_slow_layer_is_reported():
+    # 0.04px per step moves 2px in total, narrower than one shift
+    scheduler, logger = create_scheduler([(0.04, 0), (10, 0)])
+    assert get_total_shifts(scheduler, 0) == (0, 0)
+    assert any(level == "warning" and "Layer 1" in message for message, level in logger.messages)
+
+
+def test_get_displacement_rounds_half_away_from_zero():
+    assert get_displacement(2.5, 1) == 3
+    assert get_displacement(-2.5, 1) == -3
+    assert get_displacement(0.1, 3) == 0
+    # The rounding error doesn't accumulate
+    assert get_displacement(0.37, 1000) == 370
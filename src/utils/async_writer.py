@@ -0,0 +1,64 @@
+import queue
+import threading
+from PIL import Image
+
+
+class AsyncImageWriter:
+    """
+    Writes images to disk in a background thread, for files that are only kept for archival
+    and are not read back during the run.
+
+    The queue is bounded, so if the disk can't keep up, write calls block instead of
+    buffering an unbounded number of images in memory.
+    """
+
+    def __init__(self, max_pending: int = 8):
+        self.__queue = queue.Queue(maxsize=max_pending)
+        self.__error = None
+        self.__thread = threading.Thread(target=self.__write_loop, daemon=True)
+        self.__thread.start()
+
+    def write_image(self, image: Image.Image, fullpath: str):
+        """Queues a PIL image to be saved. The image must not be modified after it is queued."""
+        self.__queue.put((image, fullpath))
+
+    def write_bytes(self, data: bytes, fullpath: str):
+        """Queues already encoded image bytes to be written as-is."""
+        self.__queue.put((data, fullpath))
+
+    def flush(self):
+        """
+        Waits until every queued image is written.
+
+        Raises:
+            IOError: If writing any of the images failed.
+        """
+        self.__queue.join()
+        if self.__error:
+            raise IOError(f"Async image write failed: {self.__error}") from self.__error
+
+    def close(self):
+        """Flushes and stops the writer thread."""
+        try:
+            self.flush()
+        finally:
+            self.__queue.put(None)
+            self.__thread.join()
+
+    def __write_loop(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                self.__queue.task_done()
+                return
+            data, fullpath = item
+            try:
+                if isinstance(data, Image.Image):
+                    data.save(fullpath)
+                else:
+                    with open(fullpath, "wb") as image_file:
+                        image_file.write(data)
+            except Exception as e:
+                self.__error = e
+            finally:
+                self.__queue.task_done()
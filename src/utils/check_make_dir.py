@@ -11,6 +11,7 @@ def check_make_dir(dir_path):
         bool: True if the directory already exists, False if it was created.
     """
     if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
+        # Another thread may create it in the meantime (e.g., concurrent stages)
+        os.makedirs(dir_path, exist_ok=True)
         return False
     return True
\ No newline at end of file
@@ -0,0 +1,260 @@
+from bisect import bisect_right
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from constants import PANORAMA_TILE_CACHE_SIZE
+
+
+def create_panorama(fullpath: str, height: int, width: int, channels: int) -> np.memmap:
+    """
+    Creates a zero-filled, writable, memory-mapped (height, width, channels) uint8 array
+    stored as a .npy file at the given path.
+
+    The array is stored column-major (Fortran order), so the columns of a window are contiguous
+    in the file (one run per channel) and reading a window only touches its own pages, instead
+    of a page of every row.
+
+    Args:
+        fullpath (str): The path of the .npy file to create (overwritten if it exists).
+        height (int): The height of the panorama in pixels.
+        width (int): The width of the panorama in pixels.
+        channels (int): The number of channels (3 for RGB, 4 for RGBA).
+
+    Returns:
+        np.memmap: The writable memory-mapped array.
+    """
+    return np.lib.format.open_memmap(
+        fullpath,
+        mode="w+",
+        dtype=np.uint8,
+        shape=(height, width, channels),
+        fortran_order=True,
+    )
+
+
+def load_panorama(fullpath: str) -> np.memmap:
+    """
+    Opens a panorama created with create_panorama as a read-only memory-mapped array.
+    Only the pages that are sliced are read from disk.
+
+    Args:
+        fullpath (str): The path of the .npy file.
+
+    Returns:
+        np.memmap: The read-only memory-mapped array.
+    """
+    return np.load(fullpath, mmap_mode="r")
+
+
+class MemmapPanorama:
+    """
+    Read-only panorama backed by a .npy file created with create_panorama.
+
+    Windows are read from the file into a reused buffer (one contiguous read per channel, as the
+    file is column-major), instead of through the memory map, so rendering keeps about one frame
+    of the panorama resident however far the video has scrolled. Panoramas stored row-major
+    (before they were stored column-major) are sliced through the memory map.
+    """
+
+    def __init__(self, fullpath: str):
+        self.fullpath = fullpath
+        self.array = load_panorama(fullpath)
+        self.height, self.width, self.channels = self.array.shape
+        self.column_major = np.isfortran(self.array)
+        self.__file = open(fullpath, "rb", buffering=0) if self.column_major else None
+        # (channels, window width, height), i.e. a window as stored in the file
+        self.__buffer = np.empty((self.channels, 0, self.height), dtype=np.uint8)
+
+    def covered_width(self) -> int:
+        return self.width
+
+    def window(self, x: int, width: int, out: np.ndarray = None) -> np.ndarray:
+        """
+        Returns the columns [x, x + width) of the panorama, clipped to the panorama's width.
+
+        Args:
+            x (int): The left edge of the window.
+            width (int): The width of the window.
+            out (np.ndarray, optional): A (height, >= width, channels) array to write the window into.
+
+        Returns:
+            np.ndarray: The window. A view into out if out is given.
+        """
+        if not self.column_major:
+            window = self.array[:, x : x + width]
+        else:
+            window = self.__read_columns(x, max(min(x + width, self.width) - x, 0))
+        if out is None:
+            return np.array(window)
+        out[:, : window.shape[1]] = window
+        return out[:, : window.shape[1]]
+
+    def __read_columns(self, x: int, width: int) -> np.ndarray:
+        if self.__buffer.shape[1] < width:
+            self.__buffer = np.empty((self.channels, width, self.height), dtype=np.uint8)
+        buffer = self.__buffer[:, :width]
+        if width == 0:
+            return buffer.transpose(2, 1, 0)
+        for channel in range(self.channels):
+            # Column x of a channel starts after the previous channels and the columns before it
+            self.__file.seek(self.array.offset + (channel * self.width + x) * self.height)
+            view = memoryview(buffer[channel]).cast("B")
+            n_read = 0
+            while n_read < len(view):
+                n_read += self.__file.readinto(view[n_read:])
+        return buffer.transpose(2, 1, 0)
+
+
+class TiledPanorama:
+    """
+    Virtual panorama made of an ordered list of tiles placed at increasing x-offsets,
+    instead of one canvas which every tile is pasted onto.
+
+    A tile covers the columns from its x-offset up to the x-offset of the next tile (the next
+    tile is pasted over the overlap, as with Image.paste), so the effective spans form a
+    prefix-sum index over the panorama. Any window is assembled from only the tiles that
+    overlap it. Columns which no tile covers are zeros (black, or transparent if RGBA).
+
+    Tiles can be image files, which are only read when a window needs them (the most recently
+    used ones are kept in memory), so the panorama's memory doesn't grow with its width. Tiles
+    taller than the panorama are cut off at the bottom, shorter ones are padded with zeros.
+    """
+
+    def __init__(self, height: int, width: int, channels: int):
+        self.height = height
+        self.width = width
+        self.channels = channels
+        # An array, an image file path, or None (empty)
+        self.__tiles = []
+        self.__starts = []
+        self.__widths = []
+        self.__cache = OrderedDict()
+
+    def add_tile(self, tile: np.ndarray, x: int) -> None:
+        """
+        Places a (tile_height, tile_width, channels) tile with its left edge at x.
+        Tiles must be added in order of increasing x.
+        """
+        self.__append(tile, x, None if tile is None else tile.shape[1])
+
+    def add_tile_file(self, fullpath: str, x: int, width: int = None) -> None:
+        """
+        Places the image file as a tile with its left edge at x, the file is only read when needed.
+        Tiles must be added in order of increasing x.
+
+        Args:
+            fullpath (str): The path of the tile image.
+            x (int): The left edge of the tile.
+            width (int, optional): The width of the image, read from its header if not given.
+        """
+        if width is None:
+            with Image.open(fullpath) as image:
+                width = image.width
+        self.__append(fullpath, x, width)
+
+    def add_transparent_tile(self, x: int) -> None:
+        """Marks the columns from x up to the next tile (or the end of the panorama) as empty."""
+        self.add_tile(None, x)
+
+    def __append(self, tile, x: int, width: int) -> None:
+        if self.__starts and x < self.__starts[-1]:
+            raise ValueError(
+                f"Tiles must be added left to right: {x} < {self.__starts[-1]}"
+            )
+        self.__tiles.append(tile)
+        self.__starts.append(x)
+        self.__widths.append(width)
+
+    def covered_width(self) -> int:
+        """The x-coordinate after which the panorama only contains empty columns."""
+        for index in range(len(self.__tiles) - 1, -1, -1):
+            if self.__tiles[index] is not None:
+                return self.__get_span(index)[1]
+        return 0
+
+    def window(self, x: int, width: int, out: np.ndarray = None) -> np.ndarray:
+        """
+        Assembles the columns [x, x + width) of the panorama, clipped to the panorama's width.
+
+        Args:
+            x (int): The left edge of the window.
+            width (int): The width of the window.
+            out (np.ndarray, optional): A (height, >= width, channels) array to write the window into.
+
+        Returns:
+            np.ndarray: The window. A view into out if out is given.
+        """
+        stop = min(x + width, self.width)
+        window_width = max(stop - x, 0)
+        if out is None:
+            out = np.zeros((self.height, window_width, self.channels), dtype=np.uint8)
+        window = out[:, :window_width]
+
+        filled_until = x
+        index = max(bisect_right(self.__starts, x) - 1, 0)
+        while index < len(self.__tiles) and self.__starts[index] < stop:
+            tile = self.__tiles[index]
+            tile_start, tile_stop = self.__get_span(index)
+            start, end = max(tile_start, x), min(tile_stop, stop)
+            if start < end:
+                # Zero any gap between the previous tile and this one
+                if start > filled_until:
+                    window[:, filled_until - x : start - x] = 0
+                self.__copy_tile(
+                    index, window[:, start - x : end - x], start - tile_start, end - tile_start
+                )
+                filled_until = max(filled_until, end)
+            index += 1
+
+        if filled_until < stop:
+            window[:, filled_until - x :] = 0
+        return window
+
+    def to_array(self) -> np.ndarray:
+        """Assembles the full panorama. Allocates the full (height, width, channels) canvas."""
+        return self.window(0, self.width)
+
+    def export_memmap(self, fullpath: str) -> None:
+        """Writes the panorama to a memory-mapped .npy file, one tile at a time."""
+        panorama = create_panorama(fullpath, self.height, self.width, self.channels)
+        for index, tile in enumerate(self.__tiles):
+            tile_start, tile_stop = self.__get_span(index)
+            if tile is not None and tile_start < tile_stop:
+                self.__copy_tile(index, panorama[:, tile_start:tile_stop], 0, tile_stop - tile_start)
+        panorama.flush()
+        del panorama
+
+    def __get_span(self, index: int) -> tuple[int, int]:
+        """The columns [start, stop) that the tile at index is visible in."""
+        start = self.__starts[index]
+        stop = self.width
+        if self.__tiles[index] is not None:
+            stop = min(stop, start + self.__widths[index])
+        if index + 1 < len(self.__starts):
+            stop = min(stop, self.__starts[index + 1])
+        return start, max(start, stop)
+
+    def __copy_tile(self, index: int, dest: np.ndarray, start: int, stop: int) -> None:
+        """Copies the columns [start, stop) of the tile at index into dest, fitted to the panorama's height."""
+        tile = self.__get_tile(index)
+        if tile is None:
+            dest[:] = 0
+            return
+        rows = min(tile.shape[0], self.height)
+        dest[:rows] = tile[:rows, start:stop, : self.channels]
+        if rows < self.height:
+            dest[rows:] = 0
+
+    def __get_tile(self, index: int):
+        tile = self.__tiles[index]
+        if not isinstance(tile, str):
+            return tile
+        if index in self.__cache:
+            self.__cache.move_to_end(index)
+            return self.__cache[index]
+        with Image.open(tile) as image:
+            array = np.asarray(image.convert("RGB" if self.channels == 3 else "RGBA"))
+        self.__cache[index] = array
+        if len(self.__cache) > PANORAMA_TILE_CACHE_SIZE:
+            self.__cache.popitem(last=False)
+        return array
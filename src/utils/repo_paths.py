@@ -0,0 +1,14 @@
+import os
+from constants import PROJECT_DATA_REL_PATH
+
+
+def get_repo_root():
+    """
+    Returns the repository's root directory (the parent of src/), whatever the checkout's directory is named.
+    """
+    return os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def get_projects_dir():
+    """Returns the directory the projects are stored in."""
+    return os.path.join(get_repo_root(), PROJECT_DATA_REL_PATH)
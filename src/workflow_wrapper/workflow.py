@@ -51,15 +51,7 @@ class ComfyAPIWorkflow:
                 Defaults to False.
             append (bool, optional): Whether to append the new value to the existing value.
         """
-        if node_name in self.__node_titles:
-            index = self.__node_titles[node_name]
-        elif node_name in self.__node_class_types:
-            index = self.__node_class_types[node_name]
-        else:
-            raise ValueError(
-                "Project Workflow Error:",
-                f"The node {node_name} does not exist in the provided template workflow",
-            )
+        index = self.get_node_id(node_name)
 
         if "image" in key.lower():
             print(
@@ -99,6 +91,17 @@ class ComfyAPIWorkflow:
         if save_after:
             self.save()
 
+    def get_node_id(self, node_name: str) -> str:
+        """Returns the ID of a node in the workflow dict, given either its title or class_type"""
+        if node_name in self.__node_titles:
+            return self.__node_titles[node_name]
+        if node_name in self.__node_class_types:
+            return self.__node_class_types[node_name]
+        raise ValueError(
+            "Project Workflow Error:",
+            f"The node {node_name} does not exist in the provided template workflow",
+        )
+
     def get_workflow_dict(self):
         return self.workflow_dict
 